@@ -0,0 +1,125 @@
+# bench_db.py
+"""
+بنچمارک کوئری‌های پرتکرار دیتابیس قبل و بعد از مایگریشن ایندکس‌ها (0001 --> head).
+
+    python bench_db.py                        # SQLite موقت با ۵۰۰ هزار خرید
+    python bench_db.py --purchases 100000
+    DATABASE_URL=postgresql://... python bench_db.py   # دیتابیس خالی مخصوص تست!
+
+دیتابیس تا revision 0001 (بدون ایندکس) ساخته و پر می‌شود، کوئری‌ها زمان‌گیری می‌شوند،
+سپس مایگریشن‌ها تا head اجرا و همان کوئری‌ها دوباره اندازه‌گیری می‌شوند.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+def seed(engine, users: int, purchases: int, payments: int, servers: int, inbounds_per_server: int):
+    from sqlalchemy import insert
+    from database.models import User, Server, Inbound, Plan, Purchase, Payment
+
+    rnd = random.Random(1)
+    now = datetime.now()
+    chunk = 20000
+
+    def insert_rows(model, rows):
+        with engine.begin() as conn:
+            for i in range(0, len(rows), chunk):
+                conn.execute(insert(model.__table__), rows[i:i + chunk])
+
+    insert_rows(User, [{'id': i, 'telegram_id': 10**9 + i, 'first_name': f"u{i}"} for i in range(1, users + 1)])
+    insert_rows(Server, [{'id': s, 'name': f"s{s}", 'panel_url': "http://p", 'username': "a", 'password': "a",
+                          'subscription_url': "http://sub"} for s in range(1, servers + 1)])
+    insert_rows(Inbound, [{'server_id': s, 'xui_id': x, 'remark': f"in{x}", 'port': 20000 + x, 'protocol': "vless"}
+                          for s in range(1, servers + 1) for x in range(1, inbounds_per_server + 1)])
+    insert_rows(Plan, [{'id': p, 'name': f"p{p}", 'price': 1, 'volume_gb': 10, 'duration_days': 30, 'limit_ip': 1}
+                       for p in range(1, 11)])
+    insert_rows(Purchase, [{
+        'user_id': rnd.randint(1, users), 'plan_id': rnd.randint(1, 10), 'uuid': f"{i:032x}",
+        'sub_link': f"http://sub/{i:016x}", 'expire_date': now + timedelta(hours=rnd.randint(-24 * 60, 24 * 60)),
+        'is_active': rnd.random() < 0.7,
+    } for i in range(purchases)])
+    insert_rows(Payment, [{
+        'user_id': rnd.randint(1, users), 'plan_id': rnd.randint(1, 10), 'amount': 1,
+        'status': "pending" if rnd.random() < 0.01 else rnd.choice(["approved", "rejected"]),
+    } for _ in range(payments)])
+
+
+def queries(users: int, servers: int, inbounds_per_server: int):
+    from sqlalchemy import select, func
+    from database.models import Purchase, Payment, Inbound
+
+    rnd = random.Random(2)
+    now = datetime.now()
+    return [
+        ("active purchases of a user",
+         lambda: select(Purchase).where(Purchase.user_id == rnd.randint(1, users), Purchase.is_active.is_(True))),
+        ("payments of a user",
+         lambda: select(Payment).where(Payment.user_id == rnd.randint(1, users))),
+        ("pending payments",
+         lambda: select(Payment).where(Payment.status == "pending").limit(50)),
+        ("purchases expiring in 24h",
+         lambda: select(func.count(Purchase.id)).where(Purchase.expire_date.between(now, now + timedelta(days=1)))),
+        ("inbound by (server_id, xui_id)",
+         lambda: select(Inbound).where(Inbound.server_id == rnd.randint(1, servers),
+                                       Inbound.xui_id == rnd.randint(1, inbounds_per_server))),
+    ]
+
+
+def measure(engine, stmt_factory, repeat: int) -> tuple:
+    timings = []
+    with engine.connect() as conn:
+        for _ in range(repeat):
+            stmt = stmt_factory()
+            start = time.perf_counter()
+            conn.execute(stmt).fetchall()
+            timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2] * 1000, timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="hot query benchmark before/after index migration")
+    parser.add_argument("--purchases", type=int, default=500000)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--payments", type=int, default=500000)
+    parser.add_argument("--servers", type=int, default=50)
+    parser.add_argument("--inbounds", type=int, default=100, help="inbounds per server")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    if "DATABASE_URL" not in os.environ:
+        os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench_db.db"
+    from database.base import engine, migrate
+
+    print(f"DB: {engine.url.render_as_string(hide_password=True)}")
+    migrate('0001')
+    start = time.perf_counter()
+    seed(engine, args.users, args.purchases, args.payments, args.servers, args.inbounds)
+    print(f"seeded {args.purchases} purchases / {args.payments} payments in {time.perf_counter() - start:.1f}s")
+    if engine.dialect.name == 'postgresql':
+        with engine.begin() as conn:
+            conn.exec_driver_sql("ANALYZE")
+
+    qs = queries(args.users, args.servers, args.inbounds)
+    before = [measure(engine, q, args.repeat) for _, q in qs]
+
+    start = time.perf_counter()
+    migrate('head')
+    print(f"migrated to head in {time.perf_counter() - start:.1f}s")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("ANALYZE")
+    after = [measure(engine, q, args.repeat) for _, q in qs]
+
+    print(f"\n{'query':<34}{'p50 before':>12}{'p50 after':>12}{'p99 before':>12}{'p99 after':>12}{'speedup':>9}")
+    for (name, _), (b50, b99), (a50, a99) in zip(qs, before, after):
+        print(f"{name:<34}{b50:>10.2f}ms{a50:>10.2f}ms{b99:>10.2f}ms{a99:>10.2f}ms{b50 / max(a50, 1e-6):>8.0f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
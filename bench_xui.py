@@ -0,0 +1,277 @@
+# bench_xui.py
+"""
+بنچمارک مسیرهای پرتکرار ارتباط با پنل (XUIClient، job ساخت سرویس، sync_server_inbounds)
+روی پنل شبیه‌سازی‌شده با تعداد مختلف اینباند و کلاینت.
+
+    python bench_xui.py                      # سناریوهای پیش‌فرض
+    python bench_xui.py --quick              # فقط سناریوی کوچک
+    python bench_xui.py --scenario 10x20000 --latency 0.01 --json out.json
+
+برای هر عملیات: تعداد درخواست به پنل، p50/p99 زمان و پیک حافظه (tracemalloc) گزارش می‌شود.
+پنل در یک پروسه جدا اجرا می‌شود تا حافظه و CPU آن در اعداد کلاینت حساب نشود.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+DEFAULT_SCENARIOS = ["1x1000", "10x10000", "100x50000"]
+
+
+# ==========================
+# پنل در پروسه جدا
+# ==========================
+def _panel_main(conn, kwargs):
+    from mock_panel import MockXUIPanel
+    panel = MockXUIPanel(**kwargs).start()
+    conn.send(panel.url)
+    while True:
+        cmd = conn.recv()
+        if cmd == "total":
+            conn.send(panel.total_requests)
+        elif cmd == "stop":
+            panel.stop()
+            conn.send(None)
+            return
+
+
+class PanelProcess:
+    def __init__(self, **kwargs):
+        ctx = multiprocessing.get_context("spawn")
+        self._conn, child = ctx.Pipe()
+        self._proc = ctx.Process(target=_panel_main, args=(child, kwargs), daemon=True)
+        self._proc.start()
+        self.url = self._conn.recv()
+        self.username = kwargs.get("username", "admin")
+        self.password = kwargs.get("password", "admin")
+
+    def total_requests(self) -> int:
+        self._conn.send("total")
+        return self._conn.recv()
+
+    def stop(self):
+        self._conn.send("stop")
+        self._conn.recv()
+        self._proc.join(5)
+
+
+# ==========================
+# ربات و callback ساختگی برای هندلرهای ادمین
+# ==========================
+class _Obj:
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def answer_callback_query(self, *args, **kwargs):
+        pass
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(text)
+
+    async def edit_message_text(self, text, *args, **kwargs):
+        self.sent.append(text)
+
+
+def fake_call(chat_id: int = 1):
+    return _Obj(id="bench", data="", message=_Obj(chat=_Obj(id=chat_id), message_id=1))
+
+
+# ==========================
+# اندازه‌گیری
+# ==========================
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def measure(panel, name: str, fn, repeat: int, setup=None) -> dict:
+    """
+    fn چند بار بدون tracemalloc زمان‌گیری می‌شود (tracemalloc کند است و زمان را خراب می‌کند)
+    و یک بار جدا برای پیک حافظه اجرا می‌شود.
+    """
+    timings, requests_used = [], []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        before = panel.total_requests()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+        requests_used.append(panel.total_requests() - before)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "op": name,
+        "runs": repeat,
+        "requests": sum(requests_used) / len(requests_used),
+        "p50_ms": percentile(timings, 50) * 1000,
+        "p99_ms": percentile(timings, 99) * 1000,
+        "peak_mb": peak / 1024 / 1024,
+    }
+
+
+# ==========================
+# سناریو
+# ==========================
+def run_scenario(inbounds: int, clients: int, latency: float, repeat: int) -> list:
+    from database.base import SessionLocal, init_db
+    from database.async_base import dispose_async_engine
+    from database.models import Server, Inbound, Plan, User, Payment
+    from services.xui import XUIClient, build_client, get_xui_client, invalidate_xui_client
+    from services.traffic_sync import sync_server_traffic
+    from services.xui_async import close_http_session, invalidate_async_xui_client
+    from handlers.admin import sync_server_inbounds
+    from handlers.payment_process import run_provision_job
+    from services.provision_queue import claim_job, enqueue_job
+
+    panel = PanelProcess(inbounds=inbounds, clients_per_inbound=clients // inbounds, latency=latency, seed=1)
+    results = []
+    session = SessionLocal()
+    # هندلرهای ربات coroutine هستند؛ همه روی یک event loop اجرا می‌شوند
+    loop = asyncio.new_event_loop()
+    try:
+        init_db()
+        server = Server(name=f"bench-{inbounds}x{clients}-{uuid.uuid4().hex[:6]}", panel_url=panel.url,
+                        username=panel.username, password=panel.password, subscription_url="http://sub.local/sub")
+        session.add(server)
+        session.commit()
+        server_id = server.id
+        bot = FakeBot()
+
+        # --- کلاینت پنل ---
+        cold = {}
+
+        def new_client():
+            cold["client"] = XUIClient(panel.url, panel.username, panel.password)
+
+        results.append(measure(panel, "login", lambda: cold["client"].login(), repeat, setup=new_client))
+
+        client = XUIClient(panel.url, panel.username, panel.password)
+        client.login()
+        inbound_ids = [i["id"] for i in client.get_inbounds()]
+        first = client.get_inbound(inbound_ids[0])
+        sample = json.loads(first["settings"])["clients"][len(json.loads(first["settings"])["clients"]) // 2]
+
+        results.append(measure(panel, "get_inbounds", client.get_inbounds, repeat))
+        results.append(measure(panel, "iter_inbounds", lambda: sum(1 for _ in client.iter_inbounds()), repeat))
+        results.append(measure(panel, "get_client_info (cold)",
+                               lambda: client.get_client_info(inbound_ids[0], sample["email"], fresh=True), repeat))
+        results.append(measure(panel, "get_client_info (warm)",
+                               lambda: client.get_client_info(inbound_ids[0], sample["email"]), repeat))
+
+        def add_one():
+            client.add_client(inbound_ids[0], f"b{uuid.uuid4().hex[:10]}", str(uuid.uuid4()), "bench")
+
+        results.append(measure(panel, "add_client", add_one, repeat))
+
+        def add_bulk():
+            batch = [build_client(f"b{uuid.uuid4().hex[:10]}", str(uuid.uuid4()), "bench") for _ in range(500)]
+            client.add_clients_bulk(inbound_ids[0], batch)
+
+        results.append(measure(panel, "add_clients_bulk (500)", add_bulk, repeat))
+        client.get_client_traffic(sample["id"])  # گرم کردن ایندکس
+        results.append(measure(panel, "update_client (warm)",
+                               lambda: client.update_client(sample["id"], {"enable": True}), repeat))
+
+        # --- هندلرها ---
+        results.append(measure(panel, "sync_server_inbounds",
+                               lambda: loop.run_until_complete(sync_server_inbounds(bot, fake_call(), server_id)),
+                               repeat))
+
+        user = User(telegram_id=int(time.time() * 1000), first_name="bench")
+        plan = Plan(name="bench", price=1, volume_gb=10, duration_days=30)
+        plan.inbounds = session.query(Inbound).filter_by(server_id=server_id).all()
+        session.add_all([user, plan])
+        session.flush()
+        payment = Payment(user_id=user.id, plan_id=plan.id, amount=1)
+        session.add(payment)
+        session.commit()
+
+        # مسیر تولید: تایید پرداخت یک job ثبت می‌کند و worker آن را با acreate_service اجرا می‌کند
+        def enqueue():
+            payment.status = "processing"
+            enqueue_job(session, payment.id)
+            session.commit()
+
+        async def claim_and_run():
+            job_id = await claim_job()
+            if job_id is None:
+                raise RuntimeError("no provision job to claim")
+            await run_provision_job(bot, job_id)
+            session.expire_all()
+            if session.get(Payment, payment.id).status != "approved":
+                raise RuntimeError(f"provision job {job_id} failed")
+
+        invalidate_async_xui_client(server_id)
+        results.append(measure(panel, f"provision job ({len(plan.inbounds)} inbounds)",
+                               lambda: loop.run_until_complete(claim_and_run()), repeat, setup=enqueue))
+        results.append(measure(panel, "sync_server_traffic",
+                               lambda: sync_server_traffic(session, session.get(Server, server_id)), repeat))
+    finally:
+        session.close()
+        if "server_id" in locals():
+            invalidate_xui_client(server_id)
+            invalidate_async_xui_client(server_id)
+        loop.run_until_complete(close_http_session())
+        loop.run_until_complete(dispose_async_engine())
+        loop.close()
+        panel.stop()
+    return results
+
+
+def print_table(title: str, rows: list):
+    print(f"\n=== {title} ===")
+    print(f"{'operation':<34}{'req/op':>8}{'p50 ms':>10}{'p99 ms':>10}{'peak MB':>10}")
+    for r in rows:
+        print(f"{r['op']:<34}{r['requests']:>8.1f}{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['peak_mb']:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="X-UI client / provisioning benchmark")
+    parser.add_argument("--scenario", action="append", help="INBOUNDSxCLIENTS, e.g. 10x10000 (repeatable)")
+    parser.add_argument("--quick", action="store_true", help="only the smallest scenario")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated panel latency per request (s)")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per operation")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    scenarios = args.scenario or (DEFAULT_SCENARIOS[:1] if args.quick else DEFAULT_SCENARIOS)
+
+    # دیتابیس موقت تا دیتابیس اصلی ربات دست نخورد
+    if "DATABASE_URL" not in os.environ:
+        os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+    os.environ.setdefault("TRAFFIC_SYNC_INTERVAL", "0")
+
+    report = {}
+    for spec in scenarios:
+        inbounds, clients = (int(x) for x in spec.lower().split("x"))
+        rows = run_scenario(inbounds, clients, args.latency, args.repeat)
+        print_table(f"{inbounds} inbounds / {clients} clients (latency {args.latency * 1000:.0f} ms)", rows)
+        report[spec] = rows
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
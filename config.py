@@ -10,10 +10,89 @@ ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x]
 # اگر دیتابیس پستگرس باشد آدرس آن، اگر نباشد SQLite ساخته می‌شود
 DB_URI = os.getenv("DATABASE_URL", "sqlite:///./vpn_bot.db")
 
+# تنظیمات موتور دیتابیس (بر اساس نوع دیتابیس انتخاب می‌شوند)
+# SQLite: حالت WAL (خواندن همزمان با نوشتن)، مدت انتظار برای قفل (میلی‌ثانیه) و سطح synchronous
+DB_SQLITE_WAL = os.getenv("DB_SQLITE_WAL", "1") == "1"
+DB_SQLITE_BUSY_TIMEOUT = int(os.getenv("DB_SQLITE_BUSY_TIMEOUT", "5000"))
+DB_SQLITE_SYNCHRONOUS = os.getenv("DB_SQLITE_SYNCHRONOUS", "NORMAL")
+# استخر اتصال (برای SQLite هر ترد اتصال جدای خودش را از استخر می‌گیرد)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+
+# حالت دریافت آپدیت‌ها: polling (پیش‌فرض) یا webhook
+# در حالت webhook ربات روی WEBHOOK_LISTEN:WEBHOOK_PORT (HTTP ساده، پشت nginx/TLS) گوش می‌دهد
+# و آدرس عمومی WEBHOOK_URL + WEBHOOK_PATH در تلگرام ثبت می‌شود
+# (هندلرها روی یک event loop اجرا می‌شوند؛ WEBHOOK_MAX_CONNECTIONS سقف اتصال همزمان تلگرام است
+# و WEBHOOK_CONCURRENCY سقف آپدیت‌هایی که همزمان پردازش می‌شوند؛ بیشتر از آن پاسخ webhook منتظر می‌ماند)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "40"))
+
 XUI_PANEL_URL = os.getenv("XUI_PANEL_URL")
 XUI_USERNAME = os.getenv("XUI_USERNAME")
 XUI_PASSWORD = os.getenv("XUI_PASSWORD")
 
+# ساخت همزمان کلاینت روی اینباندهای یک پلن
+# تعداد تردهای مشترک و سقف کل زمان انتظار (ثانیه) برای تایید یک پرداخت
+PROVISION_WORKERS = int(os.getenv("PROVISION_WORKERS", "8"))
+PROVISION_DEADLINE = float(os.getenv("PROVISION_DEADLINE", "40"))
+
+# صف ساخت سرویس بعد از تایید پرداخت (جدول provision_jobs)
+# تعداد workerها در هر پروسه، سقف تلاش، backoff بین تلاش‌ها (ثانیه)،
+# فاصله بررسی صف و مدتی که بعد از آن job در حال اجرای رهاشده (مثلاً با ری‌استارت) دوباره برداشته می‌شود
+PROVISION_JOB_WORKERS = int(os.getenv("PROVISION_JOB_WORKERS", "4"))
+PROVISION_JOB_RETRIES = int(os.getenv("PROVISION_JOB_RETRIES", "5"))
+PROVISION_JOB_BACKOFF = float(os.getenv("PROVISION_JOB_BACKOFF", "10"))
+PROVISION_JOB_BACKOFF_MAX = float(os.getenv("PROVISION_JOB_BACKOFF_MAX", "600"))
+PROVISION_JOB_POLL = float(os.getenv("PROVISION_JOB_POLL", "5"))
+PROVISION_JOB_LEASE = float(os.getenv("PROVISION_JOB_LEASE", "120"))
+
+# کلاینت async پنل‌ها: سقف کل اتصال‌ها، سقف اتصال به هر پنل و مدت keep-alive (ثانیه)
+XUI_ASYNC_LIMIT = int(os.getenv("XUI_ASYNC_LIMIT", "100"))
+XUI_ASYNC_LIMIT_PER_HOST = int(os.getenv("XUI_ASYNC_LIMIT_PER_HOST", "8"))
+XUI_ASYNC_KEEPALIVE = float(os.getenv("XUI_ASYNC_KEEPALIVE", "30"))
+
+# تلاش مجدد درخواست‌های پنل در خطاهای گذرا (backoff نمایی با jitter، ثانیه)
+XUI_RETRIES = int(os.getenv("XUI_RETRIES", "2"))
+XUI_BACKOFF_BASE = float(os.getenv("XUI_BACKOFF_BASE", "0.5"))
+XUI_BACKOFF_MAX = float(os.getenv("XUI_BACKOFF_MAX", "5"))
+
+# Circuit breaker پنل‌ها: تعداد خطای پشت‌سرهم، نرخ خطا در پنجره آخر،
+# مدت باز ماندن (ثانیه) و تاخیری که پنل را «کند» حساب می‌کند
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+BREAKER_SLOW_CALL = float(os.getenv("BREAKER_SLOW_CALL", "10"))
+
+# فاصله همگام‌سازی ترافیک کلاینت‌ها از پنل‌ها به دیتابیس (ثانیه، 0 = غیرفعال)
+TRAFFIC_SYNC_INTERVAL = int(os.getenv("TRAFFIC_SYNC_INTERVAL", "300"))
+
+# کش کاتالوگ پلن‌ها (ثانیه)؛ با ویرایش پلن توسط ادمین فوراً باطل می‌شود و این مقدار
+# فقط سقف کهنگی برای تغییراتی است که از بیرون این پروسه انجام شوند
+PLAN_CATALOG_TTL = int(os.getenv("PLAN_CATALOG_TTL", "300"))
+
+# کاربرانی که اخیراً /start زده‌اند (تعداد و مدت نگهداری به ثانیه) تا دوباره به دیتابیس نرویم
+SEEN_USERS_CACHE_SIZE = int(os.getenv("SEEN_USERS_CACHE_SIZE", "10000"))
+SEEN_USERS_CACHE_TTL = int(os.getenv("SEEN_USERS_CACHE_TTL", "3600"))
+
+# وضعیت ویزاردها (خرید کاربر و ویزاردهای ادمین): memory (داخل پروسه، LRU) یا db (جدول conversation_states؛
+# بعد از ری‌استارت می‌ماند و بین چند پروسه ربات مشترک است)، مدت اعتبار (ثانیه) و سقف تعداد در حالت memory
+STATE_STORE = os.getenv("STATE_STORE", "memory").lower()
+STATE_TTL = int(os.getenv("STATE_TTL", "1800"))
+STATE_CACHE_SIZE = int(os.getenv("STATE_CACHE_SIZE", "10000"))
+
+# مدت انتظار برای عکس فیش بعد از انتخاب پرداخت کارت به کارت (ثانیه؛ جدول pending_receipts)
+RECEIPT_WAIT_TTL = int(os.getenv("RECEIPT_WAIT_TTL", "86400"))
+
 # بررسی مقداردهی (اختیاری ولی مفید)
 if not XUI_PANEL_URL or not XUI_USERNAME or not XUI_PASSWORD:
     print("WARNING: X-UI credentials are missing in .env file!")
\ No newline at end of file
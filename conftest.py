@@ -0,0 +1,29 @@
+# conftest.py
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+
+from database.base import Base
+import database.models  # noqa: F401  (ثبت جداول روی Base.metadata)
+
+
+@pytest.fixture
+def async_db(tmp_path, monkeypatch):
+    """
+    دیتابیس SQLite موقت با همه جداول. خروجی تابعی است که AsyncSessionLocal ماژول‌های
+    داده‌شده را به این دیتابیس وصل می‌کند و session factory را برمی‌گرداند.
+    NullPool: هیچ اتصالی بعد از پایان asyncio.run یک تست به event loop آن بسته نمی‌ماند.
+    """
+    path = tmp_path / "test.db"
+    sync_engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(sync_engine)
+    sync_engine.dispose()
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}", poolclass=NullPool, connect_args={"timeout": 10})
+    factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    def bind(*modules):
+        for module in modules:
+            monkeypatch.setattr(module, "AsyncSessionLocal", factory)
+        return factory
+    return bind
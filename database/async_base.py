@@ -0,0 +1,52 @@
+# database/async_base.py
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from config import (DB_URI, DB_SQLITE_BUSY_TIMEOUT,
+                    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING)
+from database.base import set_sqlite_pragmas, upsert_stmt
+
+# درایور async هر دیتابیس (آدرس DATABASE_URL همان آدرس sync باقی می‌ماند)
+ASYNC_DRIVERS = {'postgresql': 'asyncpg', 'sqlite': 'aiosqlite'}
+
+def async_url(url: str):
+    """تبدیل آدرس sync (مثل postgresql+psycopg2://) به درایور async معادل"""
+    u = make_url(url)
+    backend = u.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise NotImplementedError(f"no async driver configured for {backend}")
+    return u.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+def make_async_engine(url: str):
+    """همان پروفایل‌های make_engine (database/base.py) برای موتور async"""
+    u = async_url(url)
+    if u.get_backend_name() != 'sqlite':
+        return create_async_engine(
+            u, echo=False,
+            pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=DB_POOL_PRE_PING,
+        )
+
+    memory = u.database in (None, '', ':memory:')
+    sqlite_engine = create_async_engine(u, echo=False, connect_args={'timeout': DB_SQLITE_BUSY_TIMEOUT / 1000})
+
+    @event.listens_for(sqlite_engine.sync_engine, 'connect')
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        set_sqlite_pragmas(dbapi_connection, memory)
+
+    return sqlite_engine
+
+# موتور و سشن async (جداول با init_db / مایگریشن‌ها ساخته می‌شوند)
+async_engine = make_async_engine(DB_URI)
+
+# expire_on_commit=False: بعد از commit آبجکت‌ها بدون کوئری lazy قابل استفاده می‌مانند
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+async def dispose_async_engine():
+    await async_engine.dispose()
+
+async def abulk_upsert(session, model, rows, conflict_cols, update_cols):
+    """نسخه async تابع bulk_upsert"""
+    if not rows:
+        return
+    await session.execute(upsert_stmt(session.bind.dialect.name, model, conflict_cols, update_cols), rows)
@@ -1,10 +1,49 @@
 # database/base.py
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, declarative_base
-from config import DB_URI # این را در مرحله بعد می‌سازیم
+from config import (DB_URI, DB_SQLITE_WAL, DB_SQLITE_BUSY_TIMEOUT, DB_SQLITE_SYNCHRONOUS,
+                    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING)
+
+def make_engine(url: str):
+    """
+    ساخت موتور با پروفایل مناسب نوع دیتابیس:
+    - SQLite: هندلرها در تردهای مختلف اجرا می‌شوند؛ هر ترد اتصال جدای خودش را از استخر می‌گیرد
+      و با WAL و busy_timeout نویسنده‌ها به جای خطای «database is locked» منتظر می‌مانند.
+    - Postgres و بقیه: استخر با اندازه/سرریز محدود، pre-ping و بازسازی اتصال‌های قدیمی.
+    """
+    backend = make_url(url).get_backend_name()
+    if backend != 'sqlite':
+        return create_engine(
+            url, echo=False,
+            pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=DB_POOL_PRE_PING,
+        )
+
+    memory = make_url(url).database in (None, '', ':memory:')
+    sqlite_engine = create_engine(
+        url, echo=False,
+        connect_args={'check_same_thread': False, 'timeout': DB_SQLITE_BUSY_TIMEOUT / 1000},
+        **({} if memory else {'pool_size': DB_POOL_SIZE, 'max_overflow': DB_MAX_OVERFLOW, 'pool_timeout': DB_POOL_TIMEOUT}),
+    )
+
+    @event.listens_for(sqlite_engine, 'connect')
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        set_sqlite_pragmas(dbapi_connection, memory)
+
+    return sqlite_engine
+
+def set_sqlite_pragmas(dbapi_connection, memory: bool = False):
+    """تنظیمات هر اتصال SQLite (مشترک بین موتور sync و async)"""
+    cursor = dbapi_connection.cursor()
+    if DB_SQLITE_WAL and not memory:
+        cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(DB_SQLITE_BUSY_TIMEOUT)}")
+    cursor.execute(f"PRAGMA synchronous={DB_SQLITE_SYNCHRONOUS}")
+    cursor.close()
 
 # ساخت موتور دیتابیس
-engine = create_engine(DB_URI, echo=False)
+engine = make_engine(DB_URI)
 
 # ساخت Session برای کوئری زدن
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -13,8 +52,47 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 def init_db():
-    """ساخت تمام جداول در دیتابیس"""
-    Base.metadata.create_all(bind=engine)
+    """
+    ساخت/ارتقای جداول با مایگریشن‌های Alembic (migrations/).
+    دیتابیس‌های قدیمی که با create_all ساخته شده‌اند هم با همین مسیر ارتقا پیدا می‌کنند.
+    """
+    migrate('head')
+
+def migrate(revision: str = 'head'):
+    """اجرای مایگریشن‌ها تا revision مشخص"""
+    import os
+    from alembic import command
+    from alembic.config import Config
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    cfg = Config(os.path.join(root, 'alembic.ini'))
+    cfg.attributes['configure_logger'] = False
+    with engine.begin() as connection:
+        cfg.attributes['connection'] = connection
+        command.upgrade(cfg, revision)
+
+def bulk_upsert(session, model, rows, conflict_cols, update_cols):
+    """
+    درج/به‌روزرسانی گروهی با یک دستور INSERT ... ON CONFLICT DO UPDATE
+    (پشتیبانی از SQLite و Postgres)
+    """
+    if not rows:
+        return
+    session.execute(upsert_stmt(session.get_bind().dialect.name, model, conflict_cols, update_cols), rows)
+
+def upsert_stmt(dialect: str, model, conflict_cols, update_cols):
+    """دستور INSERT ... ON CONFLICT DO UPDATE برای dialect داده‌شده (مشترک بین sync و async)"""
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"upsert is not supported on {dialect}")
+    stmt = insert(model.__table__)
+    return stmt.on_conflict_do_update(
+        index_elements=conflict_cols,
+        set_={col: stmt.excluded[col] for col in update_cols}
+    )
 
 def get_db():
     """تابع کمکی برای گرفتن سشن دیتابیس"""
@@ -1,5 +1,6 @@
 # database/models.py
-from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, DateTime, BigInteger, Table, Text
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, DateTime, BigInteger, Table, Text, UniqueConstraint, Index, event
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database.base import Base
@@ -39,9 +40,35 @@ class Server(Base):
     
     is_active = Column(Boolean, default=True)
     inbounds = relationship("Inbound", back_populates="server", cascade="all, delete-orphan")
+    sync_state = relationship("ServerSyncState", uselist=False, cascade="all, delete-orphan")
+    usages = relationship("ClientUsage", cascade="all, delete-orphan")
+
+    # وضعیت سلامت پنل از circuit breaker همین پروسه (در دیتابیس ذخیره نمی‌شود)
+    @property
+    def health_score(self) -> int:
+        from services.circuit_breaker import get_breaker
+        return get_breaker(self.id).health_score()
+
+    @property
+    def circuit_state(self) -> str:
+        from services.circuit_breaker import get_breaker
+        return get_breaker(self.id).state
+
+# با ویرایش یا حذف سرور، سشن کش‌شده پنل آن باید دور ریخته شود
+@event.listens_for(Server, 'after_update')
+@event.listens_for(Server, 'after_delete')
+def _invalidate_panel_client(mapper, connection, target):
+    from services.xui import invalidate_xui_client
+    from services.xui_async import invalidate_async_xui_client
+    from services.circuit_breaker import reset_breaker
+    invalidate_xui_client(target.id)
+    invalidate_async_xui_client(target.id)
+    reset_breaker(target.id)
 
 class Inbound(Base):
     __tablename__ = 'inbounds'
+    # همگام‌سازی اینباندها بر اساس همین جفت upsert/جستجو می‌کند
+    __table_args__ = (UniqueConstraint('server_id', 'xui_id', name='uq_inbound_server_xui'),)
     id = Column(Integer, primary_key=True)
     server_id = Column(Integer, ForeignKey('servers.id'))
     xui_id = Column(Integer, nullable=False)
@@ -74,7 +101,7 @@ class Plan(Base):
 class Purchase(Base):
     __tablename__ = 'purchases'
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey('users.id'))
+    user_id = Column(Integer, ForeignKey('users.id'), index=True)
     
     # چون یک خرید ممکن است شامل چند اینباند باشد، اینجا فقط پلن را نگه می‌داریم
     # اما برای سادگی فعلاً فرض می‌کنیم کانفیگ اصلی روی یک اینباند اصلی است یا مولتی پورت است
@@ -83,21 +110,23 @@ class Purchase(Base):
     
     uuid = Column(String, unique=True)
     sub_link = Column(String)
-    expire_date = Column(DateTime)
+    expire_date = Column(DateTime, index=True)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     user = relationship("User", back_populates="purchases")
     plan = relationship("Plan")
+    # مصرف همگام‌شده از پنل‌ها (یک ردیف برای هر سرور)
+    usages = relationship("ClientUsage", back_populates="purchase", cascade="all, delete-orphan")
 
 class Payment(Base):
     __tablename__ = 'payments'
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey('users.id'))
+    user_id = Column(Integer, ForeignKey('users.id'), index=True)
     plan_id = Column(Integer, ForeignKey('plans.id')) # چه پلنی می‌خواست بخرد؟
     
     amount = Column(Float)
-    status = Column(String, default="pending") # pending, approved, rejected
+    status = Column(String, default="pending", index=True) # pending, processing (در صف ساخت), approved, rejected
     payment_method = Column(String, default="card") # card, zarinpal
     
     # برای کارت به کارت
@@ -108,4 +137,72 @@ class Payment(Base):
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
     user = relationship("User", back_populates="payments")
-    plan = relationship("Plan")
\ No newline at end of file
+    plan = relationship("Plan")
+
+class ClientUsage(Base):
+    """آخرین آمار مصرف یک خرید روی یک سرور (با job همگام‌سازی ترافیک پر می‌شود)"""
+    __tablename__ = 'client_usages'
+    __table_args__ = (UniqueConstraint('purchase_id', 'server_id', name='uq_client_usage_purchase_server'),)
+    id = Column(Integer, primary_key=True)
+    purchase_id = Column(Integer, ForeignKey('purchases.id'), nullable=False)
+    server_id = Column(Integer, ForeignKey('servers.id'), nullable=False)
+
+    up = Column(BigInteger, default=0) # بایت
+    down = Column(BigInteger, default=0)
+    total = Column(BigInteger, default=0) # سقف حجم (0 = نامحدود)
+    expiry_time = Column(BigInteger, default=0) # میلی‌ثانیه (0 = نامحدود)
+    enable = Column(Boolean, default=True)
+    updated_at = Column(DateTime)
+
+    purchase = relationship("Purchase", back_populates="usages")
+
+class ServerSyncState(Base):
+    """وضعیت آخرین همگام‌سازی ترافیک هر سرور"""
+    __tablename__ = 'server_sync_states'
+    server_id = Column(Integer, ForeignKey('servers.id'), primary_key=True)
+    last_synced_at = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+    clients_synced = Column(Integer, default=0)
+
+class ProvisionJob(Base):
+    """
+    ساخت سرویس برای یک پرداخت تاییدشده (صف پایدار؛ services/provision_queue.py).
+    uuid و sub_id در اولین اجرا ثبت می‌شوند تا تلاش‌های بعدی همان کلاینت را بسازند.
+    """
+    __tablename__ = 'provision_jobs'
+    __table_args__ = (Index('ix_provision_jobs_status_next_run', 'status', 'next_run_at'),)
+    id = Column(Integer, primary_key=True)
+    payment_id = Column(Integer, ForeignKey('payments.id'), nullable=False, index=True)
+    status = Column(String, nullable=False, default="pending") # pending, running, done, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_run_at = Column(DateTime, nullable=False, default=datetime.now)
+    locked_at = Column(DateTime, nullable=True) # شروع اجرای فعلی (برای بازپس‌گیری job رهاشده)
+    notify_chat_id = Column(BigInteger, nullable=True) # ادمینی که تایید کرد
+
+    uuid = Column(String, nullable=True)
+    sub_id = Column(String, nullable=True)
+    purchase_id = Column(Integer, ForeignKey('purchases.id'), nullable=True)
+    last_error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    payment = relationship("Payment")
+
+class ConversationState(Base):
+    """
+    وضعیت ویزاردها (backend دیتابیسی services/state_store.py).
+    scope نوع ویزارد است (مثلاً admin / user) و data دیکشنری وضعیت به صورت JSON.
+    """
+    __tablename__ = 'conversation_states'
+    scope = Column(String, primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True)
+    data = Column(Text, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+class PendingReceipt(Base):
+    """کاربرانی که باید عکس فیش را بفرستند (chat id --> پلن انتخاب‌شده تا زمان انقضا)"""
+    __tablename__ = 'pending_receipts'
+    chat_id = Column(BigInteger, primary_key=True)
+    plan_id = Column(Integer, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
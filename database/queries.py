@@ -0,0 +1,147 @@
+# database/queries.py
+"""
+کوئری‌های هندلرها به صورت select builder؛ هر کدام یک نسخه sync (با Session)
+و یک نسخه async با پیشوند a (با AsyncSession از database/async_base.py) دارند.
+رابطه‌هایی که هندلر لازم دارد eager load می‌شوند چون lazy load در AsyncSession ممکن نیست.
+"""
+from datetime import datetime
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import joinedload, selectinload
+
+from database.base import bulk_upsert
+from database.models import User, Server, Plan, Inbound, Purchase, Payment, PendingReceipt
+
+
+# ==========================
+# select builderها
+# ==========================
+def user_by_telegram_id_stmt(telegram_id: int):
+    return select(User).where(User.telegram_id == telegram_id)
+
+def active_plans_stmt():
+    return select(Plan).where(Plan.is_active.is_(True)).order_by(Plan.id)
+
+def plan_with_inbounds_stmt(plan_id: int):
+    return (
+        select(Plan)
+        .where(Plan.id == plan_id)
+        .options(selectinload(Plan.inbounds).joinedload(Inbound.server))
+    )
+
+def payment_with_plan_stmt(payment_id: int):
+    """پرداخت با کاربر، پلن، اینباندها و سرورها (برای تایید و ساخت سرویس)"""
+    return (
+        select(Payment)
+        .where(Payment.id == payment_id)
+        .options(
+            joinedload(Payment.user),
+            joinedload(Payment.plan).selectinload(Plan.inbounds).joinedload(Inbound.server),
+        )
+    )
+
+def servers_stmt(active_only: bool = False):
+    stmt = select(Server).options(selectinload(Server.inbounds)).order_by(Server.id)
+    return stmt.where(Server.is_active.is_(True)) if active_only else stmt
+
+def server_stmt(server_id: int):
+    return select(Server).where(Server.id == server_id).options(selectinload(Server.inbounds))
+
+def inbounds_by_ids_stmt(inbound_ids):
+    return select(Inbound).where(Inbound.id.in_(list(inbound_ids)))
+
+def active_purchases_stmt(telegram_id: int):
+    """
+    سرویس‌های فعال یک کاربر همراه با پلن، اینباندها، سرورها و مصرف
+    در تعداد ثابتی کوئری (مستقل از تعداد سرویس‌ها)
+    """
+    return (
+        select(Purchase)
+        .join(User, User.id == Purchase.user_id)
+        .where(User.telegram_id == telegram_id, Purchase.is_active.is_(True))
+        .options(
+            joinedload(Purchase.plan).selectinload(Plan.inbounds).joinedload(Inbound.server),
+            selectinload(Purchase.usages),
+        )
+        .order_by(Purchase.id)
+    )
+
+def pending_receipt_stmt(chat_id: int):
+    return select(PendingReceipt.plan_id).where(
+        PendingReceipt.chat_id == chat_id, PendingReceipt.expires_at > datetime.now())
+
+def purchase_with_servers_stmt(purchase_id: int):
+    """یک خرید با پلن، اینباندها و سرور هر اینباند (برای ساخت کانفیگ تکی)"""
+    return (
+        select(Purchase)
+        .where(Purchase.id == purchase_id)
+        .options(joinedload(Purchase.plan).selectinload(Plan.inbounds).joinedload(Inbound.server))
+    )
+
+
+# ==========================
+# نسخه sync
+# ==========================
+def upsert_user(session, telegram_id: int, first_name: str, username: str):
+    """ثبت یا به‌روزرسانی کاربر با یک دستور INSERT ... ON CONFLICT (بدون race در /start همزمان)"""
+    row = {'telegram_id': telegram_id, 'first_name': first_name, 'username': username}
+    bulk_upsert(session, User, [row], ['telegram_id'], ['first_name', 'username'])
+
+def get_active_purchases(session, telegram_id: int) -> list:
+    return session.scalars(active_purchases_stmt(telegram_id)).unique().all()
+
+def get_purchase_with_servers(session, purchase_id: int):
+    return session.scalars(purchase_with_servers_stmt(purchase_id)).unique().first()
+
+
+# ==========================
+# نسخه async
+# ==========================
+async def aupsert_user(session, telegram_id: int, first_name: str, username: str):
+    from database.async_base import abulk_upsert
+    row = {'telegram_id': telegram_id, 'first_name': first_name, 'username': username}
+    await abulk_upsert(session, User, [row], ['telegram_id'], ['first_name', 'username'])
+
+async def aget_user(session, telegram_id: int):
+    return (await session.scalars(user_by_telegram_id_stmt(telegram_id))).first()
+
+async def aget_active_plans(session) -> list:
+    return (await session.scalars(active_plans_stmt())).all()
+
+async def aget_plan(session, plan_id: int):
+    return (await session.scalars(plan_with_inbounds_stmt(plan_id))).first()
+
+async def aget_payment(session, payment_id: int):
+    return (await session.scalars(payment_with_plan_stmt(payment_id))).unique().first()
+
+async def aget_servers(session, active_only: bool = False) -> list:
+    return (await session.scalars(servers_stmt(active_only))).all()
+
+async def aget_server(session, server_id: int):
+    return (await session.scalars(server_stmt(server_id))).first()
+
+async def aget_inbounds(session, inbound_ids) -> list:
+    return (await session.scalars(inbounds_by_ids_stmt(inbound_ids))).all()
+
+async def aget_active_purchases(session, telegram_id: int) -> list:
+    return (await session.scalars(active_purchases_stmt(telegram_id))).unique().all()
+
+async def aget_purchase_with_servers(session, purchase_id: int):
+    return (await session.scalars(purchase_with_servers_stmt(purchase_id))).unique().first()
+
+async def aset_pending_receipt(session, chat_id: int, plan_id: int, expires_at: datetime):
+    from database.async_base import abulk_upsert
+    # فیش‌های منقضی همین‌جا پاک می‌شوند تا جدول کوچک بماند
+    await session.execute(delete(PendingReceipt).where(PendingReceipt.expires_at <= datetime.now()))
+    row = {'chat_id': chat_id, 'plan_id': plan_id, 'expires_at': expires_at}
+    await abulk_upsert(session, PendingReceipt, [row], ['chat_id'], ['plan_id', 'expires_at'])
+
+async def aget_pending_receipt(session, chat_id: int):
+    """plan_id فیش در انتظار (یا None)"""
+    return await session.scalar(pending_receipt_stmt(chat_id))
+
+async def aclear_pending_receipt(session, chat_id: int) -> bool:
+    """True اگر فیشی در انتظار بود (فقط یک پروسه/پیام آن را برمی‌دارد)"""
+    res = await session.execute(delete(PendingReceipt).where(
+        PendingReceipt.chat_id == chat_id, PendingReceipt.expires_at > datetime.now()))
+    return res.rowcount == 1
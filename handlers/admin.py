@@ -1,19 +1,30 @@
 # handlers/admin.py
-import telebot
+import asyncio
 from telebot import types
-from database.base import SessionLocal
-from database.models import Server, User, Plan, Inbound, plan_inbound_association
+from telebot.async_telebot import AsyncTeleBot
+from database.async_base import AsyncSessionLocal, abulk_upsert
+from database.models import Server, User, Plan, Inbound, ClientUsage, ServerSyncState, ProvisionJob, plan_inbound_association
+from database.queries import aget_servers, aget_server, aget_inbounds
 from config import ADMIN_IDS
-from services.xui import XUIClient
-from sqlalchemy.orm import joinedload
-# وضعیت‌های موقت برای ویزاردها
-admin_states = {}
+from services.xui import PanelError
+from services.xui_async import get_async_xui_client
+from services.reconcile import reconcile_all, CREATE, DISABLE, DELETE
+from services.plan_catalog import invalidate_plan_catalog
+from services.provision_queue import PENDING, RUNNING, DONE, FAILED
+from services.state_store import make_state_store, get_for_message
+from sqlalchemy import func, select, update
+# وضعیت‌های موقت ویزاردها (کلید: chat id)
+admin_states = make_state_store('admin')
 
 def is_admin(user_id):
     return user_id in ADMIN_IDS
 
-def get_db():
-    return SessionLocal()
+def _delete_row(session, model, row_id):
+    """حذف با cascade رابطه‌ها؛ از طریق AsyncSession.run_sync صدا زده می‌شود (lazy load آنجا مجاز است)"""
+    row = session.get(model, row_id)
+    if row is not None:
+        session.delete(row)
+    return row is not None
 
 # --- تابع کمکی برای دکمه کنسل ---
 def cancel_btn():
@@ -21,107 +32,136 @@ def cancel_btn():
     m.add(types.InlineKeyboardButton("❌ لغو عملیات", callback_data="admin_cancel_state"))
     return m
 
-def register_admin_handlers(bot: telebot.TeleBot):
+def register_admin_handlers(bot: AsyncTeleBot):
     
     # اتصال دکمه منوی اصلی به پنل ادمین
     @bot.callback_query_handler(func=lambda call: call.data == 'main_admin_panel')
-    def open_admin_panel(call):
+    async def open_admin_panel(call):
         if not is_admin(call.from_user.id): return
-        admin_panel_menu(bot, call.message)
+        await admin_panel_menu(bot, call.message)
 
     # دستور مستقیم /admin
     @bot.message_handler(commands=['admin'])
-    def cmd_admin(message):
+    async def cmd_admin(message):
         if not is_admin(message.from_user.id): return
-        admin_panel_menu(bot, message)
+        await admin_panel_menu(bot, message)
 
-    def admin_panel_menu(bot, message):
+    # مقایسه پنل‌ها با دیتابیس (فقط گزارش؛ اعمال با دکمه)
+    @bot.message_handler(commands=['reconcile'])
+    async def cmd_reconcile(message):
+        if not is_admin(message.from_user.id): return
+        msg = await bot.send_message(message.chat.id, "⏳ در حال مقایسه پنل‌ها با دیتابیس...")
+        await run_reconcile(bot, msg)
+
+    # وضعیت صف ساخت سرویس
+    @bot.message_handler(commands=['jobs'])
+    async def cmd_jobs(message):
+        if not is_admin(message.from_user.id): return
+        await show_provision_jobs(bot, message)
+
+    async def admin_panel_menu(bot, message):
         markup = types.InlineKeyboardMarkup(row_width=2)
         markup.add(
             types.InlineKeyboardButton("🖥 سرورها & اینباندها", callback_data="admin_servers_menu"),
             types.InlineKeyboardButton("💰 پلن‌ها", callback_data="admin_plans_menu"),
+            types.InlineKeyboardButton("📊 گزارش مصرف", callback_data="admin_usage_report"),
             types.InlineKeyboardButton("❌ بستن", callback_data="admin_close")
         )
         # چک میکنیم پیام قبلی متن بوده یا کال‌بک برای ویرایش صحیح
         if hasattr(message, 'message_id'):
              try:
-                bot.edit_message_text("🛠 **پنل مدیریت پیشرفته**", message.chat.id, message.message_id, reply_markup=markup, parse_mode="Markdown")
+                await bot.edit_message_text("🛠 **پنل مدیریت پیشرفته**", message.chat.id, message.message_id, reply_markup=markup, parse_mode="Markdown")
              except:
-                bot.send_message(message.chat.id, "🛠 **پنل مدیریت پیشرفته**", reply_markup=markup, parse_mode="Markdown")
+                await bot.send_message(message.chat.id, "🛠 **پنل مدیریت پیشرفته**", reply_markup=markup, parse_mode="Markdown")
         else:
-             bot.send_message(message.chat.id, "🛠 **پنل مدیریت پیشرفته**", reply_markup=markup, parse_mode="Markdown")
+             await bot.send_message(message.chat.id, "🛠 **پنل مدیریت پیشرفته**", reply_markup=markup, parse_mode="Markdown")
 
     # ==========================
     # هندلر دکمه‌های ادمین
     # ==========================
     @bot.callback_query_handler(func=lambda call: call.data.startswith('admin_') or call.data.startswith('server_') or call.data.startswith('plan_'))
-    def handle_admin_callbacks(call):
+    async def handle_admin_callbacks(call):
         if not is_admin(call.from_user.id): return
         action = call.data
         
         # هندل کردن ارور احتمالی کوری قدیمی
         try:
-            bot.answer_callback_query(call.id)
+            await bot.answer_callback_query(call.id)
         except:
             pass
         
         if action == "admin_close":
-            bot.delete_message(call.message.chat.id, call.message.message_id)
+            await bot.delete_message(call.message.chat.id, call.message.message_id)
             return
 
         elif action == "admin_cancel_state":
-            if call.from_user.id in admin_states:
-                del admin_states[call.from_user.id]
-            bot.send_message(call.message.chat.id, "❌ عملیات لغو شد.")
-            admin_panel_menu(bot, call.message)
+            await admin_states.delete(call.message.chat.id)
+            await bot.send_message(call.message.chat.id, "❌ عملیات لغو شد.")
+            await admin_panel_menu(bot, call.message)
 
         # --- بخش سرورها ---
         elif action == "admin_servers_menu":
-            show_servers_menu(bot, call.message)
+            await show_servers_menu(bot, call.message)
         elif action == "admin_add_server":
-            start_add_server(bot, call.message)
+            await start_add_server(bot, call.message)
         elif action == "admin_list_servers":
-            list_servers(bot, call.message)
+            await list_servers(bot, call.message)
         
         elif action.startswith("server_info_"):
             sid = int(action.split("_")[-1])
-            show_server_details(bot, call.message, sid)
+            await show_server_details(bot, call.message, sid)
             
         # FIX: اینجا به جای call.message، خود call را می‌فرستیم
         elif action.startswith("server_sync_"):
             sid = int(action.split("_")[-1])
-            sync_server_inbounds(bot, call, sid)
+            await sync_server_inbounds(bot, call, sid)
             
         elif action.startswith("server_del_"):
             sid = int(action.split("_")[-1])
-            delete_server(bot, call, sid)
+            await delete_server(bot, call, sid)
             
         elif action.startswith("server_test_"):
             sid = int(action.split("_")[-1])
-            test_server_connection(bot, call, sid)
+            await test_server_connection(bot, call, sid)
 
         # --- بخش پلن‌ها ---
         elif action == "admin_plans_menu":
-            show_plans_menu(bot, call.message)
+            await show_plans_menu(bot, call.message)
         elif action == "admin_add_plan":
-            start_add_plan(bot, call.message)
+            await start_add_plan(bot, call.message)
         elif action == "admin_list_plans":
-            list_plans(bot, call.message)
+            await list_plans(bot, call.message)
         elif action.startswith("plan_del_"):
             pid = int(action.split("_")[-1])
-            delete_plan(bot, call, pid)
+            await delete_plan(bot, call, pid)
+
+        # --- گزارش مصرف ---
+        elif action == "admin_usage_report":
+            await show_usage_report(bot, call.message)
+
+        # --- تطبیق پنل و دیتابیس ---
+        elif action == "admin_reconcile_apply":
+            await run_reconcile(bot, call.message, apply=True)
+        elif action == "admin_reconcile_orphans":
+            await run_reconcile(bot, call.message, apply=True, delete_orphans=True)
 
         # --- بازگشت ---
         elif action == "admin_back_main":
-            admin_panel_menu(bot, call.message)
+            await admin_panel_menu(bot, call.message)
 
     # ==========================
     # پردازش ورودی‌های متنی (ویزارد)
     # ==========================
-    @bot.message_handler(func=lambda msg: is_admin(msg.from_user.id) and msg.from_user.id in admin_states)
-    def handle_admin_inputs(message):
+    async def in_admin_wizard(msg):
+        return is_admin(msg.from_user.id) and await get_for_message(admin_states, msg) is not None
+
+    @bot.message_handler(func=in_admin_wizard)
+    async def handle_admin_inputs(message):
         uid = message.chat.id
-        state = admin_states[uid]
+        # همان وضعیتی که فیلتر خوانده (بدون خواندن دوباره از store)
+        state = await get_for_message(admin_states, message)
+        if state is None:
+            return
         step = state['step']
         text = message.text.strip()
         
@@ -129,22 +169,22 @@ def register_admin_handlers(bot: telebot.TeleBot):
         if step == 'server_name':
             state['data']['name'] = text
             state['step'] = 'server_url'
-            bot.send_message(uid, "🔗 **آدرس پنل را وارد کنید:**\n(مثال: http://1.1.1.1:2053)", reply_markup=cancel_btn())
+            await bot.send_message(uid, "🔗 **آدرس پنل را وارد کنید:**\n(مثال: http://1.1.1.1:2053)", reply_markup=cancel_btn())
             
         elif step == 'server_url':
             state['data']['panel_url'] = text.rstrip('/')
             state['step'] = 'server_user'
-            bot.send_message(uid, "👤 **نام کاربری پنل:**", reply_markup=cancel_btn())
+            await bot.send_message(uid, "👤 **نام کاربری پنل:**", reply_markup=cancel_btn())
             
         elif step == 'server_user':
             state['data']['username'] = text
             state['step'] = 'server_pass'
-            bot.send_message(uid, "🔑 **رمز عبور پنل:**", reply_markup=cancel_btn())
+            await bot.send_message(uid, "🔑 **رمز عبور پنل:**", reply_markup=cancel_btn())
             
         elif step == 'server_pass':
             state['data']['password'] = text
             state['step'] = 'server_sub'
-            bot.send_message(uid, "🌐 **آدرس سابسکریپشن (لینک اتصال):**\n(مثال: https://sub.domain.com/sub)", reply_markup=cancel_btn())
+            await bot.send_message(uid, "🌐 **آدرس سابسکریپشن (لینک اتصال):**\n(مثال: https://sub.domain.com/sub)", reply_markup=cancel_btn())
             
         elif step == 'server_sub':
             state['data']['subscription_url'] = text.rstrip('/')
@@ -155,7 +195,7 @@ def register_admin_handlers(bot: telebot.TeleBot):
                 "اگر نمی‌خواهید، کلمه `skip` را ارسال کنید.\n\n"
                 "مثال:\n`vless://UUID@google.com:443?security=reality&...#EMAIL`"
             )
-            bot.send_message(uid, msg, reply_markup=cancel_btn(), parse_mode="Markdown")
+            await bot.send_message(uid, msg, reply_markup=cancel_btn(), parse_mode="Markdown")
 
         elif step == 'server_template':
             if text.lower() == 'skip':
@@ -163,86 +203,86 @@ def register_admin_handlers(bot: telebot.TeleBot):
             else:
                 state['data']['config_template'] = text
             
-            save_server_to_db(bot, message, state['data'])
-            del admin_states[uid]
+            await admin_states.delete(uid)
+            await save_server_to_db(bot, message, state['data'])
+            return
 
         # --- ویزارد پلن ---
         elif step == 'plan_name':
             state['data']['name'] = text
             state['step'] = 'plan_gb'
             # پیام راهنما آپدیت شد 👇
-            bot.send_message(uid, "📦 **حجم پلن (GB):**\n(عدد `0` به معنای حجم نامحدود است)", reply_markup=cancel_btn(), parse_mode="Markdown")
+            await bot.send_message(uid, "📦 **حجم پلن (GB):**\n(عدد `0` به معنای حجم نامحدود است)", reply_markup=cancel_btn(), parse_mode="Markdown")
 
         elif step == 'plan_gb':
-            if not text.isdigit(): return bot.send_message(uid, "❌ عدد وارد کنید.")
+            if not text.isdigit(): return await bot.send_message(uid, "❌ عدد وارد کنید.")
             state['data']['volume_gb'] = float(text)
             state['step'] = 'plan_days'
             # پیام راهنما آپدیت شد 👇
-            bot.send_message(uid, "⏳ **مدت زمان (روز):**\n(عدد `0` به معنای زمان نامحدود/لایف‌تایم است)", reply_markup=cancel_btn(), parse_mode="Markdown")
+            await bot.send_message(uid, "⏳ **مدت زمان (روز):**\n(عدد `0` به معنای زمان نامحدود/لایف‌تایم است)", reply_markup=cancel_btn(), parse_mode="Markdown")
 
         elif step == 'plan_days':
-            if not text.isdigit(): return bot.send_message(uid, "❌ عدد وارد کنید.")
+            if not text.isdigit(): return await bot.send_message(uid, "❌ عدد وارد کنید.")
             state['data']['duration_days'] = int(text)
             state['step'] = 'plan_limit_ip' # مرحله جدید
-            bot.send_message(uid, "👥 **تعداد کاربر (Limit IP):**\n(مثلاً 1 برای تک‌کاربره، 0 برای نامحدود)", reply_markup=cancel_btn(), parse_mode="Markdown")
+            await bot.send_message(uid, "👥 **تعداد کاربر (Limit IP):**\n(مثلاً 1 برای تک‌کاربره، 0 برای نامحدود)", reply_markup=cancel_btn(), parse_mode="Markdown")
 
         elif step == 'plan_limit_ip':
-            if not text.isdigit(): return bot.send_message(uid, "❌ عدد وارد کنید.")
+            if not text.isdigit(): return await bot.send_message(uid, "❌ عدد وارد کنید.")
             state['data']['limit_ip'] = int(text)
             state['step'] = 'plan_price'
-            bot.send_message(uid, "💰 **قیمت (تومان):**", reply_markup=cancel_btn())
+            await bot.send_message(uid, "💰 **قیمت (تومان):**", reply_markup=cancel_btn())
 
         elif step == 'plan_price':
-            if not text.isdigit(): return bot.send_message(uid, "❌ عدد وارد کنید.")
+            if not text.isdigit(): return await bot.send_message(uid, "❌ عدد وارد کنید.")
             state['data']['price'] = float(text)
             
             # --- تغییر جدید: به جای ذخیره، لیست سرورها را نشان بده ---
-            # پاک کردن استیت متنی چون وارد مرحله دکمه‌ای می‌شویم
-            # اما دیتا را نگه می‌داریم
-            show_server_selection_for_plan(bot, message)
+            # دیتا تا مرحله دکمه‌ای (انتخاب سرور/اینباند) نگه داشته می‌شود
+            await admin_states.set(uid, state)
+            await show_server_selection_for_plan(bot, message)
+            return
+
+        # ذخیره مرحله جدید (و تمدید مهلت ویزارد)
+        await admin_states.set(uid, state)
     @bot.callback_query_handler(func=lambda call: call.data.startswith('plan_srv_'))
-    def select_server_for_plan(call):
+    async def select_server_for_plan(call):
         if not is_admin(call.from_user.id): return
         
         # لاگ برای اطمینان از کارکرد
         print(f"Server Selected: {call.data}")
 
         server_id = int(call.data.split('_')[-1])
-        user_id = call.from_user.id # یا call.message.chat.id بسته به نحوه ذخیره اولیه
+        chat_id = call.message.chat.id
         
-        # چک کنیم آیا استیت وجود دارد؟ (شاید ربات ریست شده)
-        if user_id not in admin_states:
-            # تلاش برای بازیابی استیت اگر با chat_id ذخیره شده باشد
-            if call.message.chat.id in admin_states:
-                user_id = call.message.chat.id
-            else:
-                bot.answer_callback_query(call.id, "❌ نشست منقضی شده. از اول شروع کنید.", show_alert=True)
-                return
+        # چک کنیم آیا استیت وجود دارد؟ (شاید منقضی شده باشد)
+        state = await admin_states.get(chat_id)
+        if state is None:
+            await bot.answer_callback_query(call.id, "❌ نشست منقضی شده. از اول شروع کنید.", show_alert=True)
+            return
 
         # ذخیره سرور انتخاب شده
-        admin_states[user_id]['data']['selected_server_id'] = server_id
-        admin_states[user_id]['data']['selected_inbounds'] = []
+        state['data']['selected_server_id'] = server_id
+        state['data']['selected_inbounds'] = []
+        await admin_states.set(chat_id, state)
             
         # نمایش مرحله بعدی (لیست اینباندها)
-        show_inbound_selection_for_plan(bot, call.message, server_id)
+        await show_inbound_selection_for_plan(bot, call.message, server_id)
 
 
     # 2. هندلر تیک زدن اینباندها (Toggle)
     @bot.callback_query_handler(func=lambda call: call.data.startswith('plan_inb_'))
-    def toggle_inbound_for_plan(call):
+    async def toggle_inbound_for_plan(call):
         if not is_admin(call.from_user.id): return
         
-        user_id = call.from_user.id
-        # هماهنگی با کلید استیت
-        if user_id not in admin_states and call.message.chat.id in admin_states:
-            user_id = call.message.chat.id
-        
-        if user_id not in admin_states:
-            bot.answer_callback_query(call.id, "نشست منقضی شده.", show_alert=True)
+        chat_id = call.message.chat.id
+        state = await admin_states.get(chat_id)
+        if state is None:
+            await bot.answer_callback_query(call.id, "نشست منقضی شده.", show_alert=True)
             return
 
         inbound_id = int(call.data.split('_')[-1])
-        selected_list = admin_states[user_id]['data'].get('selected_inbounds', [])
+        selected_list = state['data'].get('selected_inbounds', [])
         
         # اگر بود حذف کن، نبود اضافه کن
         if inbound_id in selected_list:
@@ -252,78 +292,77 @@ def register_admin_handlers(bot: telebot.TeleBot):
             selected_list.append(inbound_id)
             msg = "✅ انتخاب شد"
             
-        admin_states[user_id]['data']['selected_inbounds'] = selected_list
+        state['data']['selected_inbounds'] = selected_list
+        await admin_states.set(chat_id, state)
         
         # رفرش کردن لیست برای نمایش تیک‌ها
-        server_id = admin_states[user_id]['data']['selected_server_id']
-        show_inbound_selection_for_plan(bot, call.message, server_id, refresh=True)
-        try: bot.answer_callback_query(call.id, msg)
+        server_id = state['data']['selected_server_id']
+        await show_inbound_selection_for_plan(bot, call.message, server_id, selected_list, refresh=True)
+        try: await bot.answer_callback_query(call.id, msg)
         except: pass
 
 
     # 3. هندلر دکمه ذخیره نهایی
     @bot.callback_query_handler(func=lambda call: call.data == "plan_save_final")
-    def save_plan_final_handler(call):
+    async def save_plan_final_handler(call):
         if not is_admin(call.from_user.id): return
         
-        user_id = call.from_user.id
-        if user_id not in admin_states and call.message.chat.id in admin_states:
-            user_id = call.message.chat.id
-
-        if user_id not in admin_states:
-            bot.answer_callback_query(call.id, "نشست منقضی شده.", show_alert=True)
+        chat_id = call.message.chat.id
+        state = await admin_states.get(chat_id)
+        if state is None:
+            await bot.answer_callback_query(call.id, "نشست منقضی شده.", show_alert=True)
             return
         
-        data = admin_states[user_id]['data']
+        data = state['data']
         if not data.get('selected_inbounds'):
-            bot.answer_callback_query(call.id, "⚠️ حداقل یک پورت را انتخاب کنید!", show_alert=True)
+            await bot.answer_callback_query(call.id, "⚠️ حداقل یک پورت را انتخاب کنید!", show_alert=True)
             return
             
-        save_plan_to_db(bot, call.message, data)
-        del admin_states[user_id]
+        await admin_states.delete(chat_id)
+        await save_plan_to_db(bot, call.message, data)
 # ==========================
 # توابع منطقی (Logic Functions)
 # ==========================
 
-def show_servers_menu(bot, message):
+async def show_servers_menu(bot, message):
     markup = types.InlineKeyboardMarkup()
     markup.add(types.InlineKeyboardButton("➕ افزودن سرور", callback_data="admin_add_server"))
     markup.add(types.InlineKeyboardButton("📋 لیست سرورها", callback_data="admin_list_servers"))
     markup.add(types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin_back_main"))
-    bot.edit_message_text("🖥 **مدیریت سرورها**", message.chat.id, message.message_id, reply_markup=markup, parse_mode="Markdown")
+    await bot.edit_message_text("🖥 **مدیریت سرورها**", message.chat.id, message.message_id, reply_markup=markup, parse_mode="Markdown")
 
-def list_servers(bot, message):
-    session = get_db()
-    servers = session.query(Server).all()
-    session.close()
+async def list_servers(bot, message):
+    async with AsyncSessionLocal() as session:
+        servers = (await session.scalars(select(Server).order_by(Server.id))).all()
     
     if not servers:
-        try: bot.answer_callback_query(message.id, "لیست خالی است.") # اینجا message.id درست نیست اگر از کال‌بک نیاید ولی چون list_servers از کال‌بک میاد مشکلی نیست
+        try: await bot.answer_callback_query(message.id, "لیست خالی است.") # اینجا message.id درست نیست اگر از کال‌بک نیاید ولی چون list_servers از کال‌بک میاد مشکلی نیست
         except: pass
-        bot.send_message(message.chat.id, "هیچ سروری ثبت نشده است.")
+        await bot.send_message(message.chat.id, "هیچ سروری ثبت نشده است.")
         return
 
     markup = types.InlineKeyboardMarkup()
     for s in servers:
         markup.add(types.InlineKeyboardButton(f"🖥 {s.name}", callback_data=f"server_info_{s.id}"))
     markup.add(types.InlineKeyboardButton("🔙", callback_data="admin_servers_menu"))
-    bot.edit_message_text("یک سرور را انتخاب کنید:", message.chat.id, message.message_id, reply_markup=markup)
+    await bot.edit_message_text("یک سرور را انتخاب کنید:", message.chat.id, message.message_id, reply_markup=markup)
 
-def show_server_details(bot, message, server_id):
-    session = get_db()
-    server = session.query(Server).get(server_id)
+async def show_server_details(bot, message, server_id):
+    async with AsyncSessionLocal() as session:
+        server = await aget_server(session, server_id)
     if not server:
-        session.close()
         return
 
     inbound_count = len(server.inbounds)
     status_icon = "✅" if server.is_active else "❌"
+    circuit_icon = {"closed": "🟢", "half_open": "🟡", "open": "🔴"}[server.circuit_state]
     
     text = (
         f"🖥 **سرور:** `{server.name}`\n"
         f"🔗 **آدرس:** `{server.panel_url}`\n"
         f"📡 **تعداد اینباندها:** {inbound_count}\n"
-        f"وضعیت: {status_icon}\n\n"
+        f"وضعیت: {status_icon}\n"
+        f"❤️ سلامت پنل: {circuit_icon} {server.health_score}/100\n\n"
         "برای فروش، باید اینباندهای سرور را همگام‌سازی کنید."
     )
     
@@ -335,15 +374,13 @@ def show_server_details(bot, message, server_id):
     markup.add(types.InlineKeyboardButton("🗑 حذف سرور", callback_data=f"server_del_{server.id}"))
     markup.add(types.InlineKeyboardButton("🔙", callback_data="admin_list_servers"))
     
-    bot.edit_message_text(text, message.chat.id, message.message_id, reply_markup=markup, parse_mode="Markdown")
-    session.close()
+    await bot.edit_message_text(text, message.chat.id, message.message_id, reply_markup=markup, parse_mode="Markdown")
 
-def start_add_server(bot, message):
-    admin_states[message.chat.id] = {'step': 'server_name', 'data': {}}
-    bot.edit_message_text("📝 **نام سرور را وارد کنید:**\n(مثال: Germany-1)", message.chat.id, message.message_id, reply_markup=cancel_btn(), parse_mode="Markdown")
+async def start_add_server(bot, message):
+    await admin_states.set(message.chat.id, {'step': 'server_name', 'data': {}})
+    await bot.edit_message_text("📝 **نام سرور را وارد کنید:**\n(مثال: Germany-1)", message.chat.id, message.message_id, reply_markup=cancel_btn(), parse_mode="Markdown")
 
-def save_server_to_db(bot, message, data):
-    session = get_db()
+async def save_server_to_db(bot, message, data):
     try:
         s = Server(
             name=data['name'], 
@@ -353,137 +390,223 @@ def save_server_to_db(bot, message, data):
             subscription_url=data['subscription_url'],
             config_template=data.get('config_template')
         )
-        session.add(s)
-        session.commit()
-        bot.send_message(message.chat.id, "✅ سرور ذخیره شد. لطفاً **همگام‌سازی اینباند** را انجام دهید.")
+        async with AsyncSessionLocal() as session:
+            session.add(s)
+            await session.commit()
+        await bot.send_message(message.chat.id, "✅ سرور ذخیره شد. لطفاً **همگام‌سازی اینباند** را انجام دهید.")
     except Exception as e:
-        bot.send_message(message.chat.id, f"Error: {e}")
-    finally:
-        session.close()
+        await bot.send_message(message.chat.id, f"Error: {e}")
 
 # FIX: دریافت 'call' به جای 'message'
-def delete_server(bot, call, server_id):
-    try: bot.answer_callback_query(call.id, "در حال حذف...") 
+async def delete_server(bot, call, server_id):
+    try: await bot.answer_callback_query(call.id, "در حال حذف...") 
     except: pass
 
-    session = get_db()
-    server = session.query(Server).get(server_id)
-    if server:
-        session.delete(server)
-        session.commit()
-        list_servers(bot, call.message)
-    session.close()
+    async with AsyncSessionLocal() as session:
+        deleted = await session.run_sync(_delete_row, Server, server_id)
+        await session.commit()
+    if deleted:
+        # اینباندهای سرور از پلن‌ها جدا شدند
+        invalidate_plan_catalog()
+        await list_servers(bot, call.message)
 
 # FIX: دریافت 'call' به جای 'message'
-def test_server_connection(bot, call, server_id):
-    try: bot.answer_callback_query(call.id, "⏳ در حال تست اتصال...") 
+async def test_server_connection(bot, call, server_id):
+    try: await bot.answer_callback_query(call.id, "⏳ در حال تست اتصال...") 
     except: pass
     
-    session = get_db()
-    server = session.query(Server).get(server_id)
-    session.close()
+    async with AsyncSessionLocal() as session:
+        server = await session.get(Server, server_id)
+    if not server:
+        return
 
-    client = XUIClient(server.panel_url, server.username, server.password)
+    # لاگین صریح برای تست واقعی اتصال (کوکی مشترک سرور حفظ می‌شود)
+    client = get_async_xui_client(server)
     
-    if client.login():
-        stats = client.get_system_status()
+    if await client.login():
+        stats = await client.get_system_status()
         online_count = len(stats) if stats else 0
-        bot.send_message(call.message.chat.id, f"✅ **اتصال موفق بود!**\nسرور: `{server.name}`\nکاربران آنلاین: {online_count}", parse_mode="Markdown")
+        await bot.send_message(call.message.chat.id, f"✅ **اتصال موفق بود!**\nسرور: `{server.name}`\nکاربران آنلاین: {online_count}", parse_mode="Markdown")
     else:
-        bot.send_message(call.message.chat.id, f"❌ **اتصال ناموفق!**\nاطلاعات سرور را چک کنید.")
+        await bot.send_message(call.message.chat.id, f"❌ **اتصال ناموفق!**\nاطلاعات سرور را چک کنید.")
 
 # FIX: دریافت 'call' به جای 'message'
-def sync_server_inbounds(bot, call, server_id):
-    try: bot.answer_callback_query(call.id, "⏳ در حال دریافت لیست...") 
+async def sync_server_inbounds(bot, call, server_id):
+    try: await bot.answer_callback_query(call.id, "⏳ در حال دریافت لیست...") 
     except: pass
 
-    session = get_db()
-    server = session.query(Server).get(server_id)
-    
-    client = XUIClient(server.panel_url, server.username, server.password)
-    
-    if not client.login():
-        bot.send_message(call.message.chat.id, "❌ خطا در اتصال به پنل.")
-        session.close()
-        return
+    async with AsyncSessionLocal() as session:
+        server = await session.get(Server, server_id)
+        if not server:
+            return
+        client = get_async_xui_client(server)
+        
+        if not await client.ensure_login():
+            await bot.send_message(call.message.chat.id, "❌ خطا در اتصال به پنل.")
+            return
 
-    xui_inbounds = client.get_inbounds()
-    if not xui_inbounds:
-        bot.send_message(call.message.chat.id, "⚠️ هیچ اینباندی یافت نشد.")
-        session.close()
-        return
+        # اینباندهای فعلی سرور با یک کوئری؛ تغییرات در حافظه محاسبه می‌شوند
+        existing = {
+            row.xui_id: row for row in await session.execute(
+                select(Inbound.xui_id, Inbound.remark, Inbound.port, Inbound.protocol, Inbound.is_active)
+                .where(Inbound.server_id == server.id)
+            )
+        }
 
-    added, updated = 0, 0
-    for item in xui_inbounds:
-        exists = session.query(Inbound).filter_by(server_id=server.id, xui_id=item['id']).first()
-        if exists:
-            exists.remark = item['remark']
-            exists.port = item['port']
-            exists.protocol = item['protocol']
-            updated += 1
-        else:
-            new_inbound = Inbound(
-                server_id=server.id,
-                xui_id=item['id'],
-                remark=item['remark'],
-                port=item['port'],
-                protocol=item['protocol']
+        # دریافت stream لیست: فقط یک اینباند (با settings حجیمش) همزمان در حافظه است
+        rows, seen = [], set()
+        added, updated = 0, 0
+        try:
+            async for item in client.iter_inbounds():
+                seen.add(item['id'])
+                row = {
+                    'server_id': server.id,
+                    'xui_id': item['id'],
+                    'remark': item['remark'],
+                    'port': item['port'],
+                    'protocol': item['protocol'],
+                    'is_active': True
+                }
+                old = existing.get(item['id'])
+                if old is None:
+                    added += 1
+                elif (old.remark, old.port, old.protocol, old.is_active) != (row['remark'], row['port'], row['protocol'], True):
+                    updated += 1
+                else:
+                    continue
+                rows.append(row)
+        except PanelError as e:
+            await bot.send_message(call.message.chat.id, f"❌ خطا در دریافت لیست اینباندها: {e}")
+            return
+
+        if not seen:
+            # لیست خالی پنل باعث غیرفعال شدن همه اینباندها نمی‌شود
+            await bot.send_message(call.message.chat.id, "⚠️ هیچ اینباندی یافت نشد.")
+            return
+
+        # اینباندهایی که از پنل حذف شده‌اند غیرفعال می‌شوند (اتصال به پلن‌ها حفظ می‌شود)
+        vanished = [xui_id for xui_id, old in existing.items() if xui_id not in seen and old.is_active]
+
+        try:
+            await abulk_upsert(session, Inbound, rows, ['server_id', 'xui_id'], ['remark', 'port', 'protocol', 'is_active'])
+            if vanished:
+                await session.execute(
+                    update(Inbound)
+                    .where(Inbound.server_id == server.id, Inbound.xui_id.in_(vanished))
+                    .values(is_active=False)
+                )
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            await bot.send_message(call.message.chat.id, f"❌ خطا در ذخیره اینباندها: {e}")
+            return
+
+    if rows or vanished:
+        invalidate_plan_catalog()
+    await bot.send_message(
+        call.message.chat.id,
+        f"✅ عملیات موفق!\n➕ جدید: {added}\n🔄 آپدیت: {updated}\n⛔ غیرفعال: {len(vanished)}\n✔️ بدون تغییر: {len(seen) - added - updated}"
+    )
+    await show_server_details(bot, call.message, server_id)
+
+# --- گزارش مصرف (از جدول محلی، بدون درخواست به پنل‌ها) ---
+async def show_usage_report(bot, message):
+    async with AsyncSessionLocal() as session:
+        rows = (await session.execute(
+            select(
+                Server.name,
+                func.count(ClientUsage.id),
+                func.coalesce(func.sum(ClientUsage.up + ClientUsage.down), 0),
+                ServerSyncState.last_synced_at,
+                ServerSyncState.last_error
             )
-            session.add(new_inbound)
-            added += 1
-            
-    session.commit()
-    session.close()
-    bot.send_message(call.message.chat.id, f"✅ عملیات موفق!\n➕ جدید: {added}\n🔄 آپدیت: {updated}")
-    show_server_details(bot, call.message, server_id)
+            .outerjoin(ClientUsage, ClientUsage.server_id == Server.id)
+            .outerjoin(ServerSyncState, ServerSyncState.server_id == Server.id)
+            .group_by(Server.id, Server.name, ServerSyncState.last_synced_at, ServerSyncState.last_error)
+        )).all()
+
+    text = "📊 گزارش مصرف سرورها:\n"
+    for name, clients, used, synced_at, error in rows:
+        synced = synced_at.strftime('%m-%d %H:%M') if synced_at else "—"
+        text += f"\n🖥 {name}\n👥 {clients} سرویس | 💾 {used / 1024**3:.1f} GB\n🔄 آخرین همگام‌سازی: {synced}\n"
+        if error:
+            text += f"⚠️ {error}\n"
+    if not rows:
+        text += "\nهیچ سروری ثبت نشده است."
+
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("🔙", callback_data="admin_back_main"))
+    await bot.edit_message_text(text, message.chat.id, message.message_id, reply_markup=markup)
+
+# --- تطبیق پنل و دیتابیس ---
+async def run_reconcile(bot, message, apply=False, delete_orphans=False):
+    # تطبیق روی همان کلاینت sync و سشن sync سرویس reconcile اجرا می‌شود (فقط ادمین، کم‌تکرار)
+    reports = await asyncio.to_thread(reconcile_all, apply=apply, delete_orphans=delete_orphans)
+
+    text = "🔍 تطبیق پنل‌ها با دیتابیس:\n"
+    totals = {CREATE: 0, DISABLE: 0, DELETE: 0}
+    for r in reports:
+        counts = {a: sum(1 for f in r['fixes'] if f.action == a) for a in totals}
+        for a in totals:
+            totals[a] += counts[a]
+        text += f"\n🖥 {r['server']}\n➕ ساخت: {counts[CREATE]} | ⛔ غیرفعال: {counts[DISABLE]} | 🗑 یتیم: {counts[DELETE]}\n"
+        if r['applied']:
+            a = r['applied']
+            text += f"✅ اعمال شد: ➕{a[CREATE]} ⛔{a[DISABLE]} 🗑{a[DELETE]} | ❌ ناموفق: {a['failed']}\n"
+        if r['error']:
+            text += f"⚠️ {r['error']}\n"
+    if not reports:
+        text += "\nهیچ سرور فعالی ثبت نشده است."
+
+    markup = types.InlineKeyboardMarkup()
+    if not apply and (totals[CREATE] or totals[DISABLE]):
+        markup.add(types.InlineKeyboardButton("✅ اعمال ساخت/غیرفعال‌سازی", callback_data="admin_reconcile_apply"))
+    if not delete_orphans and totals[DELETE]:
+        markup.add(types.InlineKeyboardButton("🗑 اعمال همه + حذف یتیم‌ها", callback_data="admin_reconcile_orphans"))
+    markup.add(types.InlineKeyboardButton("🔙", callback_data="admin_back_main"))
+    await bot.edit_message_text(text, message.chat.id, message.message_id, reply_markup=markup)
+
+# --- صف ساخت سرویس ---
+async def show_provision_jobs(bot, message):
+    async with AsyncSessionLocal() as session:
+        counts = dict((await session.execute(
+            select(ProvisionJob.status, func.count(ProvisionJob.id)).group_by(ProvisionJob.status)
+        )).all())
+        recent = (await session.scalars(
+            select(ProvisionJob)
+            .where(ProvisionJob.status.in_([PENDING, RUNNING, FAILED]))
+            .order_by(ProvisionJob.id.desc())
+            .limit(10)
+        )).all()
+
+    text = (
+        "📦 صف ساخت سرویس:\n"
+        f"⏳ در انتظار: {counts.get(PENDING, 0)} | 🔄 در حال اجرا: {counts.get(RUNNING, 0)}\n"
+        f"✅ انجام‌شده: {counts.get(DONE, 0)} | ❌ ناموفق: {counts.get(FAILED, 0)}\n"
+    )
+    for job in recent:
+        text += f"\n#{job.id} پرداخت {job.payment_id} | {job.status} | تلاش {job.attempts}"
+        if job.last_error:
+            text += f"\n⚠️ {job.last_error[:100]}"
+    await bot.send_message(message.chat.id, text)
 
 # --- توابع پلن ---
-def show_plans_menu(bot, message):
+async def show_plans_menu(bot, message):
     markup = types.InlineKeyboardMarkup()
     markup.add(types.InlineKeyboardButton("➕ افزودن پلن", callback_data="admin_add_plan"))
     markup.add(types.InlineKeyboardButton("📋 لیست پلن‌ها", callback_data="admin_list_plans"))
     markup.add(types.InlineKeyboardButton("🔙", callback_data="admin_back_main"))
-    bot.edit_message_text("مدیریت پلن‌ها:", message.chat.id, message.message_id, reply_markup=markup)
+    await bot.edit_message_text("مدیریت پلن‌ها:", message.chat.id, message.message_id, reply_markup=markup)
 
-def start_add_plan(bot, message):
-    admin_states[message.chat.id] = {'step': 'plan_name', 'data': {}}
-    bot.edit_message_text("📝 نام پلن:", message.chat.id, message.message_id, reply_markup=cancel_btn())
+async def start_add_plan(bot, message):
+    await admin_states.set(message.chat.id, {'step': 'plan_name', 'data': {}})
+    await bot.edit_message_text("📝 نام پلن:", message.chat.id, message.message_id, reply_markup=cancel_btn())
 
-def save_plan_to_db(bot, message, data):
-    session = get_db()
-    try:
-        new_plan = Plan(
-            name=data['name'], 
-            price=data['price'], 
-            volume_gb=data['volume_gb'], 
-            duration_days=data['duration_days'],
-            limit_ip=data['limit_ip'] # <--- اضافه شد
-        )
-        
-        # اتصال به تمام اینباندهای فعال (برای حل مشکل ساخته نشدن روی همه پورت‌ها)
-        # مطمئن شوید که اینباند فعال در دیتابیس دارید!
-        all_inbounds = session.query(Inbound).filter_by(is_active=True).all()
-        
-        if not all_inbounds:
-             bot.send_message(message.chat.id, "⚠️ هشدار: هیچ اینباندی در دیتابیس نیست! پلن ساخته شد اما به سروری وصل نیست.")
-        else:
-            for inbound in all_inbounds:
-                new_plan.inbounds.append(inbound)
-            
-        session.add(new_plan)
-        session.commit()
-        bot.send_message(message.chat.id, f"✅ پلن **{data['name']}** ساخته شد.\n(متصل به {len(all_inbounds)} اینباند)")
-    except Exception as e:
-        bot.send_message(message.chat.id, f"Error: {e}")
-    finally:
-        session.close()
-
-def list_plans(bot, message):
-    session = get_db()
-    plans = session.query(Plan).all()
-    session.close()
+async def list_plans(bot, message):
+    async with AsyncSessionLocal() as session:
+        plans = (await session.scalars(select(Plan).order_by(Plan.id))).all()
     if not plans: 
-        try: bot.answer_callback_query(message.id, "خالی است.") 
+        try: await bot.answer_callback_query(message.id, "خالی است.") 
         except: pass
         return
     
@@ -493,20 +616,19 @@ def list_plans(bot, message):
         text += f"🔹 {p.name} - {int(p.price):,} T\n"
         markup.add(types.InlineKeyboardButton(f"🗑 حذف {p.name}", callback_data=f"plan_del_{p.id}"))
     markup.add(types.InlineKeyboardButton("🔙", callback_data="admin_plans_menu"))
-    bot.edit_message_text(text, message.chat.id, message.message_id, reply_markup=markup)
+    await bot.edit_message_text(text, message.chat.id, message.message_id, reply_markup=markup)
 
 # FIX: دریافت 'call' به جای 'message'
-def delete_plan(bot, call, pid):
-    try: bot.answer_callback_query(call.id, "در حال حذف...")
+async def delete_plan(bot, call, pid):
+    try: await bot.answer_callback_query(call.id, "در حال حذف...")
     except: pass
     
-    session = get_db()
-    p = session.query(Plan).get(pid)
-    if p:
-        session.delete(p)
-        session.commit()
-        list_plans(bot, call.message)
-    session.close()
+    async with AsyncSessionLocal() as session:
+        deleted = await session.run_sync(_delete_row, Plan, pid)
+        await session.commit()
+    if deleted:
+        invalidate_plan_catalog()
+        await list_plans(bot, call.message)
 
 
     
@@ -514,12 +636,11 @@ def delete_plan(bot, call, pid):
 
 # در انتهای فایل handlers/admin.py
 
-def show_server_selection_for_plan(bot, message):
-    session = get_db()
-    # استفاده از joinedload برای لود کردن همزمان اینباندها
+async def show_server_selection_for_plan(bot, message):
+    # اینباندها همراه سرورها لود می‌شوند (selectinload)
     # این کار باعث می‌شود بعد از بسته شدن سشن، ارور DetachedInstanceError ندهد
-    servers = session.query(Server).options(joinedload(Server.inbounds)).filter_by(is_active=True).all()
-    session.close()
+    async with AsyncSessionLocal() as session:
+        servers = await aget_servers(session, active_only=True)
     
     markup = types.InlineKeyboardMarkup()
     for s in servers:
@@ -529,28 +650,20 @@ def show_server_selection_for_plan(bot, message):
             
     markup.add(types.InlineKeyboardButton("❌ لغو", callback_data="admin_cancel_state"))
     
-    bot.send_message(message.chat.id, "🌍 **سرور مورد نظر را انتخاب کنید:**\n(این پلن روی کدام سرور فعال باشد؟)", reply_markup=markup, parse_mode="Markdown")
-def show_inbound_selection_for_plan(bot, message, server_id, refresh=False):
-    session = get_db()
-    # اینجا هم joinedload استفاده می‌کنیم
-    server = session.query(Server).options(joinedload(Server.inbounds)).get(server_id)
+    await bot.send_message(message.chat.id, "🌍 **سرور مورد نظر را انتخاب کنید:**\n(این پلن روی کدام سرور فعال باشد؟)", reply_markup=markup, parse_mode="Markdown")
+async def show_inbound_selection_for_plan(bot, message, server_id, selected_ids=(), refresh=False):
+    # اینجا هم اینباندها همراه سرور لود می‌شوند
+    async with AsyncSessionLocal() as session:
+        server = await aget_server(session, server_id)
     
     # اگر سرور پیدا نشد یا حذف شده بود
     if not server:
-        session.close()
-        bot.answer_callback_query(message.id if refresh else message.message_id, "سرور یافت نشد.") # هندل کردن call vs message
+        await bot.answer_callback_query(message.id if refresh else message.message_id, "سرور یافت نشد.") # هندل کردن call vs message
         return
 
     # کپی کردن لیست اینباندها به یک متغیر لوکال تا بعد از بسته شدن سشن بماند
     inbounds = list(server.inbounds)
-    session.close()
     
-    user_id = message.chat.id
-    
-    selected_ids = []
-    if user_id in admin_states:
-        selected_ids = admin_states[user_id]['data'].get('selected_inbounds', [])
-
     markup = types.InlineKeyboardMarkup(row_width=1)
     
     for inbound in inbounds:
@@ -565,13 +678,12 @@ def show_inbound_selection_for_plan(bot, message, server_id, refresh=False):
     text = f"🔌 **اینباندهای سرور {server.name} را انتخاب کنید:**\nبا کلیک روی هر گزینه، آن را فعال/غیرفعال کنید."
     
     if refresh:
-        bot.edit_message_text(text, message.chat.id, message.message_id, reply_markup=markup, parse_mode="Markdown")
+        await bot.edit_message_text(text, message.chat.id, message.message_id, reply_markup=markup, parse_mode="Markdown")
     else:
-        bot.send_message(message.chat.id, text, reply_markup=markup, parse_mode="Markdown")
+        await bot.send_message(message.chat.id, text, reply_markup=markup, parse_mode="Markdown")
 
 # اصلاح تابع ذخیره نهایی برای استفاده از اینباندهای انتخاب شده
-def save_plan_to_db(bot, message, data):
-    session = get_db()
+async def save_plan_to_db(bot, message, data):
     try:
         new_plan = Plan(
             name=data['name'], 
@@ -581,18 +693,19 @@ def save_plan_to_db(bot, message, data):
             limit_ip=data['limit_ip']
         )
         
-        # --- تغییر مهم: اتصال فقط به اینباندهای انتخاب شده ---
-        selected_ids = data['selected_inbounds']
-        selected_inbounds = session.query(Inbound).filter(Inbound.id.in_(selected_ids)).all()
-        
-        for inbound in selected_inbounds:
-            new_plan.inbounds.append(inbound)
+        async with AsyncSessionLocal() as session:
+            # --- تغییر مهم: اتصال فقط به اینباندهای انتخاب شده ---
+            selected_ids = data['selected_inbounds']
+            selected_inbounds = await aget_inbounds(session, selected_ids)
             
-        session.add(new_plan)
-        session.commit()
+            new_plan.inbounds = list(selected_inbounds)
+                
+            session.add(new_plan)
+            await session.commit()
+        invalidate_plan_catalog()
         
         # حذف پیام منوی انتخاب برای تمیزی
-        bot.delete_message(message.chat.id, message.message_id)
+        await bot.delete_message(message.chat.id, message.message_id)
         
         msg = (
             f"✅ **پلن با موفقیت ساخته شد!**\n\n"
@@ -600,9 +713,7 @@ def save_plan_to_db(bot, message, data):
             f"🔌 متصل به: {len(selected_inbounds)} اینباند\n"
             f"💰 قیمت: {int(new_plan.price):,} تومان"
         )
-        bot.send_message(message.chat.id, msg, parse_mode="Markdown")
+        await bot.send_message(message.chat.id, msg, parse_mode="Markdown")
         
     except Exception as e:
-        bot.send_message(message.chat.id, f"Error: {e}")
-    finally:
-        session.close()
\ No newline at end of file
+        await bot.send_message(message.chat.id, f"Error: {e}")
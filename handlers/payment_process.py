@@ -1,12 +1,22 @@
 # handlers/payment_process.py
-import telebot
+import asyncio
 from telebot import types
+from telebot.async_telebot import AsyncTeleBot
 import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
-from database.base import SessionLocal
-from database.models import User, Plan, Payment, Purchase, Server, Inbound
-from services.xui import XUIClient
-from config import ADMIN_IDS
+from database.async_base import AsyncSessionLocal
+from database.models import Payment, Purchase, ProvisionJob
+from database.queries import aget_user, aget_payment, aset_pending_receipt, aget_pending_receipt, aclear_pending_receipt
+from services.xui import get_xui_client
+from services.xui_async import get_async_xui_client
+from services.circuit_breaker import get_breaker
+from services.plan_catalog import aget_plan_catalog
+from services.state_store import get_for_message
+from services.provision_queue import enqueue_job, finish_job, start_workers, wake_workers, FAILED
+from sqlalchemy import update
+from config import ADMIN_IDS, PROVISION_WORKERS, PROVISION_DEADLINE, RECEIPT_WAIT_TTL
 
 # تنظیمات کارت (بهتر است بعدا در دیتابیس باشد)
 CARD_INFO = """
@@ -21,22 +31,42 @@ RULES = """
 ۳. تحویل پس از تایید ادمین انجام می‌شود.
 """
 
-def register_payment_handlers(bot: telebot.TeleBot):
-    
-    # این تابع از user.py صدا زده می‌شود، اما برای هندل کردن عکس فیش، 
-    # باید یک هندلر سراسری داشته باشیم که وضعیت کاربر را چک کند؟
-    # راه ساده‌تر: استفاده از register_next_step_handler در start_card_payment
-    pass
+def register_payment_handlers(bot: AsyncTeleBot):
+
+    # عکس فیش (یا هر پیام دیگری) از کاربری که منتظر فیش است
+    # وضعیت در جدول pending_receipts است تا بعد از ری‌استارت و بین چند پروسه ربات بماند
+    async def is_awaiting_receipt(message):
+        return await get_for_message(pending_receipts, message) is not None
+
+    @bot.message_handler(func=is_awaiting_receipt, content_types=['photo', 'text', 'document', 'sticker'])
+    async def handle_receipt(message):
+        # همان plan_id که فیلتر خوانده (بدون کوئری دوباره)
+        await process_receipt(bot, message, await get_for_message(pending_receipts, message))
+
+    @bot.callback_query_handler(func=lambda call: call.data == 'receipt_cancel')
+    async def cancel_receipt(call):
+        async with AsyncSessionLocal() as session:
+            await aclear_pending_receipt(session, call.message.chat.id)
+            await session.commit()
+        await bot.answer_callback_query(call.id)
+        await bot.edit_message_text("❌ پرداخت لغو شد.", call.message.chat.id, call.message.message_id)
+
+class _PendingReceipts:
+    """plan_id فیش در انتظار هر chat، با همان رابط get وضعیت‌ها (برای get_for_message)"""
+
+    async def get(self, chat_id: int):
+        async with AsyncSessionLocal() as session:
+            return await aget_pending_receipt(session, chat_id)
+
+pending_receipts = _PendingReceipts()
 
 # توابع کمکی که user.py از آن‌ها استفاده می‌کند
 
-def start_card_payment(bot, message, plan_id):
-    session = SessionLocal()
-    plan = session.query(Plan).get(plan_id)
-    session.close()
+async def start_card_payment(bot, message, plan_id):
+    plan = (await aget_plan_catalog()).get(plan_id)
     
     if not plan:
-        bot.send_message(message.chat.id, "❌ خطا: پلن یافت نشد.")
+        await bot.send_message(message.chat.id, "❌ خطا: پلن یافت نشد.")
         return
 
     text = (
@@ -49,50 +79,61 @@ def start_card_payment(bot, message, plan_id):
     )
     
     markup = types.ForceReply(selective=True)
-    msg = bot.send_message(message.chat.id, text, reply_markup=markup, parse_mode="Markdown")
+    await bot.send_message(message.chat.id, text, reply_markup=markup, parse_mode="Markdown")
     
     # رفتن به مرحله دریافت عکس
-    bot.register_next_step_handler(msg, process_receipt, bot, plan_id)
+    async with AsyncSessionLocal() as session:
+        await aset_pending_receipt(session, message.chat.id, plan_id,
+                                   datetime.now() + timedelta(seconds=RECEIPT_WAIT_TTL))
+        await session.commit()
 
-def process_receipt(message, bot, plan_id):
+async def process_receipt(bot, message, plan_id):
     if message.content_type != 'photo':
-        msg = bot.send_message(message.chat.id, "❌ لطفاً فقط **عکس** ارسال کنید. دوباره تلاش کنید:")
-        bot.register_next_step_handler(msg, process_receipt, bot, plan_id)
+        # کاربر تا انقضای فیش در همین مرحله می‌ماند؛ با دکمه لغو از آن خارج می‌شود
+        markup = types.InlineKeyboardMarkup()
+        markup.add(types.InlineKeyboardButton("❌ لغو پرداخت", callback_data="receipt_cancel"))
+        await bot.send_message(message.chat.id, "❌ لطفاً فقط **عکس** ارسال کنید. دوباره تلاش کنید:", reply_markup=markup)
         return
 
     file_id = message.photo[-1].file_id
     user_id = message.from_user.id
     
-    session = SessionLocal()
     try:
-        user = session.query(User).filter_by(telegram_id=user_id).first()
-        plan = session.query(Plan).get(plan_id)
-        
-        # ثبت پرداخت
-        payment = Payment(
-            user_id=user.id,
-            plan_id=plan_id,
-            amount=plan.price,
-            status="pending",
-            receipt_image_id=file_id,
-            payment_method="card"
-        )
-        session.add(payment)
-        session.commit()
+        async with AsyncSessionLocal() as session:
+            # حذف شرطی: اگر همین فیش همزمان در پروسه/پیام دیگری ثبت شده باشد، دوباره ثبت نمی‌شود
+            if not await aclear_pending_receipt(session, message.chat.id):
+                return
+            user = await aget_user(session, user_id)
+            plan = (await aget_plan_catalog()).get(plan_id)
+            if not plan:
+                await session.commit()
+                await bot.send_message(message.chat.id, "❌ خطا: پلن یافت نشد.")
+                return
+            
+            # ثبت پرداخت
+            payment = Payment(
+                user_id=user.id,
+                plan_id=plan_id,
+                amount=plan.price,
+                status="pending",
+                receipt_image_id=file_id,
+                payment_method="card"
+            )
+            session.add(payment)
+            await session.commit()
         
-        bot.reply_to(message, "✅ فیش شما دریافت شد. منتظر تایید ادمین باشید.")
+        await bot.reply_to(message, "✅ فیش شما دریافت شد. منتظر تایید ادمین باشید.")
         
         # اطلاع به ادمین
-        notify_admins(bot, payment.id)
+        await notify_admins(bot, payment.id)
         
     except Exception as e:
-        bot.send_message(message.chat.id, f"Error: {e}")
-    finally:
-        session.close()
+        await bot.send_message(message.chat.id, f"Error: {e}")
 
-def notify_admins(bot, payment_id):
-    session = SessionLocal()
-    payment = session.query(Payment).get(payment_id)
+async def notify_admins(bot, payment_id, note=None):
+    """ارسال فیش به ادمین‌ها با دکمه تایید/رد؛ note (مثلاً خطای ساخت سرویس) به متن اضافه می‌شود"""
+    async with AsyncSessionLocal() as session:
+        payment = await aget_payment(session, payment_id)
     user = payment.user
     plan = payment.plan
     
@@ -102,6 +143,8 @@ def notify_admins(bot, payment_id):
         f"📦 {plan.name} | {int(plan.price):,} T\n"
         f"📅 {datetime.now().strftime('%H:%M')}"
     )
+    if note:
+        caption += f"\n\n{note}"
     
     markup = types.InlineKeyboardMarkup()
     markup.add(types.InlineKeyboardButton("✅ تایید", callback_data=f"pay_approve_{payment.id}"))
@@ -109,65 +152,206 @@ def notify_admins(bot, payment_id):
     
     for admin in ADMIN_IDS:
         try:
-            bot.send_photo(admin, payment.receipt_image_id, caption=caption, reply_markup=markup)
+            await bot.send_photo(admin, payment.receipt_image_id, caption=caption, reply_markup=markup)
         except: pass
-    session.close()
 
 # هندلر تایید/رد ادمین (این باید در فایل اصلی رجیستر شود)
-def register_callback_handlers(bot: telebot.TeleBot):
+def register_callback_handlers(bot: AsyncTeleBot):
     @bot.callback_query_handler(func=lambda call: call.data.startswith('pay_'))
-    def handle_pay_decision(call):
+    async def handle_pay_decision(call):
         if call.from_user.id not in ADMIN_IDS: return
         
         action, pid = call.data.split('_')[1], int(call.data.split('_')[2])
-        session = SessionLocal()
-        payment = session.query(Payment).get(pid)
-        
-        if not payment or payment.status != "pending":
-            bot.answer_callback_query(call.id, "قبلاً بررسی شده.")
-            session.close()
-            return
-
-        if action == "approve":
-            bot.edit_message_caption(call.message.caption + "\n\n✅ **تایید شد**", call.message.chat.id, call.message.message_id)
+        async with AsyncSessionLocal() as session:
+            payment = await aget_payment(session, pid)
             
-            # ساخت سرویس
-            res = create_service(payment, session)
-            if res['success']:
-                payment.status = "approved"
-                session.commit()
-                
-                # پیام به کاربر
-                user_msg = (
-                    "🎉 **پرداخت تایید شد!**\n"
-                    f"✅ سرویس: {payment.plan.name}\n"
-                    f"🔗 لینک: `{res['link']}`\n\n"
-                    "👇 دریافت کانفیگ تکی:"
+            if not payment or payment.status != "pending":
+                await bot.answer_callback_query(call.id, "قبلاً بررسی شده.")
+                return
+
+            if action == "approve":
+                # تغییر وضعیت شرطی تا دو تایید همزمان دو job نسازند
+                res = await session.execute(
+                    update(Payment).where(Payment.id == pid, Payment.status == "pending").values(status="processing")
                 )
-                markup = types.InlineKeyboardMarkup()
-                markup.add(types.InlineKeyboardButton("⚙️ کانفیگ تکی", callback_data=f"get_configs_{res['purchase_id']}"))
-                bot.send_message(payment.user.telegram_id, user_msg, parse_mode="Markdown", reply_markup=markup)
-            else:
-                bot.send_message(call.message.chat.id, f"❌ خطا در پنل: {res['error']}")
-        
-        elif action == "reject":
-            payment.status = "rejected"
-            session.commit()
-            bot.edit_message_caption(call.message.caption + "\n\n❌ **رد شد**", call.message.chat.id, call.message.message_id)
-            bot.send_message(payment.user.telegram_id, "❌ پرداخت شما رد شد.")
+                if res.rowcount != 1:
+                    await bot.answer_callback_query(call.id, "قبلاً بررسی شده.")
+                    return
+                # ساخت سرویس در صف انجام می‌شود؛ نتیجه به کاربر و همین ادمین پیام داده می‌شود
+                enqueue_job(session, pid, notify_chat_id=call.message.chat.id)
+                await session.commit()
+                wake_workers()
+                await bot.edit_message_caption(call.message.caption + "\n\n✅ **تایید شد** (⏳ در صف ساخت سرویس)", call.message.chat.id, call.message.message_id)
+            
+            elif action == "reject":
+                payment.status = "rejected"
+                await session.commit()
+                await bot.edit_message_caption(call.message.caption + "\n\n❌ **رد شد**", call.message.chat.id, call.message.message_id)
+                await bot.send_message(payment.user.telegram_id, "❌ پرداخت شما رد شد.")
+
+# ==========================
+# اجرای jobهای صف ساخت سرویس (services/provision_queue.py)
+# ==========================
+async def run_provision_job(bot, job_id):
+    async with AsyncSessionLocal() as session:
+        job = await session.get(ProvisionJob, job_id)
+        payment = await aget_payment(session, job.payment_id)
 
-        session.close()
+        # مشخصات کلاینت قبل از تماس با پنل‌ها ثبت می‌شود تا تلاش بعدی همان کلاینت را بسازد
+        resume = bool(job.uuid)
+        if not resume:
+            job.uuid, job.sub_id = new_client_ids()
+            await session.commit()
+
+        try:
+            res = await acreate_service(payment, session, job.uuid, job.sub_id, resume=resume)
+        except Exception as e:
+            # rollback همه آبجکت‌ها را expire می‌کند؛ job و پرداخت دوباره خوانده می‌شوند
+            await session.rollback()
+            job = await session.get(ProvisionJob, job_id, populate_existing=True)
+            payment = await aget_payment(session, job.payment_id)
+            res = {'success': False, 'error': str(e)}
+
+        if res['success']:
+            payment.status = "approved"
+            finish_job(job, purchase_id=res['purchase_id'])
+        elif finish_job(job, error=res['error']) == FAILED:
+            # پرداخت دوباره قابل تایید می‌شود
+            payment.status = "pending"
+        await session.commit()
+
+    if res['success']:
+        # پیام به کاربر
+        user_msg = (
+            "🎉 **پرداخت تایید شد!**\n"
+            f"✅ سرویس: {payment.plan.name}\n"
+            f"🔗 لینک: `{res['link']}`\n\n"
+            "👇 دریافت کانفیگ تکی:"
+        )
+        markup = types.InlineKeyboardMarkup()
+        markup.add(types.InlineKeyboardButton("⚙️ کانفیگ تکی", callback_data=f"get_configs_{res['purchase_id']}"))
+        await bot.send_message(payment.user.telegram_id, user_msg, parse_mode="Markdown", reply_markup=markup)
+
+        if res['failed'] and job.notify_chat_id:
+            names = ", ".join(f"{t.server.name}:{t.xui_id}" for t in res['failed'])
+            await bot.send_message(job.notify_chat_id, f"⚠️ ساخت روی این اینباندها ناموفق بود: {names}")
+    elif job.status == FAILED:
+        if job.notify_chat_id:
+            await bot.send_message(job.notify_chat_id, f"❌ خطا در پنل: {res['error']}\n(بعد از {job.attempts} تلاش؛ پرداخت #{payment.id} دوباره برای تایید ارسال شد)")
+        # دکمه‌های پیام قبلی با تایید حذف شده‌اند؛ فیش با دکمه‌های تازه دوباره فرستاده می‌شود
+        await notify_admins(bot, payment.id, note=f"⚠️ ساخت سرویس بعد از {job.attempts} تلاش ناموفق بود: {res['error'][:200]}")
+
+def start_provision_workers(bot):
+    start_workers(lambda job_id: run_provision_job(bot, job_id))
 
 # در فایل handlers/payment_process.py
 
-def create_service(payment, session):
-    plan = payment.plan
-    if not plan.inbounds:
-        return {'success': False, 'error': "پلن به هیچ سروری وصل نیست"}
-    
-    new_uuid = str(uuid.uuid4())
-    # تولید ساب آیدی تمیز (۱۶ کاراکتر)
-    new_sub_id = str(uuid.uuid4()).replace('-', '')[:16]
+# اطلاعات جداشده از ORM تا تردها/تسک‌های ساخت کلاینت به سشن دیتابیس دست نزنند
+ServerRef = namedtuple('ServerRef', 'id name panel_url username password subscription_url')
+ProvisionTarget = namedtuple('ProvisionTarget', 'inbound_id xui_id flow server')
+
+# استخر مشترک تردها برای ساخت همزمان کلاینت روی اینباندها (مسیر sync)
+_provision_pool = ThreadPoolExecutor(max_workers=max(1, PROVISION_WORKERS), thread_name_prefix="provision")
+
+def _provision_targets(plan):
+    targets = []
+    for inbound in plan.inbounds:
+        # اینباندی که از پنل حذف شده (غیرفعال در همگام‌سازی) رد می‌شود
+        if inbound.is_active is False:
+            continue
+        s = inbound.server
+        targets.append(ProvisionTarget(
+            inbound_id=inbound.id,
+            xui_id=inbound.xui_id,
+            flow="xtls-rprx-vision" if "reality" in (inbound.protocol or "").lower() else "",
+            server=ServerRef(s.id, s.name, s.panel_url, s.username, s.password, s.subscription_url)
+        ))
+    return targets
+
+def _add_client_on_target(target, client_kwargs):
+    client = get_xui_client(target.server)
+    if not client.ensure_login():
+        return False, "login failed"
+    ok = client.add_client(inbound_id=target.xui_id, flow=target.flow, **client_kwargs)
+    return bool(ok), None if ok else "add_client failed"
+
+async def _aadd_client_on_target(target, client_kwargs, resume=False):
+    client = get_async_xui_client(target.server)
+    if not await client.ensure_login():
+        return False, "login failed"
+    # تلاش مجدد یک job: کلاینتی که در اجرای قبلی ساخته شده دوباره ساخته نمی‌شود
+    if resume and await client.get_client_info(target.xui_id, client_kwargs['uuid'], fresh=True):
+        return True, None
+    ok = await client.add_client(inbound_id=target.xui_id, flow=target.flow, **client_kwargs)
+    return bool(ok), None if ok else "add_client failed"
+
+def _target_kwargs(targets, client_kwargs):
+    """
+    ایمیل کلاینت در کل یک پنل یکتاست؛ روی اینباندهای بعدی همان سرور
+    پسوند xui_id می‌گیرد (همان قاعده services/reconcile.py)
+    """
+    seen, out = set(), []
+    for t in targets:
+        kwargs = client_kwargs
+        if t.server.id in seen:
+            kwargs = {**client_kwargs, 'email': f"{client_kwargs['email']}-{t.xui_id}"}
+        seen.add(t.server.id)
+        out.append(kwargs)
+    return out
+
+def _collect_results(targets, futures):
+    """(target, ok, error) برای هر هدف؛ futureهای تمام‌نشده لغو می‌شوند"""
+    results = []
+    for target, future in zip(targets, futures):
+        if future is None:
+            results.append((target, False, "server unhealthy"))
+            continue
+        if not future.done():
+            future.cancel()
+            results.append((target, False, "timeout"))
+            continue
+        try:
+            ok, error = future.result()
+        except Exception as e:
+            ok, error = False, str(e)
+        results.append((target, ok, error))
+    return results
+
+def provision_on_inbounds(targets, client_kwargs, deadline=None):
+    """
+    ساخت کلاینت به صورت همزمان روی همه اینباندها (حتی روی سرورهای مختلف).
+    خروجی: لیست (target, ok, error) به ترتیب ورودی.
+    بعد از پایان همه یا رسیدن به سقف زمان برمی‌گردد؛ موارد باقی‌مانده خطای timeout می‌گیرند.
+    """
+    deadline = PROVISION_DEADLINE if deadline is None else deadline
+    # سرورهایی که circuit breaker آن‌ها باز است اصلاً ارسال نمی‌شوند
+    futures = [
+        None if get_breaker(t.server.id).is_open() else _provision_pool.submit(_add_client_on_target, t, kwargs)
+        for t, kwargs in zip(targets, _target_kwargs(targets, client_kwargs))
+    ]
+    wait([f for f in futures if f], timeout=deadline)
+    return _collect_results(targets, futures)
+
+async def aprovision_on_inbounds(targets, client_kwargs, deadline=None, resume=False):
+    """نسخه async تابع provision_on_inbounds: یک تسک برای هر اینباند روی event loop جاری"""
+    deadline = PROVISION_DEADLINE if deadline is None else deadline
+    tasks = [
+        None if get_breaker(t.server.id).is_open() else asyncio.ensure_future(_aadd_client_on_target(t, kwargs, resume))
+        for t, kwargs in zip(targets, _target_kwargs(targets, client_kwargs))
+    ]
+    pending = [t for t in tasks if t]
+    if pending:
+        await asyncio.wait(pending, timeout=deadline)
+    return _collect_results(targets, tasks)
+
+def new_client_ids():
+    """UUID و ساب آیدی تمیز (۱۶ کاراکتر) برای یک کلاینت جدید"""
+    return str(uuid.uuid4()), str(uuid.uuid4()).replace('-', '')[:16]
+
+def _new_client(plan, new_uuid=None, new_sub_id=None):
+    """مشخصات کلاینت جدید برای پلن؛ خروجی: (client_kwargs، تاریخ انقضا برای دیتابیس)"""
+    if not (new_uuid and new_sub_id):
+        new_uuid, new_sub_id = new_client_ids()
     email = f"u{new_sub_id[:8]}"
     
     # مدیریت زمان (0 = نامحدود)
@@ -178,59 +362,87 @@ def create_service(payment, session):
         expire_time = 0
         db_expire = None
 
-    # مدیریت IP Limit (اگر 0 بود یعنی نامحدود)
-    limit_ip_val = plan.limit_ip
+    client_kwargs = dict(
+        email=email,
+        uuid=new_uuid,
+        sub_id=new_sub_id,
+        total_gb=plan.volume_gb,
+        expiry_time=expire_time,
+        enable=True,
+        limit_ip=plan.limit_ip # مدیریت IP Limit (اگر 0 بود یعنی نامحدود)
+    )
+    return client_kwargs, db_expire
 
-    created_count = 0
+def _purchase_from_results(payment, results, client_kwargs, db_expire):
+    """
+    خرید حاصل از نتیجه ساخت کلاینت‌ها (لینک از اولین سرور موفق)؛
+    خروجی: (Purchase یا None اگر روی هیچ اینباندی ساخته نشد، اینباندهای ناموفق)
+    """
     main_server = None
+    failed = []
+    for target, ok, error in results:
+        if ok:
+            print(f"✅ Created on Inbound {target.xui_id} ({target.server.name})")
+            if main_server is None:
+                main_server = target.server
+        else:
+            print(f"❌ Failed on Inbound {target.xui_id} ({target.server.name}): {error}")
+            failed.append(target)
+
+    if not main_server:
+        return None, failed
+    link = f"{main_server.subscription_url.rstrip('/')}/{client_kwargs['sub_id']}"
+    pur = Purchase(
+        user_id=payment.user_id,
+        plan_id=payment.plan.id,
+        uuid=client_kwargs['uuid'],
+        sub_link=link, 
+        expire_date=db_expire,
+        is_active=True
+    )
+    return pur, failed
+
+def create_service(payment, session):
+    plan = payment.plan
+    targets = _provision_targets(plan)
+    if not targets:
+        return {'success': False, 'error': "پلن به هیچ سروری وصل نیست"}
     
-    print(f"--- Creating User: {email} ---")
-    print(f"Targets: {len(plan.inbounds)} inbounds")
+    client_kwargs, db_expire = _new_client(plan)
+    print(f"--- Creating User: {client_kwargs['email']} ---")
+    print(f"Targets: {len(targets)} inbounds")
 
-    for inbound in plan.inbounds:
-        server = inbound.server
-        main_server = server
-        
-        try:
-            client = XUIClient(server.panel_url, server.username, server.password)
-            if not client.login():
-                print(f"❌ Failed to login to server: {server.name}")
-                continue
-            
-            ok = client.add_client(
-                inbound_id=inbound.xui_id,
-                email=email,
-                uuid=new_uuid,
-                sub_id=new_sub_id,
-                total_gb=plan.volume_gb,
-                expiry_time=expire_time,
-                enable=True,
-                limit_ip=limit_ip_val, # <--- استفاده از مقدار پلن
-                flow="xtls-rprx-vision" if "reality" in inbound.protocol.lower() else ""
-            )
-            
-            if ok:
-                print(f"✅ Created on Inbound {inbound.xui_id} ({server.name})")
-                created_count += 1
-            else:
-                print(f"❌ Failed to add client on Inbound {inbound.xui_id}")
-        
-        except Exception as e:
-            print(f"⚠️ Exception for inbound {inbound.id}: {e}")
+    results = provision_on_inbounds(targets, client_kwargs)
 
-    if created_count > 0 and main_server:
-        link = f"{main_server.subscription_url.rstrip('/')}/{new_sub_id}"
-        
-        pur = Purchase(
-            user_id=payment.user_id,
-            plan_id=plan.id,
-            uuid=new_uuid,
-            sub_link=link, 
-            expire_date=db_expire,
-            is_active=True
-        )
+    pur, failed = _purchase_from_results(payment, results, client_kwargs, db_expire)
+    if pur:
         session.add(pur)
         session.flush()
-        return {'success': True, 'link': link, 'purchase_id': pur.id}
+        return {'success': True, 'link': pur.sub_link, 'purchase_id': pur.id, 'failed': failed}
     
-    return {'success': False, 'error': "خطا در تمام سرورها"}
\ No newline at end of file
+    return {'success': False, 'error': "خطا در تمام سرورها"}
+
+async def acreate_service(payment, session, client_uuid=None, sub_id=None, resume=False):
+    """
+    نسخه async تابع create_service (اجرا در صف ساخت سرویس).
+    payment باید با پلن، اینباندها و سرورها لود شده باشد (aget_payment).
+    client_uuid/sub_id ثابت و resume=True برای تلاش مجدد همان کلاینت است.
+    """
+    plan = payment.plan
+    targets = _provision_targets(plan)
+    if not targets:
+        return {'success': False, 'error': "پلن به هیچ سروری وصل نیست"}
+
+    client_kwargs, db_expire = _new_client(plan, client_uuid, sub_id)
+    print(f"--- Creating User: {client_kwargs['email']} ---")
+    print(f"Targets: {len(targets)} inbounds")
+
+    results = await aprovision_on_inbounds(targets, client_kwargs, resume=resume)
+
+    pur, failed = _purchase_from_results(payment, results, client_kwargs, db_expire)
+    if pur:
+        session.add(pur)
+        await session.flush()
+        return {'success': True, 'link': pur.sub_link, 'purchase_id': pur.id, 'failed': failed}
+
+    return {'success': False, 'error': "خطا در تمام سرورها"}
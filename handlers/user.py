@@ -1,38 +1,38 @@
 # handlers/user.py (نسخه نهایی و اصلاح شده)
 import uuid
-import telebot
 from telebot import types
+from telebot.async_telebot import AsyncTeleBot
 from datetime import datetime, timedelta
-from database.base import SessionLocal
+from database.async_base import AsyncSessionLocal
 from database.models import User, Plan, Server, Inbound, Purchase
-from services.xui import XUIClient
-from config import ADMIN_IDS
+from database.queries import aget_active_purchases, aget_purchase_with_servers, aupsert_user
+from services.plan_catalog import aget_plan_catalog
+from services.xui import XUIClient, TTLCache
+from services.state_store import make_state_store
+from config import ADMIN_IDS, SEEN_USERS_CACHE_SIZE, SEEN_USERS_CACHE_TTL
 from handlers.payment_process import start_card_payment 
 
-user_steps = {}
+# پلن انتخاب‌شده هر کاربر تا زدن دکمه پرداخت (کلید: telegram id)
+user_steps = make_state_store('user')
 
-def get_db():
-    return SessionLocal()
+# telegram_id --> (first_name, username) کاربرانی که اخیراً ثبت/به‌روز شده‌اند
+_seen_users = TTLCache(ttl=SEEN_USERS_CACHE_TTL, maxsize=SEEN_USERS_CACHE_SIZE)
 
-def register_user_handlers(bot: telebot.TeleBot):
+def register_user_handlers(bot: AsyncTeleBot):
     
     @bot.message_handler(commands=['start'])
-    def cmd_start(message):
+    async def cmd_start(message):
         telegram_id = message.from_user.id
-        session = get_db()
-        user = session.query(User).filter_by(telegram_id=telegram_id).first()
-        if not user:
-            user = User(
-                telegram_id=telegram_id,
-                first_name=message.from_user.first_name,
-                username=message.from_user.username
-            )
-            session.add(user)
-            session.commit()
-        session.close()
-        show_main_menu(bot, message.chat.id, message.from_user.id)
-
-    def show_main_menu(bot, chat_id, user_id):
+        profile = (message.from_user.first_name, message.from_user.username)
+        # کاربر تکراری با همان نام: بدون رفتن به دیتابیس
+        if _seen_users.get(telegram_id) != profile:
+            async with AsyncSessionLocal() as session:
+                await aupsert_user(session, telegram_id, *profile)
+                await session.commit()
+            _seen_users.set(telegram_id, profile)
+        await show_main_menu(bot, message.chat.id, message.from_user.id)
+
+    async def show_main_menu(bot, chat_id, user_id):
         markup = types.InlineKeyboardMarkup(row_width=2)
         btn_buy = types.InlineKeyboardButton("🛒 خرید سرویس", callback_data="main_buy")
         btn_services = types.InlineKeyboardButton("👤 سرویس‌های من", callback_data="main_services")
@@ -44,62 +44,52 @@ def register_user_handlers(bot: telebot.TeleBot):
             markup.add(types.InlineKeyboardButton("⚙️ پنل مدیریت", callback_data="main_admin_panel"))
         
         text = f"سلام دوست من 👋\nبه ربات هوشمند ما خوش آمدید.\n\nاز منوی زیر انتخاب کنید:"
-        bot.send_message(chat_id, text, reply_markup=markup)
+        await bot.send_message(chat_id, text, reply_markup=markup)
 
     @bot.callback_query_handler(func=lambda call: call.data.startswith('main_'))
-    def handle_main_menu(call):
+    async def handle_main_menu(call):
         action = call.data
         if action == "main_buy":
-            show_plans(bot, call.message)
+            await show_plans(bot, call.message)
         elif action == "main_services":
-            show_user_services(bot, call.message)
+            await show_user_services(bot, call.message, call.from_user.id)
         elif action == "main_wallet":
-            bot.answer_callback_query(call.id, "به زودی...")
+            await bot.answer_callback_query(call.id, "به زودی...")
         elif action == "main_support":
-            bot.answer_callback_query(call.id, "پیام خود را ارسال کنید.")
+            await bot.answer_callback_query(call.id, "پیام خود را ارسال کنید.")
         elif action == "main_admin_panel":
             pass 
 
-    # 1. نمایش پلن‌ها
-    def show_plans(bot, message):
-        session = get_db()
-        plans = session.query(Plan).filter_by(is_active=True).all()
-        session.close()
+    # 1. نمایش پلن‌ها (از کاتالوگ کش‌شده، بدون کوئری دیتابیس)
+    async def show_plans(bot, message):
+        markup = (await aget_plan_catalog()).keyboard
 
-        if not plans:
-            bot.edit_message_text("❌ در حال حاضر پلنی وجود ندارد.", message.chat.id, message.message_id)
+        if not markup:
+            await bot.edit_message_text("❌ در حال حاضر پلنی وجود ندارد.", message.chat.id, message.message_id)
             return
 
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        for p in plans:
-            # فرمت قیمت با کاما
-            price_fmt = "{:,}".format(int(p.price))
-            btn_text = f"💎 {p.name} | {p.volume_gb} GB | {p.duration_days} روز | {price_fmt} T"
-            markup.add(types.InlineKeyboardButton(btn_text, callback_data=f"buy_plan_{p.id}"))
-        
-        markup.add(types.InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main"))
-        
         # استفاده از HTML به جای Markdown برای جلوگیری از ارور
         try:
-            bot.edit_message_text("📋 <b>لطفاً تعرفه مورد نظر را انتخاب کنید:</b>", 
+            await bot.edit_message_text("📋 <b>لطفاً تعرفه مورد نظر را انتخاب کنید:</b>", 
                                   message.chat.id, message.message_id, reply_markup=markup, parse_mode="HTML")
         except:
-            bot.send_message(message.chat.id, "📋 <b>لطفاً تعرفه مورد نظر را انتخاب کنید:</b>", 
+            await bot.send_message(message.chat.id, "📋 <b>لطفاً تعرفه مورد نظر را انتخاب کنید:</b>", 
                              reply_markup=markup, parse_mode="HTML")
 
     # 2. دریافت پلن و نمایش فاکتور نهایی (حذف مرحله انتخاب سرور/اینباند)
     @bot.callback_query_handler(func=lambda call: call.data.startswith('buy_plan_'))
-    def step_confirm_plan(call):
+    async def step_confirm_plan(call):
         plan_id = int(call.data.split('_')[-1])
-        user_steps[call.from_user.id] = {'plan_id': plan_id}
+        await user_steps.set(call.from_user.id, {'plan_id': plan_id})
 
-        session = get_db()
-        plan = session.query(Plan).get(plan_id)
+        plan = (await aget_plan_catalog()).get(plan_id)
+        if not plan:
+            await bot.answer_callback_query(call.id, "این پلن دیگر موجود نیست.")
+            return
         
         # چک کنیم آیا پلن به سروری وصل هست؟
-        if not plan.inbounds:
-            bot.answer_callback_query(call.id, "این پلن موقتاً غیرفعال است (بدون سرور).")
-            session.close()
+        if not plan.inbound_count:
+            await bot.answer_callback_query(call.id, "این پلن موقتاً غیرفعال است (بدون سرور).")
             return
 
         price_fmt = "{:,}".format(int(plan.price))
@@ -112,78 +102,83 @@ def register_user_handlers(bot: telebot.TeleBot):
             f"💰 <b>مبلغ قابل پرداخت:</b> {price_fmt} تومان\n\n"
             "جهت دریافت آنی، پرداخت را انجام دهید 👇"
         )
-        session.close()
 
         markup = types.InlineKeyboardMarkup()
         markup.add(types.InlineKeyboardButton("💳 پرداخت (کارت به کارت)", callback_data="pay_card"))
         markup.add(types.InlineKeyboardButton("❌ لغو", callback_data="back_to_main"))
         
-        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup, parse_mode="HTML")
+        await bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup, parse_mode="HTML")
 
     # 3. شروع پروسه پرداخت
     @bot.callback_query_handler(func=lambda call: call.data == "pay_card")
-    def process_purchase_request(call):
+    async def process_purchase_request(call):
         user_id = call.from_user.id
-        if user_id not in user_steps: 
-            bot.answer_callback_query(call.id, "لطفاً دوباره انتخاب کنید.")
+        step = await user_steps.get(user_id)
+        if step is None: 
+            await bot.answer_callback_query(call.id, "لطفاً دوباره انتخاب کنید.")
             return
         
-        plan_id = user_steps[user_id]['plan_id']
-        start_card_payment(bot, call.message, plan_id)
+        await start_card_payment(bot, call.message, step['plan_id'])
         
         # پاک کردن استیت
-        del user_steps[user_id]
+        await user_steps.delete(user_id)
 
     # دکمه بازگشت
     @bot.callback_query_handler(func=lambda call: call.data == "back_to_main")
-    def back_to_main(call):
-        show_main_menu(bot, call.message.chat.id, call.from_user.id)
-        bot.delete_message(call.message.chat.id, call.message.message_id)
+    async def back_to_main(call):
+        await show_main_menu(bot, call.message.chat.id, call.from_user.id)
+        await bot.delete_message(call.message.chat.id, call.message.message_id)
 
     # نمایش سرویس‌ها
-    def show_user_services(bot, message):
-        session = get_db()
-        user = session.query(User).filter_by(telegram_id=message.from_user.id).first()
+    # (message پیام خود ربات است؛ شناسه کاربر جدا از callback می‌آید)
+    async def show_user_services(bot, message, telegram_id):
+        async with AsyncSessionLocal() as session:
+            # یک کوئری با eager loading؛ فقط سرویس‌های فعال از دیتابیس خوانده می‌شوند
+            purchases = await aget_active_purchases(session, telegram_id)
         
-        if not user or not user.purchases:
-            bot.edit_message_text("شما هنوز سرویسی ندارید.", message.chat.id, message.message_id)
-            session.close()
+        if not purchases:
+            await bot.edit_message_text("شما هنوز سرویسی ندارید.", message.chat.id, message.message_id)
             return
 
-        bot.delete_message(message.chat.id, message.message_id)
+        await bot.delete_message(message.chat.id, message.message_id)
         
-        for p in user.purchases:
-            if not p.is_active: continue
-            days_left = (p.expire_date - datetime.now()).days
+        for p in purchases:
+            # سرویس بدون تاریخ انقضا نامحدود است
+            expire_text = f"{(p.expire_date - datetime.now()).days} روز دیگر" if p.expire_date else "نامحدود"
             
             # پیدا کردن اینباند اصلی (برای نمایش نام پروتکل)
             protocol_name = "V2Ray"
             if p.plan and p.plan.inbounds:
-                protocol_name = p.plan.inbounds[0].protocol.upper()
+                protocol_name = (p.plan.inbounds[0].protocol or protocol_name).upper()
+
+            # مصرف از جدول محلی (همگام‌شده در پس‌زمینه)، بدون درخواست به پنل
+            usage_line = ""
+            if p.usages:
+                used_gb = sum(u.up + u.down for u in p.usages) / 1024**3
+                limit = f"{p.plan.volume_gb:g} GB" if p.plan and p.plan.volume_gb > 0 else "∞"
+                usage_line = f"📊 مصرف: {used_gb:.2f} GB / {limit}\n"
 
             text = (
                 f"🔰 <b>سرویس {protocol_name}</b>\n"
-                f"📅 انقضا: {days_left} روز دیگر\n"
+                f"📅 انقضا: {expire_text}\n"
+                f"{usage_line}"
                 f"🔗 <code>{p.sub_link}</code>"
             )
             markup = types.InlineKeyboardMarkup()
             markup.add(types.InlineKeyboardButton("⚙️ دریافت کانفیگ تکی", callback_data=f"get_configs_{p.id}"))
             markup.add(types.InlineKeyboardButton("🏠 منوی اصلی", callback_data="back_to_main"))
             
-            bot.send_message(message.chat.id, text, reply_markup=markup, parse_mode="HTML")
-            
-        session.close()
+            await bot.send_message(message.chat.id, text, reply_markup=markup, parse_mode="HTML")
 
     # دریافت کانفیگ تکی (از تمپلیت)
     @bot.callback_query_handler(func=lambda call: call.data.startswith('get_configs_'))
-    def send_single_configs(call):
+    async def send_single_configs(call):
         pid = int(call.data.split('_')[-1])
-        session = get_db()
-        purchase = session.query(Purchase).get(pid)
+        async with AsyncSessionLocal() as session:
+            purchase = await aget_purchase_with_servers(session, pid)
         
         if not purchase:
-            bot.answer_callback_query(call.id, "سرویس یافت نشد.")
-            session.close()
+            await bot.answer_callback_query(call.id, "سرویس یافت نشد.")
             return
 
         # بررسی اینکه آیا سرور تمپلیت دارد؟
@@ -195,10 +190,8 @@ def register_user_handlers(bot: telebot.TeleBot):
                 email_part = f"u{purchase.uuid[:8]}"
                 # پر کردن تمپلیت
                 config = server.config_template.replace("UUID", purchase.uuid).replace("EMAIL", email_part)
-                bot.send_message(call.message.chat.id, f"⚙️ <b>کانفیگ اختصاصی:</b>\n\n<code>{config}</code>", parse_mode="HTML")
+                await bot.send_message(call.message.chat.id, f"⚙️ <b>کانفیگ اختصاصی:</b>\n\n<code>{config}</code>", parse_mode="HTML")
             else:
-                bot.answer_callback_query(call.id, "تمپلیت کانفیگ تنظیم نشده است.")
+                await bot.answer_callback_query(call.id, "تمپلیت کانفیگ تنظیم نشده است.")
         else:
-            bot.answer_callback_query(call.id, "اطلاعات سرور یافت نشد.")
-        
-        session.close()
\ No newline at end of file
+            await bot.answer_callback_query(call.id, "اطلاعات سرور یافت نشد.")
@@ -1,30 +1,62 @@
 # main.py
-import telebot
-import time
-from config import BOT_TOKEN
+import asyncio
+from telebot.async_telebot import AsyncTeleBot
+from config import BOT_TOKEN, BOT_MODE
 from database.base import init_db
+from database.async_base import dispose_async_engine
 from handlers import admin, user, payment_process
+from services.traffic_sync import start_traffic_sync
+from services.provision_queue import stop_workers
+from services.webhook import run_webhook
+from services.xui_async import close_http_session
 print("--- Initializing Database ---")
 init_db()
 print("✅ Database initialized.")
 
-bot = telebot.TeleBot(BOT_TOKEN)
-
-# ⚠️ این خط بسیار مهم است: حذف وب‌هوک‌های قدیمی
-print("🔄 Clearing previous webhooks...")
-try:
-    bot.delete_webhook()
-    print("✅ Webhook cleared.")
-except Exception as e:
-    print(f"⚠️ Warning deleting webhook: {e}")
+# همه هندلرها coroutine هستند و روی یک event loop اجرا می‌شوند
+bot = AsyncTeleBot(BOT_TOKEN)
 
 # ثبت هندلرها
 admin.register_admin_handlers(bot)
 user.register_user_handlers(bot)
+payment_process.register_payment_handlers(bot)
 payment_process.register_callback_handlers(bot)
-print("🤖 Bot is running...")
-try:
-    bot.infinity_polling(timeout=10, long_polling_timeout=5)
-except Exception as e:
-    print(f"❌ Error: {e}")
-    time.sleep(5)
\ No newline at end of file
+
+# همگام‌سازی دوره‌ای ترافیک کلاینت‌ها در پس‌زمینه
+start_traffic_sync()
+
+async def run_polling(bot):
+    # ⚠️ این خط بسیار مهم است: در حالت polling وب‌هوک قبلی باید حذف شود
+    print("🔄 Clearing previous webhooks...")
+    try:
+        await bot.delete_webhook()
+        print("✅ Webhook cleared.")
+    except Exception as e:
+        print(f"⚠️ Warning deleting webhook: {e}")
+
+    print("🤖 Bot is running (polling)...")
+    try:
+        await bot.infinity_polling(timeout=5, request_timeout=10)
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        await asyncio.sleep(5)
+
+async def main():
+    # workerهای صف ساخت سرویس (jobهای باقی‌مانده از اجرای قبلی هم برداشته می‌شوند)
+    payment_process.start_provision_workers(bot)
+    try:
+        if BOT_MODE == "webhook":
+            print("🤖 Bot is running (webhook)...")
+            if not await run_webhook(bot):
+                print("⚠️ Webhook setup failed, falling back to polling.")
+                await run_polling(bot)
+        else:
+            await run_polling(bot)
+    finally:
+        await stop_workers()
+        # بستن سشن‌های HTTP (تلگرام و پنل‌ها) و اتصال‌های دیتابیس async
+        await bot.close_session()
+        await close_http_session()
+        await dispose_async_engine()
+
+asyncio.run(main())
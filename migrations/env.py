@@ -0,0 +1,44 @@
+# migrations/env.py
+from logging.config import fileConfig
+
+from alembic import context
+
+from config import DB_URI
+from database.base import Base, engine
+import database.models  # noqa: F401  (ثبت جداول روی Base.metadata)
+
+config = context.config
+
+# وقتی از داخل ربات (init_db) اجرا می‌شود تنظیمات لاگ برنامه دست نمی‌خورد
+if config.config_file_name and config.attributes.get('configure_logger', True):
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+
+def run_migrations_offline():
+    context.configure(url=DB_URI, target_metadata=target_metadata, literal_binds=True, render_as_batch=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    connection = config.attributes.get('connection')
+    if connection is None:
+        with engine.connect() as connection:
+            _run(connection)
+    else:
+        _run(connection)
+
+
+def _run(connection):
+    # render_as_batch: تغییر constraint روی SQLite با ساخت مجدد جدول انجام می‌شود
+    context.configure(connection=connection, target_metadata=target_metadata, render_as_batch=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
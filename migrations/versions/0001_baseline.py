@@ -0,0 +1,120 @@
+"""baseline schema
+
+دیتابیس‌هایی که قبل از Alembic با create_all ساخته شده‌اند جداول را دارند؛
+برای همین فقط جدول‌های ناموجود ساخته می‌شوند.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _create(name, *columns):
+    if not sa.inspect(op.get_bind()).has_table(name):
+        op.create_table(name, *columns)
+
+
+def upgrade():
+    _create(
+        'users',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('telegram_id', sa.BigInteger(), nullable=False, unique=True),
+        sa.Column('first_name', sa.String()),
+        sa.Column('username', sa.String()),
+        sa.Column('balance', sa.Float()),
+        sa.Column('is_admin', sa.Boolean()),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    _create(
+        'servers',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('name', sa.String(), nullable=False, unique=True),
+        sa.Column('panel_url', sa.String(), nullable=False),
+        sa.Column('username', sa.String(), nullable=False),
+        sa.Column('password', sa.String(), nullable=False),
+        sa.Column('subscription_url', sa.String(), nullable=False),
+        sa.Column('config_template', sa.Text(), nullable=True),
+        sa.Column('is_active', sa.Boolean()),
+    )
+    _create(
+        'inbounds',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('server_id', sa.Integer(), sa.ForeignKey('servers.id')),
+        sa.Column('xui_id', sa.Integer(), nullable=False),
+        sa.Column('remark', sa.String()),
+        sa.Column('port', sa.Integer()),
+        sa.Column('protocol', sa.String()),
+        sa.Column('is_active', sa.Boolean()),
+    )
+    _create(
+        'plans',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('price', sa.Float(), nullable=False),
+        sa.Column('volume_gb', sa.Float(), nullable=False),
+        sa.Column('duration_days', sa.Integer(), nullable=False),
+        sa.Column('limit_ip', sa.Integer(), nullable=False),
+        sa.Column('is_active', sa.Boolean()),
+    )
+    _create(
+        'plan_inbound',
+        sa.Column('plan_id', sa.Integer(), sa.ForeignKey('plans.id')),
+        sa.Column('inbound_id', sa.Integer(), sa.ForeignKey('inbounds.id')),
+    )
+    _create(
+        'purchases',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id')),
+        sa.Column('plan_id', sa.Integer(), sa.ForeignKey('plans.id')),
+        sa.Column('uuid', sa.String(), unique=True),
+        sa.Column('sub_link', sa.String()),
+        sa.Column('expire_date', sa.DateTime()),
+        sa.Column('is_active', sa.Boolean()),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    _create(
+        'payments',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id')),
+        sa.Column('plan_id', sa.Integer(), sa.ForeignKey('plans.id')),
+        sa.Column('amount', sa.Float()),
+        sa.Column('status', sa.String()),
+        sa.Column('payment_method', sa.String()),
+        sa.Column('receipt_image_id', sa.String(), nullable=True),
+        sa.Column('admin_note', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('updated_at', sa.DateTime(timezone=True)),
+    )
+    _create(
+        'client_usages',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('purchase_id', sa.Integer(), sa.ForeignKey('purchases.id'), nullable=False),
+        sa.Column('server_id', sa.Integer(), sa.ForeignKey('servers.id'), nullable=False),
+        sa.Column('up', sa.BigInteger()),
+        sa.Column('down', sa.BigInteger()),
+        sa.Column('total', sa.BigInteger()),
+        sa.Column('expiry_time', sa.BigInteger()),
+        sa.Column('enable', sa.Boolean()),
+        sa.Column('updated_at', sa.DateTime()),
+        sa.UniqueConstraint('purchase_id', 'server_id', name='uq_client_usage_purchase_server'),
+    )
+    _create(
+        'server_sync_states',
+        sa.Column('server_id', sa.Integer(), sa.ForeignKey('servers.id'), primary_key=True),
+        sa.Column('last_synced_at', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.String(), nullable=True),
+        sa.Column('clients_synced', sa.Integer()),
+    )
+
+
+def downgrade():
+    for name in ('server_sync_states', 'client_usages', 'payments', 'purchases',
+                 'plan_inbound', 'plans', 'inbounds', 'servers', 'users'):
+        op.drop_table(name)
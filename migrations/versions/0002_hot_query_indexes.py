@@ -0,0 +1,57 @@
+"""indexes on hot query columns, unique (server_id, xui_id) on inbounds
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_purchases_user_id', 'purchases', ['user_id']),
+    ('ix_purchases_expire_date', 'purchases', ['expire_date']),
+    ('ix_payments_user_id', 'payments', ['user_id']),
+    ('ix_payments_status', 'payments', ['status']),
+]
+
+
+def _dedupe_inbounds():
+    """
+    ردیف‌های تکراری (server_id, xui_id) قبل از ساخت constraint ادغام می‌شوند:
+    کوچک‌ترین id نگه داشته و اتصال پلن‌ها به آن منتقل می‌شود.
+    """
+    bind = op.get_bind()
+    dupes = bind.execute(sa.text(
+        "SELECT i.id, k.keep_id FROM inbounds i JOIN ("
+        "  SELECT server_id, xui_id, MIN(id) AS keep_id FROM inbounds"
+        "  GROUP BY server_id, xui_id HAVING COUNT(*) > 1"
+        ") k ON i.server_id = k.server_id AND i.xui_id = k.xui_id WHERE i.id <> k.keep_id"
+    )).all()
+    for dup_id, keep_id in dupes:
+        bind.execute(sa.text(
+            "UPDATE plan_inbound SET inbound_id = :keep WHERE inbound_id = :dup AND plan_id NOT IN "
+            "(SELECT plan_id FROM plan_inbound WHERE inbound_id = :keep)"
+        ), {'keep': keep_id, 'dup': dup_id})
+        bind.execute(sa.text("DELETE FROM plan_inbound WHERE inbound_id = :dup"), {'dup': dup_id})
+        bind.execute(sa.text("DELETE FROM inbounds WHERE id = :dup"), {'dup': dup_id})
+
+
+def upgrade():
+    for name, table, cols in INDEXES:
+        op.create_index(name, table, cols)
+
+    _dedupe_inbounds()
+    with op.batch_alter_table('inbounds') as batch:
+        batch.create_unique_constraint('uq_inbound_server_xui', ['server_id', 'xui_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('inbounds') as batch:
+        batch.drop_constraint('uq_inbound_server_xui', type_='unique')
+    for name, table, _ in INDEXES:
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,40 @@
+"""provision job queue
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'provision_jobs',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('payment_id', sa.Integer(), sa.ForeignKey('payments.id'), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('next_run_at', sa.DateTime(), nullable=False),
+        sa.Column('locked_at', sa.DateTime(), nullable=True),
+        sa.Column('notify_chat_id', sa.BigInteger(), nullable=True),
+        sa.Column('uuid', sa.String(), nullable=True),
+        sa.Column('sub_id', sa.String(), nullable=True),
+        sa.Column('purchase_id', sa.Integer(), sa.ForeignKey('purchases.id'), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('updated_at', sa.DateTime(timezone=True)),
+    )
+    op.create_index('ix_provision_jobs_payment_id', 'provision_jobs', ['payment_id'])
+    op.create_index('ix_provision_jobs_status_next_run', 'provision_jobs', ['status', 'next_run_at'])
+
+
+def downgrade():
+    op.drop_index('ix_provision_jobs_status_next_run', table_name='provision_jobs')
+    op.drop_index('ix_provision_jobs_payment_id', table_name='provision_jobs')
+    op.drop_table('provision_jobs')
@@ -0,0 +1,29 @@
+"""conversation state store
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'conversation_states',
+        sa.Column('scope', sa.String(), primary_key=True),
+        sa.Column('chat_id', sa.BigInteger(), primary_key=True),
+        sa.Column('data', sa.Text(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_conversation_states_expires_at', 'conversation_states', ['expires_at'])
+
+
+def downgrade():
+    op.drop_index('ix_conversation_states_expires_at', table_name='conversation_states')
+    op.drop_table('conversation_states')
@@ -0,0 +1,28 @@
+"""pending receipts
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'pending_receipts',
+        sa.Column('chat_id', sa.BigInteger(), primary_key=True),
+        sa.Column('plan_id', sa.Integer(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_pending_receipts_expires_at', 'pending_receipts', ['expires_at'])
+
+
+def downgrade():
+    op.drop_index('ix_pending_receipts_expires_at', table_name='pending_receipts')
+    op.drop_table('pending_receipts')
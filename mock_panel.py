@@ -0,0 +1,359 @@
+# mock_panel.py
+"""
+پنل X-UI شبیه‌سازی‌شده (درون‌پروسه‌ای) برای تست و بنچمارک بدون پنل واقعی.
+
+    with MockXUIPanel(inbounds=10, clients_per_inbound=1000, latency=0.02) as panel:
+        client = XUIClient(panel.url, panel.username, panel.password)
+        ...
+        print(panel.requests)   # تعداد درخواست به تفکیک endpoint
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid as uuidlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+COOKIE_NAME = "3x-ui"
+
+
+class MockXUIPanel:
+    def __init__(self, inbounds: int = 1, clients_per_inbound: int = 0, latency: float = 0.0,
+                 latency_jitter: float = 0.0, error_rate: float = 0.0, lost_response_rate: float = 0.0,
+                 username: str = "admin", password: str = "admin", seed: int = None):
+        """
+        latency / latency_jitter: تاخیر هر درخواست (ثانیه)
+        error_rate: احتمال پاسخ 500 بدون انجام عملیات
+        lost_response_rate: احتمال انجام عملیات و قطع اتصال بدون پاسخ (شبیه timeout)
+        """
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.lost_response_rate = lost_response_rate
+        self.requests = Counter()
+        self._rand = random.Random(seed)
+        self._lock = threading.RLock()
+        self._sessions = set()
+        self._fail_next = []
+        self._inbounds = {}
+        self._traffics = {}  # email --> رکورد ترافیک (ایمیل در کل پنل یکتاست)
+        self._next_inbound_id = 1
+        self._next_traffic_id = 1
+        self._server = None
+        self._thread = None
+        for i in range(inbounds):
+            self.seed_inbound(clients=clients_per_inbound, port=20000 + i)
+
+    # ==========================
+    # مدیریت سرور
+    # ==========================
+    def start(self):
+        handler = type("Handler", (_Handler,), {"panel": self})
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-xui", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def total_requests(self) -> int:
+        return sum(self.requests.values())
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests.clear()
+
+    def expire_sessions(self):
+        """باطل کردن کوکی‌ها (برای تست لاگین مجدد بعد از 401)"""
+        with self._lock:
+            self._sessions.clear()
+
+    def fail_next(self, count: int = 1, status: int = 500):
+        """count درخواست بعدی با status پاسخ داده می‌شوند"""
+        with self._lock:
+            self._fail_next.extend([status] * count)
+
+    # ==========================
+    # داده‌ها
+    # ==========================
+    def _new_uuid(self) -> str:
+        return str(uuidlib.UUID(int=self._rand.getrandbits(128), version=4))
+
+    def seed_inbound(self, clients: int = 0, port: int = None, protocol: str = "vless", remark: str = None) -> int:
+        with self._lock:
+            inbound_id = self._next_inbound_id
+            self._next_inbound_id += 1
+            self._inbounds[inbound_id] = {
+                "id": inbound_id, "up": 0, "down": 0, "total": 0,
+                "remark": remark or f"inbound-{inbound_id}", "enable": True, "expiryTime": 0,
+                "listen": "", "port": port or 20000 + inbound_id, "protocol": protocol,
+                "settings": {"clients": [], "decryption": "none", "fallbacks": []},
+                "streamSettings": json.dumps({"network": "tcp", "security": "none"}),
+                "tag": f"inbound-{inbound_id}", "sniffing": "{}",
+            }
+            self._add_clients(inbound_id, [
+                {"id": self._new_uuid(), "email": f"seed{inbound_id}_{n}", "limitIp": 0, "totalGB": 0,
+                 "expiryTime": 0, "enable": True, "tgId": "", "subId": "", "flow": ""}
+                for n in range(clients)
+            ])
+            return inbound_id
+
+    def clients(self, inbound_id: int) -> list:
+        with self._lock:
+            return list(self._inbounds[inbound_id]["settings"]["clients"])
+
+    def set_traffic(self, email: str, **fields):
+        """تغییر رکورد ترافیک یک ایمیل (مثلاً up/down مصرف‌شده) برای تست همگام‌سازی"""
+        with self._lock:
+            self._traffics[email].update(fields)
+
+    def _add_clients(self, inbound_id: int, clients: list):
+        inbound = self._inbounds.get(inbound_id)
+        if inbound is None:
+            return False, "inbound not found"
+        emails = [c.get("email") for c in clients]
+        if len(set(emails)) != len(emails) or any(e in self._traffics for e in emails):
+            return False, "Duplicate email"
+        for c in clients:
+            inbound["settings"]["clients"].append(dict(c))
+            self._traffics[c["email"]] = {
+                "id": self._next_traffic_id, "inboundId": inbound_id, "enable": c.get("enable", True),
+                "email": c["email"], "up": 0, "down": 0, "expiryTime": c.get("expiryTime", 0),
+                "total": c.get("totalGB", 0), "reset": 0,
+            }
+            self._next_traffic_id += 1
+        return True, ""
+
+    def _find_client(self, client_id: str):
+        """جستجو با UUID یا شناسه عددی ترافیک (کلاینت ربات شناسه عددی می‌فرستد)"""
+        for inbound in self._inbounds.values():
+            for idx, c in enumerate(inbound["settings"]["clients"]):
+                traffic = self._traffics.get(c["email"], {})
+                if c["id"] == client_id or str(traffic.get("id")) == client_id:
+                    return inbound, idx, c
+        return None, None, None
+
+    def _serialize(self, inbound: dict) -> dict:
+        out = dict(inbound)
+        out["settings"] = json.dumps(inbound["settings"])
+        out["clientStats"] = [self._traffics[c["email"]] for c in inbound["settings"]["clients"] if c["email"] in self._traffics]
+        return out
+
+    # ==========================
+    # endpointها
+    # ==========================
+    def handle(self, method: str, path: str, body: dict, cookie: str):
+        """خروجی: (status, payload, set_cookie)"""
+        if path == "/login" and method == "POST":
+            if body.get("username") == self.username and body.get("password") == self.password:
+                token = uuidlib.uuid4().hex
+                self._sessions.add(token)
+                return 200, {"success": True, "msg": "Login Successfully", "obj": None}, token
+            return 200, {"success": False, "msg": "Invalid username or password", "obj": None}, None
+
+        if cookie not in self._sessions:
+            return 401, None, None
+
+        for pattern, verb, name in _ROUTES:
+            m = pattern.fullmatch(path)
+            if m and verb == method:
+                return (200, getattr(self, "_" + name)(body, *m.groups()), None)
+        return 404, None, None
+
+    def _ok(self, obj=None, msg=""):
+        return {"success": True, "msg": msg, "obj": obj}
+
+    def _fail(self, msg):
+        return {"success": False, "msg": msg, "obj": None}
+
+    def _list(self, body):
+        return self._ok([self._serialize(i) for i in self._inbounds.values()])
+
+    def _get(self, body, inbound_id):
+        inbound = self._inbounds.get(int(inbound_id))
+        return self._ok(self._serialize(inbound)) if inbound else self._fail("inbound not found")
+
+    def _add(self, body):
+        inbound_id = self.seed_inbound(port=body.get("port"), protocol=body.get("protocol", "vless"), remark=body.get("remark"))
+        settings = json.loads(body.get("settings") or "{}")
+        clients = settings.pop("clients", [])
+        self._inbounds[inbound_id]["settings"].update(settings)
+        self._add_clients(inbound_id, clients)
+        return self._ok(self._serialize(self._inbounds[inbound_id]))
+
+    def _update(self, body, inbound_id):
+        inbound = self._inbounds.get(int(inbound_id))
+        if not inbound:
+            return self._fail("inbound not found")
+        for key in ("remark", "port", "protocol", "enable", "expiryTime", "total"):
+            if key in body:
+                inbound[key] = body[key]
+        return self._ok()
+
+    def _delete(self, body, inbound_id):
+        inbound = self._inbounds.pop(int(inbound_id), None)
+        if not inbound:
+            return self._fail("inbound not found")
+        for c in inbound["settings"]["clients"]:
+            self._traffics.pop(c["email"], None)
+        return self._ok()
+
+    def _add_client(self, body):
+        clients = json.loads(body.get("settings") or "{}").get("clients", [])
+        ok, msg = self._add_clients(int(body.get("id", 0)), clients)
+        return self._ok() if ok else self._fail(msg)
+
+    def _update_client(self, body, client_id):
+        inbound, idx, client = self._find_client(client_id)
+        if client is None:
+            return self._fail("client not found")
+        if "settings" in body:
+            # قالب پنل واقعی: {"id": inbound_id, "settings": "{\"clients\": [...]}"}
+            body = (json.loads(body["settings"]).get("clients") or [{}])[0]
+        updated = dict(client)
+        for key in ("email", "limitIp", "totalGB", "expiryTime", "enable", "tgId", "subId", "flow"):
+            if key in body:
+                updated[key] = body[key]
+        traffic = self._traffics.pop(client["email"])
+        traffic.update(email=updated["email"], enable=updated["enable"],
+                       expiryTime=updated["expiryTime"], total=updated["totalGB"])
+        self._traffics[updated["email"]] = traffic
+        inbound["settings"]["clients"][idx] = updated
+        return self._ok()
+
+    def _del_client(self, body, inbound_id, client_id):
+        inbound, idx, client = self._find_client(client_id)
+        if client is None or inbound["id"] != int(inbound_id):
+            return self._fail("client not found")
+        del inbound["settings"]["clients"][idx]
+        self._traffics.pop(client["email"], None)
+        return self._ok()
+
+    def _traffic_by_id(self, body, client_uuid):
+        records = []
+        for inbound in self._inbounds.values():
+            for c in inbound["settings"]["clients"]:
+                if c["id"] == client_uuid and c["email"] in self._traffics:
+                    records.append(self._traffics[c["email"]])
+        return self._ok(records)
+
+    def _onlines(self, body):
+        return self._ok([])
+
+    def _reset_traffic(self, body, inbound_id, email):
+        traffic = self._traffics.get(email)
+        if not traffic:
+            return self._fail("client not found")
+        traffic.update(up=0, down=0)
+        return self._ok()
+
+    def _status(self, body):
+        return self._ok({"xray": {"state": "running", "version": "mock"}})
+
+
+_ROUTES = [
+    (re.compile(r"/panel/api/inbounds/list"), "GET", "list"),
+    (re.compile(r"/panel/api/inbounds/get/(\d+)"), "GET", "get"),
+    (re.compile(r"/panel/api/inbounds/add"), "POST", "add"),
+    (re.compile(r"/panel/api/inbounds/update/(\d+)"), "POST", "update"),
+    (re.compile(r"/panel/api/inbounds/del/(\d+)"), "POST", "delete"),
+    (re.compile(r"/panel/api/inbounds/addClient"), "POST", "add_client"),
+    (re.compile(r"/panel/api/inbounds/updateClient/([^/]+)"), "POST", "update_client"),
+    (re.compile(r"/panel/api/inbounds/(\d+)/delClient/([^/]+)"), "POST", "del_client"),
+    (re.compile(r"/panel/api/inbounds/getClientTrafficsById/([^/]+)"), "GET", "traffic_by_id"),
+    (re.compile(r"/panel/api/inbounds/onlines"), "POST", "onlines"),
+    (re.compile(r"/panel/api/inbounds/(\d+)/resetClientTraffic/([^/]+)"), "POST", "reset_traffic"),
+    (re.compile(r"/server/status"), "GET", "status"),
+]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive مثل پنل واقعی
+    disable_nagle_algorithm = True  # هدر و بدنه جدا نوشته می‌شوند؛ بدون این هر پاسخ ~40ms تاخیر ACK می‌خورد
+    panel = None
+
+    def log_message(self, *args):
+        pass
+
+    def _endpoint_name(self) -> str:
+        # شناسه‌ها از مسیر حذف می‌شوند تا شمارش به تفکیک endpoint باشد
+        path = self.path.split("?")[0]
+        for pattern, _, _ in _ROUTES:
+            if pattern.fullmatch(path):
+                return re.sub(r"\([^)]*\)", ":id", pattern.pattern)
+        return path
+
+    def _handle(self, method: str):
+        panel = self.panel
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        body = {}
+        if raw:
+            try:
+                body = json.loads(raw)
+            except ValueError:
+                body = {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+
+        delay = panel.latency + (panel._rand.uniform(0, panel.latency_jitter) if panel.latency_jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+        cookie = None
+        for part in (self.headers.get("Cookie") or "").split(";"):
+            name, _, value = part.strip().partition("=")
+            if name == COOKIE_NAME:
+                cookie = value
+
+        with panel._lock:
+            panel.requests[self._endpoint_name()] += 1
+            forced = panel._fail_next.pop(0) if panel._fail_next else None
+            if forced is None and panel.error_rate and panel._rand.random() < panel.error_rate:
+                forced = 500
+            if forced is not None:
+                return self._send(forced, {"success": False, "msg": "injected error", "obj": None})
+            status, payload, token = panel.handle(method, self.path.split("?")[0], body, cookie)
+            lose = panel.lost_response_rate and panel._rand.random() < panel.lost_response_rate
+
+        if lose:
+            # عملیات انجام شد ولی پاسخی برنمی‌گردد
+            self.close_connection = True
+            return
+        self._send(status, payload, token)
+
+    def _send(self, status: int, payload, token=None):
+        data = json.dumps(payload).encode() if payload is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        if token:
+            self.send_header("Set-Cookie", f"{COOKIE_NAME}={token}; Path=/; HttpOnly")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
@@ -0,0 +1,121 @@
+# services/circuit_breaker.py
+import threading
+import time
+from collections import deque
+
+from config import BREAKER_FAILURES, BREAKER_ERROR_RATE, BREAKER_WINDOW, BREAKER_COOLDOWN, BREAKER_SLOW_CALL
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker یک پنل (closed / open / half_open).
+    با خطاهای پشت‌سرهم یا نرخ خطای بالا در پنجره آخر باز می‌شود (درخواست کندتر از
+    slow_call در نرخ خطا شکست حساب می‌شود)؛ در حالت باز
+    درخواست‌ها بلافاصله رد می‌شوند و بعد از cooldown یک درخواست آزمایشی اجازه دارد.
+    """
+
+    def __init__(self, failures: int = BREAKER_FAILURES, error_rate: float = BREAKER_ERROR_RATE,
+                 window: int = BREAKER_WINDOW, cooldown: float = BREAKER_COOLDOWN, slow_call: float = BREAKER_SLOW_CALL):
+        self.failures = failures
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.slow_call = slow_call
+        self._calls = deque(maxlen=window)  # (ok, latency)
+        self._consecutive = 0
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+            self._state = HALF_OPEN
+            self._probe_in_flight = False
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+    def is_open(self) -> bool:
+        return self.state == OPEN
+
+    def allow(self) -> bool:
+        """آیا درخواست به پنل ارسال شود؟"""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record(self, ok: bool, latency: float):
+        with self._lock:
+            self._calls.append((ok, latency))
+            if self._state == HALF_OPEN:
+                # درخواست آزمایشی کند هم یعنی پنل هنوز سالم نیست
+                if ok and latency < self.slow_call:
+                    self._state = CLOSED
+                    self._calls.clear()
+                    self._consecutive = 0
+                else:
+                    self._open()
+                return
+
+            self._consecutive = 0 if ok else self._consecutive + 1
+            if self._state == CLOSED and (self._consecutive >= self.failures or self._too_many_errors()):
+                self._open()
+
+    def _too_many_errors(self) -> bool:
+        # تا پر شدن نیمی از پنجره تصمیمی بر اساس نرخ خطا گرفته نمی‌شود
+        if len(self._calls) < max(2, self._calls.maxlen // 2):
+            return False
+        errors = sum(1 for ok, latency in self._calls if not ok or latency >= self.slow_call)
+        return errors / len(self._calls) >= self.error_rate
+
+    def health_score(self) -> int:
+        """امتیاز ۰ تا ۱۰۰ بر اساس وضعیت، نرخ خطا و میانگین تاخیر"""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == OPEN:
+                return 0
+            if not self._calls:
+                return 100 if self._state == CLOSED else 25
+            errors = sum(1 for ok, _ in self._calls if not ok)
+            avg_latency = sum(lat for _, lat in self._calls) / len(self._calls)
+            score = (1 - errors / len(self._calls)) * 100
+            # تاخیر بیشتر از slow_call تا نصف امتیاز را کم می‌کند
+            score *= 1 - 0.5 * min(1.0, avg_latency / self.slow_call)
+            if self._state == HALF_OPEN:
+                score = min(score, 25)
+            return int(round(score))
+
+
+# ==========================
+# رجیستری breakerها (یکی برای هر سرور)
+# ==========================
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(key) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker()
+        return breaker
+
+def reset_breaker(key):
+    with _breakers_lock:
+        _breakers.pop(key, None)
@@ -0,0 +1,143 @@
+# services/json_stream.py
+import codecs
+import json
+import re
+
+# کاراکترهای ساختاری بیرون از رشته
+_STRUCT = re.compile(r'[{}\[\]"]')
+# محتوای داخل رشته تا قبل از " پایانی (escapeها رد می‌شوند)
+_STRING_BODY = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*')
+
+
+class JSONArrayStream:
+    """
+    پارسر افزایشی برای آرایه‌ای که زیر یک کلید در شیء سطح اول قرار دارد
+    (مثل obj در پاسخ {"success": true, "obj": [...]}).
+    تکه‌های متن با feed داده می‌شوند و هر عضو آرایه به محض کامل شدن
+    decode و برگردانده می‌شود؛ فقط عضو در حال خواندن در حافظه می‌ماند.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.buf = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.string_start = 0
+        self.last_key = None
+        self.array_depth = None  # عمق آرایه هدف پس از پیدا شدن
+        self.elem_start = None
+        self.done = False
+
+    def feed(self, text: str) -> list:
+        if self.done:
+            return []
+        self.buf += text
+        items = []
+        buf = self.buf
+        pos = self.pos
+        while True:
+            if self.in_string:
+                m = _STRING_BODY.match(buf, pos)
+                end = m.end()
+                if end >= len(buf) or buf[end] != '"':
+                    # رشته (یا یک escape) هنوز تمام نشده؛ از همین نقطه ادامه می‌دهیم
+                    pos = end
+                    break
+                self.in_string = False
+                if self.depth == 1 and self.array_depth is None:
+                    self.last_key = buf[self.string_start:end + 1]
+                pos = end + 1
+                continue
+
+            m = _STRUCT.search(buf, pos)
+            if not m:
+                pos = len(buf)
+                break
+            ch = m.group()
+            pos = m.end()
+            if ch == '"':
+                self.in_string = True
+                self.string_start = m.start()
+            elif ch in '{[':
+                if (ch == '[' and self.array_depth is None and self.depth == 1
+                        and self.last_key is not None and json.loads(self.last_key) == self.key):
+                    self.array_depth = self.depth + 1
+                elif self.depth == self.array_depth:
+                    self.elem_start = m.start()
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if self.array_depth is not None and self.depth == self.array_depth and self.elem_start is not None:
+                    items.append(json.loads(buf[self.elem_start:pos]))
+                    self.elem_start = None
+                elif self.array_depth is not None and self.depth < self.array_depth:
+                    self.done = True
+                    break
+
+        # متن مصرف‌شده دور ریخته می‌شود تا حافظه محدود بماند
+        keep_from = self.elem_start if self.elem_start is not None else (self.string_start if self.in_string else pos)
+        keep_from = min(keep_from, pos)
+        self.buf = buf[keep_from:]
+        self.pos = pos - keep_from
+        if self.elem_start is not None:
+            self.elem_start -= keep_from
+        if self.in_string:
+            self.string_start -= keep_from
+        return items
+
+    @property
+    def found(self) -> bool:
+        return self.array_depth is not None
+
+
+def iter_json_array(chunks, key: str):
+    """
+    اعضای آرایه key را از روی تکه‌های bytes یا str (مثلاً iter_content پاسخ) برمی‌گرداند.
+    اگر آرایه در سند پیدا نشود یا ناقص باشد ValueError می‌دهد.
+    """
+    parser = JSONArrayStream(key)
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    for chunk in chunks:
+        text = decoder.decode(chunk) if isinstance(chunk, (bytes, bytearray)) else chunk
+        yield from parser.feed(text)
+        if parser.done:
+            return
+    yield from parser.feed(decoder.decode(b'', final=True))
+    if not parser.found:
+        raise ValueError(f"array '{key}' not found in response")
+    if not parser.done:
+        raise ValueError(f"array '{key}' is truncated")
+
+
+async def aiter_json_array(chunks, key: str):
+    """نسخه async تابع iter_json_array برای تکه‌های یک async iterator"""
+    parser = JSONArrayStream(key)
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    async for chunk in chunks:
+        for item in parser.feed(decoder.decode(chunk)):
+            yield item
+        if parser.done:
+            return
+    for item in parser.feed(decoder.decode(b'', final=True)):
+        yield item
+    if not parser.found:
+        raise ValueError(f"array '{key}' not found in response")
+    if not parser.done:
+        raise ValueError(f"array '{key}' is truncated")
+
+
+def iter_settings_clients(inbound: dict, chunk_size: int = 1 << 16):
+    """
+    کلاینت‌های settings یک اینباند را یکی‌یکی و بدون ساختن کل لیست برمی‌گرداند.
+    اینباند بدون کلاینت (settings خالی یا بدون کلید clients) چیزی برنمی‌گرداند؛
+    settings ناقص یا خراب ValueError می‌دهد تا با یک لیست کوتاه‌تر اشتباه گرفته نشود.
+    """
+    settings = inbound.get('settings') or '{}'
+    parser = JSONArrayStream('clients')
+    for i in range(0, len(settings), chunk_size):
+        yield from parser.feed(settings[i:i + chunk_size])
+        if parser.done:
+            return
+    if parser.found or parser.depth or parser.in_string:
+        raise ValueError("inbound settings are truncated")
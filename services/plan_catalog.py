@@ -0,0 +1,100 @@
+# services/plan_catalog.py
+import asyncio
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import func, select
+from telebot import types
+
+from database.base import SessionLocal
+from database.models import Plan, Inbound, plan_inbound_association
+from config import PLAN_CATALOG_TTL
+
+# اطلاعات جداشده از ORM تا بدون سشن دیتابیس قابل استفاده باشد
+PlanEntry = namedtuple('PlanEntry', 'id name price volume_gb duration_days limit_ip inbound_count')
+
+
+class PlanCatalog:
+    """پلن‌های فعال، تعداد اینباند هر پلن و کیبورد آماده لیست خرید"""
+
+    def __init__(self, plans: list):
+        self.plans = {p.id: p for p in plans}
+        self.keyboard = self._build_keyboard(plans) if plans else None
+        self.loaded_at = time.monotonic()
+
+    def get(self, plan_id: int):
+        return self.plans.get(plan_id)
+
+    @staticmethod
+    def _build_keyboard(plans: list):
+        markup = types.InlineKeyboardMarkup(row_width=1)
+        for p in plans:
+            # فرمت قیمت با کاما
+            price_fmt = "{:,}".format(int(p.price))
+            btn_text = f"💎 {p.name} | {p.volume_gb} GB | {p.duration_days} روز | {price_fmt} T"
+            markup.add(types.InlineKeyboardButton(btn_text, callback_data=f"buy_plan_{p.id}"))
+        markup.add(types.InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_main"))
+        return markup
+
+
+def load_plan_catalog(session) -> PlanCatalog:
+    """پلن‌های فعال به همراه تعداد اینباندهای فعالشان با یک کوئری"""
+    inbound_count = func.count(Inbound.id)
+    rows = session.execute(
+        select(Plan.id, Plan.name, Plan.price, Plan.volume_gb, Plan.duration_days, Plan.limit_ip, inbound_count)
+        .outerjoin(plan_inbound_association, plan_inbound_association.c.plan_id == Plan.id)
+        .outerjoin(Inbound, (Inbound.id == plan_inbound_association.c.inbound_id) & Inbound.is_active.is_(True))
+        .where(Plan.is_active.is_(True))
+        .group_by(Plan.id)
+        .order_by(Plan.id)
+    ).all()
+    return PlanCatalog([PlanEntry(*row) for row in rows])
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+# با هر invalidate زیاد می‌شود تا بارگذاری async که همزمان با آن شروع شده کاتالوگ کهنه ذخیره نکند
+_catalog_version = 0
+
+def get_plan_catalog(ttl: float = PLAN_CATALOG_TTL) -> PlanCatalog:
+    """کاتالوگ کش‌شده؛ فقط بعد از باطل شدن یا گذشتن ttl از دیتابیس خوانده می‌شود"""
+    global _catalog
+    catalog = _catalog
+    if catalog and time.monotonic() - catalog.loaded_at < ttl:
+        return catalog
+    with _catalog_lock:
+        if _catalog is None or time.monotonic() - _catalog.loaded_at >= ttl:
+            session = SessionLocal()
+            try:
+                _catalog = load_plan_catalog(session)
+            finally:
+                session.close()
+        return _catalog
+
+_acatalog_lock = asyncio.Lock()
+
+async def aget_plan_catalog(ttl: float = PLAN_CATALOG_TTL) -> PlanCatalog:
+    """نسخه async تابع get_plan_catalog (همان کش مشترک؛ بارگذاری با AsyncSession)"""
+    global _catalog
+    catalog = _catalog
+    if catalog and time.monotonic() - catalog.loaded_at < ttl:
+        return catalog
+    from database.async_base import AsyncSessionLocal
+    async with _acatalog_lock:
+        catalog = _catalog
+        if catalog is None or time.monotonic() - catalog.loaded_at >= ttl:
+            version = _catalog_version
+            async with AsyncSessionLocal() as session:
+                catalog = await session.run_sync(load_plan_catalog)
+            with _catalog_lock:
+                if version == _catalog_version:
+                    _catalog = catalog
+        return catalog
+
+def invalidate_plan_catalog():
+    """بعد از ساخت/حذف/ویرایش پلن یا اینباندهای آن صدا زده شود"""
+    global _catalog, _catalog_version
+    with _catalog_lock:
+        _catalog = None
+        _catalog_version += 1
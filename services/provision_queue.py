@@ -0,0 +1,127 @@
+# services/provision_queue.py
+"""
+صف پایدار ساخت سرویس (جدول provision_jobs).
+
+تایید پرداخت فقط یک job ثبت می‌کند؛ workerها (تسک‌های async داخل پروسه ربات)
+job آماده را با یک UPDATE شرطی برمی‌دارند، پس چند پروسه ربات می‌توانند صف مشترک داشته باشند.
+jobی که اجرایش نیمه‌کاره مانده (ری‌استارت/کرش) بعد از PROVISION_JOB_LEASE دوباره برداشته می‌شود.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_, select, update
+
+from database.async_base import AsyncSessionLocal
+from database.models import ProvisionJob
+from services.xui import backoff_delay
+from config import (PROVISION_JOB_WORKERS, PROVISION_JOB_RETRIES, PROVISION_JOB_BACKOFF,
+                    PROVISION_JOB_BACKOFF_MAX, PROVISION_JOB_POLL, PROVISION_JOB_LEASE)
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+_wakeup = None
+_workers = []
+
+
+def enqueue_job(session, payment_id: int, notify_chat_id: int = None) -> ProvisionJob:
+    """ثبت job در همان تراکنش سشن (commit با صدا زننده)؛ بعد از commit، wake_workers صدا زده شود"""
+    job = ProvisionJob(payment_id=payment_id, notify_chat_id=notify_chat_id, status=PENDING,
+                       attempts=0, next_run_at=datetime.now())
+    session.add(job)
+    return job
+
+def wake_workers():
+    if _wakeup is not None:
+        _wakeup.set()
+
+async def claim_job():
+    """
+    برداشتن یک job آماده (یا رهاشده)؛ خروجی: id یا None.
+    UPDATE فقط وقتی اثر دارد که وضعیت job از لحظه خواندن تغییر نکرده باشد.
+    """
+    now = datetime.now()
+    async with AsyncSessionLocal() as session:
+        candidates = (await session.execute(
+            select(ProvisionJob.id, ProvisionJob.status, ProvisionJob.locked_at)
+            .where(or_(
+                and_(ProvisionJob.status == PENDING, ProvisionJob.next_run_at <= now),
+                and_(ProvisionJob.status == RUNNING,
+                     ProvisionJob.locked_at < now - timedelta(seconds=PROVISION_JOB_LEASE)),
+            ))
+            .order_by(ProvisionJob.next_run_at)
+            .limit(PROVISION_JOB_WORKERS)
+        )).all()
+        for job_id, status, locked_at in candidates:
+            unchanged = ProvisionJob.locked_at.is_(None) if locked_at is None else ProvisionJob.locked_at == locked_at
+            res = await session.execute(
+                update(ProvisionJob)
+                .where(ProvisionJob.id == job_id, ProvisionJob.status == status, unchanged)
+                .values(status=RUNNING, locked_at=now, attempts=ProvisionJob.attempts + 1)
+            )
+            await session.commit()
+            if res.rowcount == 1:
+                return job_id
+    return None
+
+def finish_job(job: ProvisionJob, error: str = None, purchase_id: int = None) -> str:
+    """
+    ثبت نتیجه یک اجرا روی job (commit با صدا زننده)؛ خروجی: وضعیت جدید.
+    خطا تا سقف PROVISION_JOB_RETRIES با backoff نمایی دوباره زمان‌بندی می‌شود.
+    """
+    job.locked_at = None
+    job.last_error = error[:500] if error else None
+    if error is None:
+        job.status = DONE
+        job.purchase_id = purchase_id
+    elif job.attempts >= PROVISION_JOB_RETRIES:
+        job.status = FAILED
+    else:
+        job.status = PENDING
+        delay = max(PROVISION_JOB_BACKOFF, backoff_delay(job.attempts, PROVISION_JOB_BACKOFF, PROVISION_JOB_BACKOFF_MAX))
+        job.next_run_at = datetime.now() + timedelta(seconds=delay)
+    return job.status
+
+
+async def _worker(run_job):
+    while True:
+        # قبل از بررسی صف پاک می‌شود تا job ثبت‌شده بعد از این لحظه بیدارباش را از دست ندهد
+        _wakeup.clear()
+        try:
+            job_id = await claim_job()
+        except Exception as e:
+            logger.error(f"Provision queue claim failed: {e}")
+            job_id = None
+
+        if job_id is None:
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=PROVISION_JOB_POLL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        try:
+            await run_job(job_id)
+        except Exception as e:
+            # job در وضعیت running می‌ماند و بعد از lease دوباره برداشته می‌شود
+            logger.error(f"Provision job {job_id} crashed: {e}")
+
+def start_workers(run_job, count: int = PROVISION_JOB_WORKERS):
+    """اجرای workerها روی event loop جاری؛ run_job(job_id) اجرای یک job را انجام می‌دهد"""
+    global _wakeup
+    if _workers or count <= 0:
+        return
+    _wakeup = asyncio.Event()
+    for _ in range(count):
+        _workers.append(asyncio.create_task(_worker(run_job)))
+
+async def stop_workers():
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
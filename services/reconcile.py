@@ -0,0 +1,183 @@
+# services/reconcile.py
+import logging
+import re
+from collections import namedtuple, defaultdict
+from datetime import datetime
+
+from database.base import SessionLocal
+from database.models import Server, Inbound, Plan, Purchase, plan_inbound_association
+from services.xui import get_xui_client, build_client, PanelError
+from services.json_stream import iter_settings_clients
+
+logger = logging.getLogger(__name__)
+
+CREATE = "create"
+DISABLE = "disable"
+DELETE = "delete"
+
+# یک اصلاح لازم روی پنل؛ client فقط برای create پر می‌شود
+Fix = namedtuple('Fix', 'action server_id xui_id uuid email purchase_id client')
+
+# ایمیل کلاینت‌های ساخت ربات: u + ۸ کاراکتر اول ساب آیدی (hex)، با پسوند -xui_id روی اینباندهای بعدی
+_BOT_EMAIL = re.compile(r'u[0-9a-f]{8}(?:-\d+)?')
+
+
+def sub_id_from_link(sub_link: str, uuid: str) -> str:
+    """ساب آیدی آخرین بخش لینک اشتراک است (مثل create_service)"""
+    if sub_link:
+        return sub_link.rstrip('/').rsplit('/', 1)[-1]
+    return uuid.replace('-', '')[:16]
+
+def is_bot_client(client: dict) -> bool:
+    """کلاینت با الگوی نام‌گذاری ربات ساخته شده؟ (کلاینت‌های دستی اپراتور یتیم حساب نمی‌شوند)"""
+    return bool(_BOT_EMAIL.fullmatch(client.get('email') or ''))
+
+def _expected_clients(session, server_id: int) -> dict:
+    """
+    xui_id --> {uuid: ردیف خرید} برای خریدهایی که پلنشان روی این سرور اینباند دارد
+    (یک کوئری برای کل سرور)
+    """
+    rows = (
+        session.query(
+            Inbound.xui_id, Inbound.protocol,
+            Purchase.id, Purchase.uuid, Purchase.sub_link, Purchase.expire_date, Purchase.is_active,
+            Plan.volume_gb, Plan.limit_ip
+        )
+        .join(plan_inbound_association, plan_inbound_association.c.inbound_id == Inbound.id)
+        .join(Purchase, Purchase.plan_id == plan_inbound_association.c.plan_id)
+        .join(Plan, Plan.id == Purchase.plan_id)
+        .filter(Inbound.server_id == server_id, Purchase.uuid.isnot(None))
+        .all()
+    )
+    expected = defaultdict(dict)
+    for row in rows:
+        expected[row.xui_id][row.uuid] = row
+    return expected
+
+def _panel_clients(client, managed: set) -> dict:
+    """
+    xui_id --> {uuid: کلاینت پنل} فقط برای اینباندهای ثبت‌شده در دیتابیس (یک درخواست list).
+    settings ناقص PanelError می‌دهد؛ لیست ناقص کلاینت‌های موجود را گم‌شده نشان می‌داد.
+    """
+    snapshot = {}
+    for inbound in client.iter_inbounds():
+        if inbound.get('id') in managed:
+            try:
+                snapshot[inbound['id']] = {c.get('id'): c for c in iter_settings_clients(inbound)}
+            except ValueError as e:
+                raise PanelError(f"inbound {inbound['id']}: {e}") from e
+    return snapshot
+
+def diff_server(expected: dict, panel: dict, known_uuids: set, server_id: int, now: datetime = None) -> list:
+    """
+    مقایسه وضعیت مورد انتظار با اسنپ‌شات پنل با عملیات مجموعه‌ای:
+    - خرید فعال که روی اینباند نیست --> create
+    - خرید منقضی/غیرفعال که روی پنل هنوز فعال است --> disable
+    - کلاینت ساخت ربات که UUID آن به هیچ خریدی تعلق ندارد --> delete (یتیم)
+    """
+    now = now or datetime.now()
+    fixes = []
+    # ایمیل در کل پنل یکتاست؛ ایمیل‌های گرفته‌شده (روی پنل یا در همین اصلاحات) نگه داشته می‌شوند
+    taken = {c.get('email') for clients in panel.values() for c in clients.values()}
+
+    for xui_id, present in panel.items():
+        wanted = expected.get(xui_id, {})
+        active = {u for u, r in wanted.items() if r.is_active and (r.expire_date is None or r.expire_date > now)}
+        present_ids = set(present)
+
+        for uuid in active - present_ids:
+            r = wanted[uuid]
+            sub_id = sub_id_from_link(r.sub_link, uuid)
+            email = f"u{sub_id[:8]}"
+            if email in taken:
+                email = f"{email}-{xui_id}"
+            taken.add(email)
+            expiry = int(r.expire_date.timestamp() * 1000) if r.expire_date else 0
+            flow = "xtls-rprx-vision" if "reality" in (r.protocol or "").lower() else ""
+            client = build_client(email, uuid, sub_id, total_gb=r.volume_gb or 0, expiry_time=expiry,
+                                  limit_ip=r.limit_ip, flow=flow)
+            fixes.append(Fix(CREATE, server_id, xui_id, uuid, email, r.id, client))
+
+        for uuid in (set(wanted) - active) & present_ids:
+            if present[uuid].get('enable', True):
+                fixes.append(Fix(DISABLE, server_id, xui_id, uuid, present[uuid].get('email'), wanted[uuid].id, None))
+
+        for uuid in present_ids - known_uuids:
+            if not is_bot_client(present[uuid]):
+                continue
+            fixes.append(Fix(DELETE, server_id, xui_id, uuid, present[uuid].get('email'), None, None))
+    return fixes
+
+def apply_fixes(client, fixes: list, delete_orphans: bool = False) -> dict:
+    """
+    اعمال اصلاحات روی پنل: ساخت‌ها به صورت گروهی برای هر اینباند (add_clients_bulk)،
+    غیرفعال‌سازی برای هر (اینباند، ایمیل). حذف یتیم‌ها فقط با delete_orphans.
+    """
+    done = {CREATE: 0, DISABLE: 0, DELETE: 0, 'failed': 0}
+
+    creates = defaultdict(list)
+    for f in fixes:
+        if f.action == CREATE:
+            creates[f.xui_id].append(f.client)
+    for xui_id, clients in creates.items():
+        result = client.add_clients_bulk(xui_id, clients)
+        ok = sum(1 for v in result.values() if v)
+        done[CREATE] += ok
+        done['failed'] += len(clients) - ok
+
+    # UUID یک خرید روی چند اینباند با ایمیل‌های مختلف است؛ هر (اینباند، ایمیل) جدا غیرفعال می‌شود
+    disables = defaultdict(dict)
+    for f in fixes:
+        if f.action == DISABLE:
+            disables[f.xui_id][f.email] = {"enable": False}
+    for xui_id, updates in disables.items():
+        result = client.update_clients_on_inbound(xui_id, updates)
+        ok = sum(1 for v in result.values() if v)
+        done[DISABLE] += ok
+        done['failed'] += len(updates) - ok
+
+    if delete_orphans:
+        deletes = defaultdict(list)
+        for f in fixes:
+            if f.action == DELETE:
+                deletes[f.xui_id].append(f.email)
+        for xui_id, emails in deletes.items():
+            result = client.delete_clients_on_inbound(xui_id, emails)
+            ok = sum(1 for v in result.values() if v)
+            done[DELETE] += ok
+            done['failed'] += len(emails) - ok
+    return done
+
+def reconcile_server(session, server, known_uuids: set, apply: bool = False, delete_orphans: bool = False) -> dict:
+    report = {'server': server.name, 'fixes': [], 'applied': None, 'error': None}
+    managed = {xui_id for (xui_id,) in session.query(Inbound.xui_id).filter_by(server_id=server.id)}
+    if not managed:
+        return report
+
+    client = get_xui_client(server)
+    try:
+        panel = _panel_clients(client, managed)
+    except PanelError as e:
+        report['error'] = str(e)[:200]
+        return report
+
+    report['fixes'] = diff_server(_expected_clients(session, server.id), panel, known_uuids, server.id)
+    if apply and report['fixes']:
+        report['applied'] = apply_fixes(client, report['fixes'], delete_orphans=delete_orphans)
+    return report
+
+def reconcile_all(apply: bool = False, delete_orphans: bool = False) -> list:
+    """مقایسه (و در صورت نیاز اصلاح) همه سرورهای فعال؛ خروجی: گزارش هر سرور"""
+    session = SessionLocal()
+    try:
+        known_uuids = {u for (u,) in session.query(Purchase.uuid).filter(Purchase.uuid.isnot(None))}
+        reports = []
+        for server in session.query(Server).filter_by(is_active=True).all():
+            try:
+                reports.append(reconcile_server(session, server, known_uuids, apply, delete_orphans))
+            except Exception as e:
+                logger.error(f"Reconcile failed for {server.name}: {e}")
+                reports.append({'server': server.name, 'fixes': [], 'applied': None, 'error': str(e)[:200]})
+        return reports
+    finally:
+        session.close()
@@ -0,0 +1,98 @@
+# services/state_store.py
+"""
+ذخیره وضعیت ویزاردها (کلید: chat id، مقدار: دیکشنری قابل تبدیل به JSON).
+هر وضعیت بعد از STATE_TTL ثانیه بدون تغییر منقضی می‌شود؛ تغییر روی دیکشنری
+برگشتی تا صدا زدن set ذخیره نمی‌شود.
+"""
+import json
+import time
+import weakref
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select
+
+from database.async_base import AsyncSessionLocal, abulk_upsert
+from database.models import ConversationState
+from services.xui import TTLCache
+from config import STATE_STORE, STATE_TTL, STATE_CACHE_SIZE
+
+
+class MemoryStateStore:
+    """داخل پروسه؛ حافظه با سقف maxsize (LRU) و انقضای زمانی محدود می‌ماند"""
+
+    def __init__(self, ttl: float = STATE_TTL, maxsize: int = STATE_CACHE_SIZE):
+        self._cache = TTLCache(ttl=ttl, maxsize=maxsize)
+
+    async def get(self, chat_id: int):
+        # کپی JSON تا رفتار با backend دیتابیسی یکسان باشد (بدون set چیزی ذخیره نمی‌شود)
+        raw = self._cache.get(chat_id)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, chat_id: int, state: dict):
+        self._cache.set(chat_id, json.dumps(state))
+
+    async def delete(self, chat_id: int):
+        self._cache.pop(chat_id)
+
+
+class DBStateStore:
+    """جدول conversation_states؛ scope ویزاردهای مختلف را در یک جدول جدا می‌کند"""
+
+    # فاصله پاک کردن ردیف‌های منقضی (ثانیه)
+    PURGE_INTERVAL = 600
+
+    def __init__(self, scope: str, ttl: float = STATE_TTL):
+        self.scope = scope
+        self.ttl = ttl
+        self._purge_at = 0.0
+
+    async def get(self, chat_id: int):
+        async with AsyncSessionLocal() as session:
+            raw = await session.scalar(
+                select(ConversationState.data).where(
+                    ConversationState.scope == self.scope,
+                    ConversationState.chat_id == chat_id,
+                    ConversationState.expires_at > datetime.now(),
+                )
+            )
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, chat_id: int, state: dict):
+        row = {'scope': self.scope, 'chat_id': chat_id, 'data': json.dumps(state),
+               'expires_at': datetime.now() + timedelta(seconds=self.ttl)}
+        async with AsyncSessionLocal() as session:
+            await abulk_upsert(session, ConversationState, [row], ['scope', 'chat_id'], ['data', 'expires_at'])
+            if time.monotonic() >= self._purge_at:
+                self._purge_at = time.monotonic() + self.PURGE_INTERVAL
+                await session.execute(delete(ConversationState).where(ConversationState.expires_at <= datetime.now()))
+            await session.commit()
+
+    async def delete(self, chat_id: int):
+        async with AsyncSessionLocal() as session:
+            await session.execute(delete(ConversationState).where(
+                ConversationState.scope == self.scope, ConversationState.chat_id == chat_id))
+            await session.commit()
+
+
+# پیام --> {(store, chat id): وضعیت}؛ با تمام شدن پردازش آپدیت خودبه‌خود آزاد می‌شود
+_read_for_message = weakref.WeakKeyDictionary()
+
+async def get_for_message(store, message):
+    """
+    store.get برای chat پیام، یک بار در هر آپدیت: فیلتر هندلر و خود هندلر
+    همان نتیجه را می‌گیرند (با backend دیتابیسی یک رفت‌وبرگشت به جای دو).
+    """
+    reads = _read_for_message.setdefault(message, {})
+    key = (id(store), message.chat.id)
+    if key not in reads:
+        reads[key] = await store.get(message.chat.id)
+    return reads[key]
+
+
+def make_state_store(scope: str, backend: str = STATE_STORE):
+    """backend بر اساس STATE_STORE (memory یا db)"""
+    if backend == 'db':
+        return DBStateStore(scope)
+    if backend == 'memory':
+        return MemoryStateStore()
+    raise ValueError(f"unknown STATE_STORE: {backend}")
@@ -0,0 +1,118 @@
+# services/traffic_sync.py
+import logging
+import threading
+import time
+from datetime import datetime
+
+from database.base import SessionLocal, bulk_upsert
+from database.models import Server, Inbound, Purchase, ClientUsage, ServerSyncState, plan_inbound_association
+from services.xui import get_xui_client, PanelError
+from services.json_stream import iter_settings_clients
+from config import TRAFFIC_SYNC_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+USAGE_FIELDS = ['up', 'down', 'total', 'expiry_time', 'enable', 'updated_at']
+
+
+def _server_purchases(session, server_id: int) -> dict:
+    """UUID --> purchase_id برای خریدهایی که پلنشان روی این سرور اینباند دارد"""
+    rows = (
+        session.query(Purchase.uuid, Purchase.id)
+        .join(plan_inbound_association, plan_inbound_association.c.plan_id == Purchase.plan_id)
+        .join(Inbound, Inbound.id == plan_inbound_association.c.inbound_id)
+        .filter(Inbound.server_id == server_id, Purchase.uuid.isnot(None))
+        .distinct()
+        .all()
+    )
+    return dict(rows)
+
+def collect_usage(inbounds, purchases: dict, server_id: int) -> list:
+    """
+    ساخت ردیف‌های ClientUsage از اینباندهای پنل (لیست یا iterator).
+    آمار هر کلاینت در clientStats (بر اساس ایمیل) و UUID آن در settings است؛
+    آمار هر ایمیل فقط یک بار شمرده می‌شود. settings ناقص PanelError می‌دهد
+    تا مصرف یک خرید با جمع بخشی از اینباندها بازنویسی نشود.
+    """
+    now = datetime.now()
+    per_purchase = {}  # purchase_id --> {email: stat}
+    for inbound in inbounds:
+        stats = {st.get('email'): st for st in (inbound.get('clientStats') or [])}
+        if not stats:
+            continue
+        try:
+            for c in iter_settings_clients(inbound):
+                pid = purchases.get(c.get('id'))
+                st = stats.get(c.get('email'))
+                if pid and st:
+                    per_purchase.setdefault(pid, {})[c['email']] = st
+        except ValueError as e:
+            raise PanelError(f"inbound {inbound.get('id')}: {e}") from e
+
+    rows = []
+    for pid, by_email in per_purchase.items():
+        records = list(by_email.values())
+        rows.append({
+            'purchase_id': pid,
+            'server_id': server_id,
+            'up': sum(r.get('up') or 0 for r in records),
+            'down': sum(r.get('down') or 0 for r in records),
+            'total': max(r.get('total') or 0 for r in records),
+            'expiry_time': max(r.get('expiryTime') or 0 for r in records),
+            'enable': any(r.get('enable', True) for r in records),
+            'updated_at': now,
+        })
+    return rows
+
+def sync_server_traffic(session, server) -> int:
+    """
+    همگام‌سازی ترافیک همه کلاینت‌های یک سرور با یک درخواست inbounds/list
+    و یک upsert گروهی. خروجی: تعداد خریدهای به‌روزشده
+    """
+    state = {'server_id': server.id, 'last_error': None}
+    try:
+        # لیست اینباندها stream می‌شود تا حافظه روی پنل‌های بزرگ محدود بماند
+        rows = collect_usage(get_xui_client(server).iter_inbounds(), _server_purchases(session, server.id), server.id)
+    except PanelError as e:
+        state['last_error'] = str(e)[:200]
+        bulk_upsert(session, ServerSyncState, [state], ['server_id'], ['last_error'])
+        session.commit()
+        return 0
+
+    bulk_upsert(session, ClientUsage, rows, ['purchase_id', 'server_id'], USAGE_FIELDS)
+
+    state.update(last_synced_at=datetime.now(), clients_synced=len(rows))
+    bulk_upsert(session, ServerSyncState, [state], ['server_id'], ['last_synced_at', 'last_error', 'clients_synced'])
+    session.commit()
+    return len(rows)
+
+def sync_all_servers():
+    session = SessionLocal()
+    try:
+        servers = session.query(Server).filter_by(is_active=True).all()
+        for server in servers:
+            try:
+                count = sync_server_traffic(session, server)
+                logger.info(f"Traffic synced for {server.name}: {count} purchases")
+            except Exception as e:
+                session.rollback()
+                logger.error(f"Traffic sync failed for {server.name}: {e}")
+    finally:
+        session.close()
+
+def start_traffic_sync(interval: int = TRAFFIC_SYNC_INTERVAL):
+    """اجرای دوره‌ای همگام‌سازی ترافیک در یک ترد پس‌زمینه"""
+    if interval <= 0:
+        return None
+
+    def loop():
+        while True:
+            try:
+                sync_all_servers()
+            except Exception as e:
+                logger.error(f"Traffic sync loop error: {e}")
+            time.sleep(interval)
+
+    t = threading.Thread(target=loop, name="traffic-sync", daemon=True)
+    t.start()
+    return t
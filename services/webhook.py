@@ -0,0 +1,99 @@
+# services/webhook.py
+import asyncio
+import hmac
+import json
+import logging
+import secrets
+
+from aiohttp import web
+from telebot import types
+
+from config import (WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_MAX_CONNECTIONS,
+                    WEBHOOK_CONCURRENCY)
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# آپدیت‌های تلگرام کوچک‌اند؛ بدنه بزرگ‌تر رد می‌شود
+MAX_BODY = 1 << 20
+
+
+def make_webhook_app(bot, path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET,
+                     concurrency: int = WEBHOOK_CONCURRENCY) -> web.Application:
+    """
+    دریافت آپدیت‌ها از تلگرام: بررسی مسیر و secret، سپس تحویل به همان هندلرهای ثبت‌شده.
+    هندلرها در یک تسک جدا روی همان event loop اجرا می‌شوند و پاسخ 200 بلافاصله برمی‌گردد،
+    مگر concurrency آپدیت در حال پردازش باشد؛ آن‌وقت پاسخ تا آزاد شدن یک جا منتظر می‌ماند
+    تا تلگرام (با سقف max_connections) آپدیت بیشتری نفرستد.
+    """
+    # ارجاع به تسک‌های در حال اجرا تا قبل از پایان جمع‌آوری نشوند
+    pending = set()
+    limit = asyncio.Semaphore(concurrency)
+
+    def done(task):
+        pending.discard(task)
+        limit.release()
+
+    async def receive(request: web.Request):
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            return web.Response(status=403)
+        if not request.content_length:
+            return web.Response(status=400)
+        try:
+            update = types.Update.de_json(json.loads(await request.read()))
+        except ValueError:
+            return web.Response(status=400)
+        await limit.acquire()
+        task = asyncio.create_task(_process(bot, update))
+        pending.add(task)
+        task.add_done_callback(done)
+        return web.Response(status=200)
+
+    # بدنه بزرگ‌تر از MAX_BODY با خطای 413 خود aiohttp رد می‌شود؛ مسیرهای دیگر 404 می‌گیرند
+    app = web.Application(client_max_size=MAX_BODY)
+    app.router.add_post(path, receive)
+    return app
+
+
+async def _process(bot, update):
+    try:
+        await bot.process_new_updates([update])
+    except Exception as e:
+        logger.error(f"Webhook update {update.update_id} failed: {e}")
+
+
+async def run_webhook(bot, public_url: str = WEBHOOK_URL, path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET,
+                      listen: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT) -> bool:
+    """
+    ثبت webhook در تلگرام و اجرای سرور HTTP (تا لغو تسک / توقف پروسه).
+    اگر آدرس عمومی تنظیم نشده باشد یا ثبت webhook شکست بخورد False برمی‌گرداند
+    تا main به حالت polling برگردد.
+    """
+    if not public_url:
+        logger.error("WEBHOOK_URL is not set")
+        return False
+    # بدون secret ثابت، یک secret تصادفی برای همین اجرا ساخته می‌شود
+    secret = secret or secrets.token_urlsafe(32)
+    runner = web.AppRunner(make_webhook_app(bot, path, secret), access_log=None)
+    await runner.setup()
+    try:
+        try:
+            await web.TCPSite(runner, listen, port).start()
+        except OSError as e:
+            logger.error(f"Webhook listen on {listen}:{port} failed: {e}")
+            return False
+        try:
+            await bot.remove_webhook()
+            ok = await bot.set_webhook(url=public_url.rstrip('/') + path, secret_token=secret,
+                                       max_connections=WEBHOOK_MAX_CONNECTIONS)
+        except Exception as e:
+            logger.error(f"set_webhook failed: {e}")
+            ok = False
+        if not ok:
+            return False
+
+        logger.info(f"Webhook listening on {listen}:{port}{path}")
+        await asyncio.Event().wait()
+        return True
+    finally:
+        await runner.cleanup()
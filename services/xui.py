@@ -2,21 +2,203 @@
 import requests
 import json
 import logging
+import itertools
+import random
+import threading
+import time
+from collections import deque, OrderedDict
 import urllib3
 
+from config import XUI_RETRIES, XUI_BACKOFF_BASE, XUI_BACKOFF_MAX
+from services.circuit_breaker import get_breaker
+from services.json_stream import iter_json_array
+
 # غیرفعال کردن اخطارهای امنیتی SSL
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 # تنظیمات لاگ
 logger = logging.getLogger(__name__)
 
+class PanelError(Exception):
+    """پاسخ پنل دریافت نشد یا نامعتبر بود"""
+
+class PanelUnavailable(PanelError):
+    """circuit breaker پنل باز است و درخواست ارسال نشد"""
+
+# حداکثر تعداد کلاینت در هر درخواست addClient گروهی
+BULK_CHUNK_SIZE = 200
+
+# ==========================
+# ساخت payload (مشترک بین کلاینت sync و async)
+# ==========================
+def build_client(email: str, uuid: str, sub_id: str, total_gb: float = 0, expiry_time: int = 0, enable: bool = True, limit_ip: int = 1, flow: str = "") -> dict:
+    """ساخت رکورد کلاینت پنل؛ حجم یا زمان صفر/منفی یعنی نامحدود"""
+    # محاسبه حجم (اگر صفر یا کمتر بود، یعنی نامحدود، پس 0 میفرستیم)
+    final_total = int(total_gb * 1024**3) if total_gb > 0 else 0
+    
+    # محاسبه زمان (اگر صفر یا کمتر بود، یعنی نامحدود، پس 0 میفرستیم)
+    final_expiry = expiry_time if expiry_time > 0 else 0
+
+    return {
+        "id": uuid,
+        "email": email,
+        "limitIp": limit_ip,
+        "totalGB": final_total, 
+        "expiryTime": final_expiry,
+        "enable": enable,
+        "tgId": "",
+        "subId": sub_id,  # <--- ارسال دستی SubID
+        "flow": flow
+    }
+
+def clients_payload(inbound_id: int, clients: list) -> dict:
+    """بدنه درخواست addClient؛ پنل لیست کلاینت‌ها را یکجا می‌پذیرد"""
+    return {
+        "id": inbound_id,
+        "settings": json.dumps({"clients": clients})
+    }
+
+def chunked(items: list, size: int) -> list:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def build_inbound_payload(remark: str, port: int, protocol: str, settings: dict, stream_settings: dict) -> dict:
+    return {
+        "up": 0, "down": 0, "total": 0, "remark": remark,
+        "enable": True, "expiryTime": 0,
+        "listen": "", "port": port, "protocol": protocol,
+        "settings": json.dumps(settings),
+        "streamSettings": json.dumps(stream_settings),
+        "sniffing": json.dumps({"enabled": True, "destOverride": ["http", "tls"]})
+    }
+
+def merge_client_update(client_uuid: str, db_id, current_data, client_settings: dict) -> dict:
+    """ادغام تغییرات با اطلاعات فعلی کلاینت تا فیلدهای ضروری حذف نشوند"""
+    if not current_data:
+        # اگر نتوانستیم اطلاعات فعلی را بگیریم، یک قالب پیش‌فرض می‌سازیم
+        current_data = {
+            "id": client_uuid,
+            "flow": "",
+            "limitIp": 0,
+            "totalGB": 0,
+            "expiryTime": 0,
+            "enable": True,
+            "tgId": "",
+            "subId": ""
+        }
+    else:
+        current_data = dict(current_data)
+
+    current_data.update(client_settings)
+    
+    # اطمینان از اینکه فیلدهای حیاتی وجود دارند (پنل بدون اینها ارور می‌دهد)
+    if "limitIp" not in current_data: current_data["limitIp"] = 0
+    if "flow" not in current_data: current_data["flow"] = ""
+    if "totalGB" not in current_data: current_data["totalGB"] = 0
+    if "email" not in current_data: current_data["email"] = f"user_{db_id}"
+    return current_data
+
+def backoff_delay(attempt: int, base: float = XUI_BACKOFF_BASE, cap: float = XUI_BACKOFF_MAX) -> float:
+    """تاخیر تصادفی (full jitter) برای تلاش شماره attempt"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def first_traffic_record(res):
+    """خروجی getClientTrafficsById ممکن است لیست یا دیکشنری باشد"""
+    if res and res.get('success'):
+        data = res.get('obj')
+        if isinstance(data, list) and data:
+            return data[0]
+        elif isinstance(data, dict):
+            return data
+    return None
+
+class InboundSnapshot:
+    """
+    نسخه کش‌شده یک اینباند: settings فقط یک بار parse می‌شود و کلاینت‌ها
+    بر اساس UUID و ایمیل ایندکس می‌شوند تا جستجوی هر کلاینت O(1) باشد.
+    """
+
+    def __init__(self, inbound: dict, version: int):
+        self.inbound_id = inbound.get('id')
+        self.version = version
+        try:
+            clients = json.loads(inbound.get('settings') or '{}').get('clients', [])
+        except Exception:
+            clients = []
+        self.by_id = {c['id']: c for c in clients if c.get('id')}
+        self.by_email = {c['email']: c for c in clients if c.get('email')}
+        self.stats_by_email = {st['email']: st for st in (inbound.get('clientStats') or []) if st.get('email')}
+        # رشته حجیم settings نگه داشته نمی‌شود
+        self.inbound = {k: v for k, v in inbound.items() if k not in ('settings', 'clientStats')}
+
+    def find(self, uuid_or_email: str):
+        return self.by_id.get(uuid_or_email) or self.by_email.get(uuid_or_email)
+
+    def indexed_clients(self):
+        """(uuid، شناسه عددی پنل، رکورد ترافیک) برای کلاینت‌هایی که آمار دارند"""
+        for email, st in self.stats_by_email.items():
+            c = self.by_email.get(email)
+            if c and 'id' in st:
+                yield c.get('id'), st['id'], st
+
+# ==========================
+# کش زمان‌دار
+# ==========================
+class TTLCache:
+    """کش LRU با انقضای زمانی و سقف اندازه (امن برای چند ترد)"""
+
+    def __init__(self, ttl: float, maxsize: int = 50000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[1] if item else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
 class XUIClient:
-    def __init__(self, panel_url: str, username: str, password: str):
+    def __init__(self, panel_url: str, username: str, password: str, index_ttl: float = 300, snapshot_ttl: float = 60, breaker=None, retries: int = XUI_RETRIES):
         self.base_url = panel_url.rstrip('/')
+        # تعداد تلاش مجدد برای خطاهای گذرا (timeout، قطعی شبکه، 5xx)
+        self.retries = retries
+        # circuit breaker اختیاری؛ کلاینت‌های رجیستری breaker سرور خود را دارند
+        self.breaker = breaker
         self.username = username
         self.password = password
         self.session = requests.Session()
         self.is_logged_in = False
+        # شمارنده لاگین برای جلوگیری از لاگین همزمان چند ترد پس از 401
+        self._login_gen = 0
+        self._login_lock = threading.Lock()
+        # ایندکس UUID/ایمیل --> (شناسه عددی پنل، آخرین رکورد کلاینت)
+        self._client_index = TTLCache(index_ttl)
+        # اسنپ‌شات اینباندها با ایندکس کلاینت‌ها (با TTL یا بعد از نوشتن خودمان تازه می‌شود)
+        self._snapshots = TTLCache(snapshot_ttl, maxsize=256)
+        self._snapshot_seq = itertools.count(1)
         
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
@@ -34,50 +216,145 @@ class XUIClient:
         url = self._get_url('/login')
         payload = {'username': self.username, 'password': self.password}
         try:
-            response = self.session.post(url, json=payload, timeout=30)
+            response = self._send('POST', url, json=payload, timeout=30)
             if response.status_code == 200 and response.json().get('success'):
                 self.is_logged_in = True
+                self._login_gen += 1
                 return True
+            self.is_logged_in = False
             return False
         except Exception as e:
             logger.error(f"Login Error: {e}")
             return False
 
-    def _request(self, method: str, endpoint: str, **kwargs):
-        if not self.is_logged_in:
-            if not self.login(): return None
+    def ensure_login(self) -> bool:
+        """فقط در صورت نبود سشن معتبر لاگین می‌کند"""
+        if self.is_logged_in:
+            return True
+        with self._login_lock:
+            if self.is_logged_in:
+                return True
+            return self.login()
+
+    def _relogin(self, seen_gen: int) -> bool:
+        """لاگین مجدد پس از 401/403؛ اگر ترد دیگری زودتر لاگین کرده باشد تکرار نمی‌شود"""
+        with self._login_lock:
+            if self._login_gen != seen_gen and self.is_logged_in:
+                return True
+            self.is_logged_in = False
+            return self.login()
+
+    def _send(self, method: str, url: str, **kwargs):
+        """ارسال خام درخواست با گزارش نتیجه و تاخیر به circuit breaker"""
+        if self.breaker and not self.breaker.allow():
+            raise PanelUnavailable(f"circuit open for {self.base_url}")
+        start = time.monotonic()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except Exception:
+            if self.breaker: self.breaker.record(False, time.monotonic() - start)
+            raise
+        if self.breaker: self.breaker.record(response.status_code < 500, time.monotonic() - start)
+        return response
+
+    def _request(self, method: str, endpoint: str, retry: bool = None, **kwargs):
+        """
+        retry: تلاش مجدد با backoff برای خطاهای گذرا؛ پیش‌فرض فقط برای GET.
+        درخواست‌های غیر idempotent (مثل addClient) خودشان قبل از تلاش مجدد
+        بررسی می‌کنند که عملیات قبلی انجام نشده باشد.
+        """
+        if retry is None:
+            retry = method == 'GET'
+        attempts = self.retries + 1 if retry else 1
+        for attempt in range(attempts):
+            if attempt:
+                time.sleep(backoff_delay(attempt - 1))
+            res, transient = self._request_once(method, endpoint, **kwargs)
+            if not transient or self._circuit_open():
+                break
+        return res
+
+    def _circuit_open(self) -> bool:
+        return bool(self.breaker and self.breaker.is_open())
+
+    def _request_once(self, method: str, endpoint: str, **kwargs):
+        """خروجی: (پاسخ json یا None، آیا خطا گذرا بود)"""
+        if not self.ensure_login(): return None, False
 
         url = self._get_url(endpoint)
         req_kwargs = {'timeout': 30, 'verify': False}
         req_kwargs.update(kwargs)
 
         try:
-            response = self.session.request(method, url, **req_kwargs)
+            seen_gen = self._login_gen
+            response = self._send(method, url, **req_kwargs)
             if response.status_code in [401, 403]:
-                if self.login():
-                    response = self.session.request(method, url, **req_kwargs)
+                if self._relogin(seen_gen):
+                    response = self._send(method, url, **req_kwargs)
                 else:
-                    return None
-            return response.json()
+                    return None, False
+            if response.status_code >= 500:
+                logger.warning(f"API Request Error ({endpoint}): HTTP {response.status_code}")
+                return None, True
+            return response.json(), False
+        except PanelUnavailable as e:
+            logger.warning(f"API Request Skipped ({endpoint}): {e}")
+            return None, False
+        except requests.RequestException as e:
+            logger.error(f"API Request Error ({endpoint}): {e}")
+            return None, True
         except Exception as e:
             logger.error(f"API Request Error ({endpoint}): {e}")
-            return None
+            return None, False
 
     # ==========================
     # توابع کمکی هوشمند
     # ==========================
     def _get_client_db_id(self, uuid: str):
         """یافتن شناسه عددی کلاینت با UUID"""
-        traffic_data = self.get_client_traffic(uuid)
-        if traffic_data and 'id' in traffic_data:
-            return traffic_data['id']
-        return None
+        db_id, _ = self._lookup_client(uuid)
+        return db_id
+
+    def _lookup_client(self, uuid: str):
+        """(شناسه عددی، رکورد) از ایندکس؛ در صورت نبود، یک درخواست ترافیک"""
+        entry = self._client_index.get(uuid)
+        if entry:
+            return entry
+        record = self.get_client_traffic(uuid)
+        if record and 'id' in record:
+            return record['id'], record
+        return None, None
+
+    def _remember_client(self, db_id, record: dict, *keys):
+        entry = (db_id, record)
+        for key in keys + (record.get('email'),):
+            if key:
+                self._client_index.set(key, entry)
+
+    def _forget_client(self, uuid: str):
+        entry = self._client_index.pop(uuid)
+        if entry and entry[1].get('email'):
+            self._client_index.pop(entry[1]['email'])
+
+    def _store_snapshot(self, inbound: dict) -> InboundSnapshot:
+        snap = InboundSnapshot(inbound, next(self._snapshot_seq))
+        self._snapshots.set(snap.inbound_id, snap)
+        for uuid, db_id, record in snap.indexed_clients():
+            self._remember_client(db_id, record, uuid)
+        return snap
+
+    def _invalidate_snapshot(self, inbound_id=None):
+        """بعد از هر نوشتن، اسنپ‌شات اینباند (یا همه اگر نامعلوم باشد) کهنه می‌شود"""
+        if inbound_id is None:
+            self._snapshots.clear()
+        else:
+            self._snapshots.pop(inbound_id)
 
     # ==========================
     # 1. مدیریت سیستم
     # ==========================
     def get_system_status(self):
-        return self._request('POST', '/panel/api/inbounds/onlines')
+        return self._request('POST', '/panel/api/inbounds/onlines', retry=True)
 
     def get_xray_version(self):
         return self._request('GET', '/server/status')
@@ -86,31 +363,68 @@ class XUIClient:
     # 2. مدیریت اینباندها
     # ==========================
     def get_inbounds(self):
+        return self.fetch_inbounds() or []
+
+    def iter_inbounds(self, chunk_size: int = 1 << 16):
+        """
+        نسخه stream از get_inbounds: اینباندها یکی‌یکی از بدنه پاسخ decode می‌شوند
+        تا لیست کامل (و settings همه اینباندها) همزمان در حافظه نباشد.
+        در صورت خطای اتصال یا پاسخ ناقص PanelError می‌دهد.
+        """
+        if not self.ensure_login():
+            raise PanelError("login failed")
+        url = self._get_url('/panel/api/inbounds/list')
+        try:
+            seen_gen = self._login_gen
+            response = self._send('GET', url, stream=True, timeout=30, verify=False)
+            if response.status_code in [401, 403]:
+                response.close()
+                if not self._relogin(seen_gen):
+                    raise PanelError("login failed")
+                response = self._send('GET', url, stream=True, timeout=30, verify=False)
+            with response:
+                if response.status_code != 200:
+                    raise PanelError(f"HTTP {response.status_code}")
+                yield from iter_json_array(response.iter_content(chunk_size), 'obj')
+        except PanelError:
+            raise
+        except (requests.RequestException, ValueError) as e:
+            raise PanelError(f"inbounds/list: {e}") from e
+
+    def fetch_inbounds(self):
+        """مثل get_inbounds ولی در صورت خطا None برمی‌گرداند (تا با پنل خالی اشتباه نشود)"""
         res = self._request('GET', '/panel/api/inbounds/list')
-        return res.get('obj', []) if res and res.get('success') else []
+        return (res.get('obj') or []) if res and res.get('success') else None
 
     def get_inbound(self, inbound_id: int):
         res = self._request('GET', f'/panel/api/inbounds/get/{inbound_id}')
-        return res.get('obj') if res and res.get('success') else None
+        inbound = res.get('obj') if res and res.get('success') else None
+        if inbound:
+            self._store_snapshot(inbound)
+        return inbound
+
+    def get_inbound_snapshot(self, inbound_id: int, fresh: bool = False):
+        """اسنپ‌شات کش‌شده اینباند؛ fresh=True یعنی حتماً از پنل خوانده شود"""
+        snap = None if fresh else self._snapshots.get(inbound_id)
+        if snap:
+            return snap
+        res = self._request('GET', f'/panel/api/inbounds/get/{inbound_id}')
+        inbound = res.get('obj') if res and res.get('success') else None
+        return self._store_snapshot(inbound) if inbound else None
 
     def add_inbound(self, remark: str, port: int, protocol: str, settings: dict, stream_settings: dict):
-        payload = {
-            "up": 0, "down": 0, "total": 0, "remark": remark,
-            "enable": True, "expiryTime": 0,
-            "listen": "", "port": port, "protocol": protocol,
-            "settings": json.dumps(settings),
-            "streamSettings": json.dumps(stream_settings),
-            "sniffing": json.dumps({"enabled": True, "destOverride": ["http", "tls"]})
-        }
+        payload = build_inbound_payload(remark, port, protocol, settings, stream_settings)
         res = self._request('POST', '/panel/api/inbounds/add', json=payload)
         return res and res.get('success')
 
     def update_inbound(self, inbound_id: int, data: dict):
-        res = self._request('POST', f'/panel/api/inbounds/update/{inbound_id}', json=data)
+        res = self._request('POST', f'/panel/api/inbounds/update/{inbound_id}', json=data, retry=True)
+        self._invalidate_snapshot(inbound_id)
         return res and res.get('success')
 
     def delete_inbound(self, inbound_id: int):
         res = self._request('POST', f'/panel/api/inbounds/del/{inbound_id}')
+        self._invalidate_snapshot(inbound_id)
         return res and res.get('success')
 
     # ==========================
@@ -122,109 +436,183 @@ class XUIClient:
         total_gb <= 0  --> نامحدود
         expiry_time <= 0 --> نامحدود (Lifetime)
         """
-        
-        # محاسبه حجم (اگر صفر یا کمتر بود، یعنی نامحدود، پس 0 میفرستیم)
-        final_total = int(total_gb * 1024**3) if total_gb > 0 else 0
-        
-        # محاسبه زمان (اگر صفر یا کمتر بود، یعنی نامحدود، پس 0 میفرستیم)
-        final_expiry = expiry_time if expiry_time > 0 else 0
-
-        client = {
-            "id": uuid,
-            "email": email,
-            "limitIp": limit_ip,
-            "totalGB": final_total, 
-            "expiryTime": final_expiry,
-            "enable": enable,
-            "tgId": "",
-            "subId": sub_id,  # <--- ارسال دستی SubID
-            "flow": flow
-        }
-        
-        payload = {
-            "id": inbound_id,
-            "settings": json.dumps({"clients": [client]})
-        }
-        
-        res = self._request('POST', '/panel/api/inbounds/addClient', json=payload)
-        return res and res.get('success')
+        client = build_client(email, uuid, sub_id, total_gb, expiry_time, enable, limit_ip, flow)
+        return self.add_clients_bulk(inbound_id, [client]).get(email, False)
+
+    def _created_clients(self, inbound_id: int, clients: list) -> list:
+        """کلاینت‌هایی از لیست که (با همان UUID و ایمیل) روی پنل وجود دارند"""
+        snap = self.get_inbound_snapshot(inbound_id, fresh=True)
+        if not snap:
+            return []
+        return [c for c in clients if (snap.by_email.get(c['email']) or {}).get('id') == c['id']]
+
+    def add_clients_bulk(self, inbound_id: int, clients: list, chunk_size: int = BULK_CHUNK_SIZE) -> dict:
+        """
+        افزودن گروهی کلاینت‌ها (رکوردهای build_client) با کمترین تعداد درخواست.
+        خروجی: {email: True/False}
+        - اگر پنل یک دسته را رد کند (مثلاً ایمیل تکراری)، دسته نصف می‌شود تا
+          فقط کلاینت‌های مشکل‌دار ناموفق علامت بخورند.
+        - اگر نتیجه نامعلوم باشد (timeout/قطعی)، قبل از تلاش مجدد از روی پنل
+          بررسی می‌شود کدام کلاینت‌ها ساخته شده‌اند تا کلاینت تکراری ساخته نشود.
+        - کلاینتی که رد شده ولی با همان UUID و ایمیل روی پنل هست موفق حساب
+          می‌شود؛ پس فراخوانی دوباره با همان کلاینت‌ها (مثلاً ادامه یک job) امن است.
+        """
+        results = {}
+        pending = deque((chunk, 0) for chunk in chunked(list(clients), max(1, chunk_size)))
+        while pending:
+            chunk, attempt = pending.popleft()
+            res = self._request('POST', '/panel/api/inbounds/addClient', json=clients_payload(inbound_id, chunk))
+            self._invalidate_snapshot(inbound_id)
+            if res and res.get('success'):
+                results.update((c['email'], True) for c in chunk)
+                continue
+            if res is not None and len(chunk) > 1:
+                mid = len(chunk) // 2
+                pending.extendleft([(chunk[mid:], attempt), (chunk[:mid], attempt)])
+                continue
+            # نتیجه نامعلوم، یا رد شدن یک کلاینت (شاید همین کلاینت قبلاً ساخته شده باشد)
+            created = {c['email'] for c in self._created_clients(inbound_id, chunk)}
+            results.update((email, True) for email in created)
+            missing = [c for c in chunk if c['email'] not in created]
+            if not missing:
+                continue
+            if res is None and attempt < self.retries and not self._circuit_open():
+                time.sleep(backoff_delay(attempt))
+                pending.appendleft((missing, attempt + 1))
+            else:
+                results.update((c['email'], False) for c in missing)
+        return results
 
     def update_client(self, client_uuid: str, client_settings: dict):
         """
         ویرایش هوشمند کلاینت:
-        ۱. شناسه عددی را پیدا می‌کند.
-        ۲. اطلاعات فعلی را می‌گیرد.
-        ۳. تغییرات را ادغام می‌کند تا فیلدهای ضروری حذف نشوند.
+        ۱. شناسه عددی و اطلاعات فعلی را از ایندکس (یا یک درخواست ترافیک) می‌گیرد.
+        ۲. تغییرات را ادغام می‌کند تا فیلدهای ضروری حذف نشوند.
+        ۳. با ایندکس گرم فقط یک درخواست به پنل ارسال می‌شود.
         """
-        # 1. یافتن ID عددی
-        db_id = self._get_client_db_id(client_uuid)
+        # 1. یافتن ID عددی و اطلاعات فعلی
+        cached = self._client_index.get(client_uuid)
+        db_id, current_data = cached or self._lookup_client(client_uuid)
         if not db_id:
             logger.error(f"Cannot update client: UUID {client_uuid} not found.")
             return False
 
-        # 2. دریافت اطلاعات فعلی برای جلوگیری از حذف شدن فیلدهای مهم
-        current_data = self.get_client_traffic(client_uuid)
-        if not current_data:
-            # اگر نتوانستیم اطلاعات فعلی را بگیریم، یک قالب پیش‌فرض می‌سازیم
-            current_data = {
-                "id": client_uuid,
-                "flow": "",
-                "limitIp": 0,
-                "totalGB": 0,
-                "expiryTime": 0,
-                "enable": True,
-                "tgId": "",
-                "subId": ""
-            }
-
-        # 3. ادغام تنظیمات جدید با اطلاعات فعلی
-        current_data.update(client_settings)
-        
-        # اطمینان از اینکه فیلدهای حیاتی وجود دارند (پنل بدون اینها ارور می‌دهد)
-        if "limitIp" not in current_data: current_data["limitIp"] = 0
-        if "flow" not in current_data: current_data["flow"] = ""
-        if "totalGB" not in current_data: current_data["totalGB"] = 0
-        if "email" not in current_data: current_data["email"] = f"user_{db_id}"
+        # 2. ادغام تنظیمات جدید با اطلاعات فعلی
+        payload = merge_client_update(client_uuid, db_id, current_data, client_settings)
 
-        # 4. ارسال درخواست آپدیت
+        # 3. ارسال درخواست آپدیت
         endpoint = f'/panel/api/inbounds/updateClient/{db_id}'
-        res = self._request('POST', endpoint, json=current_data)
-        return res and res.get('success')
+        res = self._request('POST', endpoint, json=payload, retry=True)
+        self._invalidate_snapshot(current_data.get('inboundId') if current_data else None)
+        if res and res.get('success'):
+            self._remember_client(db_id, payload, client_uuid)
+            return True
+        if cached:
+            # شاید ایندکس کهنه باشد؛ یک بار با اطلاعات تازه تلاش می‌کنیم
+            self._forget_client(client_uuid)
+            return self.update_client(client_uuid, client_settings)
+        return False
+
+    def update_clients_on_inbound(self, inbound_id: int, updates: dict) -> dict:
+        """
+        ویرایش کلاینت‌های یک اینباند بر اساس ایمیل: {email: تغییرات} --> {email: True/False}.
+        UUID یک خرید روی چند اینباند مشترک است و update_client فقط اولین رکورد آن را
+        پیدا می‌کند؛ اینجا شناسه عددی رکورد همین اینباند از یک اسنپ‌شات تازه خوانده می‌شود.
+        """
+        snap = self.get_inbound_snapshot(inbound_id, fresh=True)
+        results = {}
+        for email, client_settings in updates.items():
+            current = snap.by_email.get(email) if snap else None
+            db_id = (snap.stats_by_email.get(email) or {}).get('id') if snap else None
+            if not current or not db_id:
+                results[email] = False
+                continue
+            payload = merge_client_update(current.get('id'), db_id, current, client_settings)
+            res = self._request('POST', f'/panel/api/inbounds/updateClient/{db_id}', json=payload, retry=True)
+            results[email] = bool(res and res.get('success'))
+        self._invalidate_snapshot(inbound_id)
+        return results
+
+    def delete_clients_on_inbound(self, inbound_id: int, emails: list) -> dict:
+        """حذف کلاینت‌های یک اینباند بر اساس ایمیل (مثل update_clients_on_inbound)؛ خروجی: {email: True/False}"""
+        snap = self.get_inbound_snapshot(inbound_id, fresh=True)
+        results = {}
+        for email in emails:
+            current = snap.by_email.get(email) if snap else None
+            db_id = (snap.stats_by_email.get(email) or {}).get('id') if snap else None
+            if not current or not db_id:
+                results[email] = False
+                continue
+            res = self._request('POST', f'/panel/api/inbounds/{inbound_id}/delClient/{db_id}')
+            results[email] = bool(res and res.get('success'))
+            if results[email]:
+                self._forget_client(current.get('id'))
+        self._invalidate_snapshot(inbound_id)
+        return results
 
     def delete_client(self, inbound_id: int, client_uuid: str):
-        db_id = self._get_client_db_id(client_uuid)
+        cached = self._client_index.get(client_uuid)
+        db_id, _ = cached or self._lookup_client(client_uuid)
         if not db_id:
             logger.error(f"Cannot delete client: UUID {client_uuid} not found.")
             return False
             
         endpoint = f'/panel/api/inbounds/{inbound_id}/delClient/{db_id}'
         res = self._request('POST', endpoint)
-        return res and res.get('success')
+        self._forget_client(client_uuid)
+        self._invalidate_snapshot(inbound_id)
+        if res and res.get('success'):
+            return True
+        if cached:
+            return self.delete_client(inbound_id, client_uuid)
+        return False
 
-    def get_client_info(self, inbound_id: int, uuid_or_email: str):
-        inbound = self.get_inbound(inbound_id)
-        if not inbound: return None
-        try:
-            clients = json.loads(inbound.get('settings', '{}')).get('clients', [])
-            for c in clients:
-                if c.get('id') == uuid_or_email or c.get('email') == uuid_or_email:
-                    return c
-        except: pass
-        return None
+    def get_client_info(self, inbound_id: int, uuid_or_email: str, fresh: bool = False):
+        snap = self.get_inbound_snapshot(inbound_id, fresh=fresh)
+        return snap.find(uuid_or_email) if snap else None
 
     # ==========================
     # 4. ترافیک
     # ==========================
     def get_client_traffic(self, uuid: str):
         res = self._request('GET', f'/panel/api/inbounds/getClientTrafficsById/{uuid}')
-        if res and res.get('success'):
-            data = res.get('obj')
-            if isinstance(data, list) and data:
-                return data[0]
-            elif isinstance(data, dict):
-                return data
-        return None
+        record = first_traffic_record(res)
+        if record and 'id' in record:
+            self._remember_client(record['id'], record, uuid)
+        return record
 
     def reset_client_traffic(self, inbound_id: int, email: str):
-        res = self._request('POST', f'/panel/api/inbounds/{inbound_id}/resetClientTraffic/{email}')
-        return res and res.get('success')
\ No newline at end of file
+        res = self._request('POST', f'/panel/api/inbounds/{inbound_id}/resetClientTraffic/{email}', retry=True)
+        self._invalidate_snapshot(inbound_id)
+        return res and res.get('success')
+
+
+# ==========================
+# رجیستری کلاینت‌ها (یک سشن مشترک برای هر سرور)
+# ==========================
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_xui_client(server) -> XUIClient:
+    """
+    کلاینت مشترک یک سرور (بر اساس Server.id) را برمی‌گرداند.
+    سشن HTTP و کوکی لاگین بین درخواست‌ها حفظ می‌شود؛ اگر اطلاعات ورود
+    سرور تغییر کرده باشد کلاینت جدید ساخته می‌شود.
+    """
+    creds = (server.panel_url.rstrip('/'), server.username, server.password)
+    with _clients_lock:
+        entry = _clients.get(server.id)
+        if entry and entry[0] == creds:
+            return entry[1]
+        client = XUIClient(*creds, breaker=get_breaker(server.id))
+        _clients[server.id] = (creds, client)
+    if entry:
+        entry[1].session.close()
+    return client
+
+def invalidate_xui_client(server_id: int):
+    """حذف کلاینت کش‌شده یک سرور (بعد از ویرایش یا حذف سرور)"""
+    with _clients_lock:
+        entry = _clients.pop(server_id, None)
+    if entry:
+        entry[1].session.close()
@@ -0,0 +1,456 @@
+# services/xui_async.py
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+import aiohttp
+
+from config import XUI_ASYNC_LIMIT, XUI_ASYNC_LIMIT_PER_HOST, XUI_ASYNC_KEEPALIVE, XUI_RETRIES
+from services.circuit_breaker import get_breaker
+from services.json_stream import aiter_json_array
+from services.xui import (
+    BULK_CHUNK_SIZE, InboundSnapshot, PanelError, PanelUnavailable, TTLCache, backoff_delay,
+    build_client, build_inbound_payload, chunked, clients_payload,
+    first_traffic_record, merge_client_update
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': 'application/json, text/plain, */*',
+    'Content-Type': 'application/json'
+}
+
+# ==========================
+# سشن HTTP مشترک (keep-alive + محدودیت اتصال برای هر هاست)
+# ==========================
+_http_session = None
+_http_session_loop = None
+
+def get_http_session() -> aiohttp.ClientSession:
+    """
+    یک ClientSession مشترک برای event loop جاری.
+    کوکی‌ها در این سشن نگه داشته نمی‌شوند؛ هر کلاینت کوکی پنل خودش را دارد
+    (چند پنل روی یک IP با پورت‌های مختلف کوکی همدیگر را خراب نکنند).
+    """
+    global _http_session, _http_session_loop
+    loop = asyncio.get_running_loop()
+    if _http_session is None or _http_session.closed or _http_session_loop is not loop:
+        connector = aiohttp.TCPConnector(
+            limit=XUI_ASYNC_LIMIT,
+            limit_per_host=XUI_ASYNC_LIMIT_PER_HOST,
+            keepalive_timeout=XUI_ASYNC_KEEPALIVE,
+            ssl=False
+        )
+        _http_session = aiohttp.ClientSession(
+            connector=connector,
+            headers=DEFAULT_HEADERS,
+            cookie_jar=aiohttp.DummyCookieJar()
+        )
+        _http_session_loop = loop
+    return _http_session
+
+async def close_http_session():
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+
+class AsyncXUIClient:
+    """نسخه asyncio از XUIClient با همان متدها"""
+
+    def __init__(self, panel_url: str, username: str, password: str, timeout: float = 30, index_ttl: float = 300, snapshot_ttl: float = 60, breaker=None, retries: int = XUI_RETRIES):
+        self.base_url = panel_url.rstrip('/')
+        self.retries = retries
+        self.breaker = breaker
+        self.username = username
+        self.password = password
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.is_logged_in = False
+        self._cookies = {}
+        self._login_gen = 0
+        self._login_lock = None
+        # ایندکس UUID/ایمیل --> (شناسه عددی پنل، آخرین رکورد کلاینت)
+        self._client_index = TTLCache(index_ttl)
+        # اسنپ‌شات اینباندها با ایندکس کلاینت‌ها (با TTL یا بعد از نوشتن خودمان تازه می‌شود)
+        self._snapshots = TTLCache(snapshot_ttl, maxsize=256)
+        self._snapshot_seq = itertools.count(1)
+
+    def _get_url(self, endpoint: str) -> str:
+        if not endpoint.startswith('/'):
+            endpoint = '/' + endpoint
+        return self.base_url + endpoint
+
+    def _cookie_header(self) -> dict:
+        if not self._cookies:
+            return {}
+        return {'Cookie': '; '.join(f"{k}={v}" for k, v in self._cookies.items())}
+
+    async def login(self) -> bool:
+        url = self._get_url('/login')
+        payload = {'username': self.username, 'password': self.password}
+        try:
+            status, data, cookies = await self._send('POST', url, json=payload, with_cookies=False)
+            if status == 200 and data and data.get('success'):
+                self._cookies = cookies
+                self.is_logged_in = True
+                self._login_gen += 1
+                return True
+            self.is_logged_in = False
+            return False
+        except Exception as e:
+            logger.error(f"Login Error: {e}")
+            return False
+
+    async def ensure_login(self) -> bool:
+        """فقط در صورت نبود سشن معتبر لاگین می‌کند"""
+        if self.is_logged_in:
+            return True
+        if self._login_lock is None:
+            self._login_lock = asyncio.Lock()
+        async with self._login_lock:
+            if self.is_logged_in:
+                return True
+            return await self.login()
+
+    async def _relogin(self, seen_gen: int) -> bool:
+        if self._login_lock is None:
+            self._login_lock = asyncio.Lock()
+        async with self._login_lock:
+            if self._login_gen != seen_gen and self.is_logged_in:
+                return True
+            self.is_logged_in = False
+            return await self.login()
+
+    async def _send(self, method: str, url: str, with_cookies: bool = True, **kwargs):
+        """ارسال خام درخواست با گزارش نتیجه و تاخیر به circuit breaker"""
+        if self.breaker and not self.breaker.allow():
+            raise PanelUnavailable(f"circuit open for {self.base_url}")
+        headers = self._cookie_header() if with_cookies else {}
+        start = time.monotonic()
+        try:
+            async with get_http_session().request(method, url, headers=headers, timeout=self.timeout, **kwargs) as response:
+                if response.status in [401, 403] or response.status >= 500:
+                    data = None
+                else:
+                    data = await response.json(content_type=None)
+                cookies = {k: m.value for k, m in response.cookies.items()}
+        except Exception:
+            if self.breaker: self.breaker.record(False, time.monotonic() - start)
+            raise
+        if self.breaker: self.breaker.record(response.status < 500, time.monotonic() - start)
+        return response.status, data, cookies
+
+    async def _request(self, method: str, endpoint: str, retry: bool = None, **kwargs):
+        """مثل XUIClient._request: تلاش مجدد با backoff فقط برای خطاهای گذرا"""
+        if retry is None:
+            retry = method == 'GET'
+        attempts = self.retries + 1 if retry else 1
+        for attempt in range(attempts):
+            if attempt:
+                await asyncio.sleep(backoff_delay(attempt - 1))
+            res, transient = await self._request_once(method, endpoint, **kwargs)
+            if not transient or self._circuit_open():
+                break
+        return res
+
+    def _circuit_open(self) -> bool:
+        return bool(self.breaker and self.breaker.is_open())
+
+    async def _request_once(self, method: str, endpoint: str, **kwargs):
+        if not await self.ensure_login(): return None, False
+
+        url = self._get_url(endpoint)
+        try:
+            seen_gen = self._login_gen
+            status, data, _ = await self._send(method, url, **kwargs)
+            if status in [401, 403]:
+                if await self._relogin(seen_gen):
+                    status, data, _ = await self._send(method, url, **kwargs)
+                else:
+                    return None, False
+            if status >= 500:
+                logger.warning(f"API Request Error ({endpoint}): HTTP {status}")
+                return None, True
+            return data, False
+        except PanelUnavailable as e:
+            logger.warning(f"API Request Skipped ({endpoint}): {e}")
+            return None, False
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"API Request Error ({endpoint}): {e}")
+            return None, True
+        except Exception as e:
+            logger.error(f"API Request Error ({endpoint}): {e}")
+            return None, False
+
+    # ==========================
+    # توابع کمکی هوشمند
+    # ==========================
+    async def _get_client_db_id(self, uuid: str):
+        """یافتن شناسه عددی کلاینت با UUID"""
+        db_id, _ = await self._lookup_client(uuid)
+        return db_id
+
+    async def _lookup_client(self, uuid: str):
+        entry = self._client_index.get(uuid)
+        if entry:
+            return entry
+        record = await self.get_client_traffic(uuid)
+        if record and 'id' in record:
+            return record['id'], record
+        return None, None
+
+    def _remember_client(self, db_id, record: dict, *keys):
+        entry = (db_id, record)
+        for key in keys + (record.get('email'),):
+            if key:
+                self._client_index.set(key, entry)
+
+    def _forget_client(self, uuid: str):
+        entry = self._client_index.pop(uuid)
+        if entry and entry[1].get('email'):
+            self._client_index.pop(entry[1]['email'])
+
+    def _store_snapshot(self, inbound: dict) -> InboundSnapshot:
+        snap = InboundSnapshot(inbound, next(self._snapshot_seq))
+        self._snapshots.set(snap.inbound_id, snap)
+        for uuid, db_id, record in snap.indexed_clients():
+            self._remember_client(db_id, record, uuid)
+        return snap
+
+    def _invalidate_snapshot(self, inbound_id=None):
+        """بعد از هر نوشتن، اسنپ‌شات اینباند (یا همه اگر نامعلوم باشد) کهنه می‌شود"""
+        if inbound_id is None:
+            self._snapshots.clear()
+        else:
+            self._snapshots.pop(inbound_id)
+
+    # ==========================
+    # 1. مدیریت سیستم
+    # ==========================
+    async def get_system_status(self):
+        return await self._request('POST', '/panel/api/inbounds/onlines', retry=True)
+
+    async def get_xray_version(self):
+        return await self._request('GET', '/server/status')
+
+    # ==========================
+    # 2. مدیریت اینباندها
+    # ==========================
+    async def get_inbounds(self):
+        return await self.fetch_inbounds() or []
+
+    async def iter_inbounds(self, chunk_size: int = 1 << 16):
+        """نسخه async و stream از get_inbounds (مثل XUIClient.iter_inbounds)"""
+        if not await self.ensure_login():
+            raise PanelError("login failed")
+        url = self._get_url('/panel/api/inbounds/list')
+        for attempt in range(2):
+            if self.breaker and not self.breaker.allow():
+                raise PanelUnavailable(f"circuit open for {self.base_url}")
+            seen_gen = self._login_gen
+            start = time.monotonic()
+            try:
+                async with get_http_session().get(url, headers=self._cookie_header(), timeout=self.timeout) as response:
+                    if self.breaker: self.breaker.record(response.status < 500, time.monotonic() - start)
+                    if response.status in [401, 403] and attempt == 0:
+                        pass  # بعد از بستن پاسخ، لاگین مجدد و تلاش دوباره
+                    elif response.status != 200:
+                        raise PanelError(f"HTTP {response.status}")
+                    else:
+                        async for item in aiter_json_array(response.content.iter_chunked(chunk_size), 'obj'):
+                            yield item
+                        return
+            except PanelError:
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                if self.breaker: self.breaker.record(False, time.monotonic() - start)
+                raise PanelError(f"inbounds/list: {e}") from e
+            if not await self._relogin(seen_gen):
+                raise PanelError("login failed")
+
+    async def fetch_inbounds(self):
+        res = await self._request('GET', '/panel/api/inbounds/list')
+        return (res.get('obj') or []) if res and res.get('success') else None
+
+    async def get_inbound(self, inbound_id: int):
+        res = await self._request('GET', f'/panel/api/inbounds/get/{inbound_id}')
+        inbound = res.get('obj') if res and res.get('success') else None
+        if inbound:
+            self._store_snapshot(inbound)
+        return inbound
+
+    async def get_inbound_snapshot(self, inbound_id: int, fresh: bool = False):
+        """اسنپ‌شات کش‌شده اینباند؛ fresh=True یعنی حتماً از پنل خوانده شود"""
+        snap = None if fresh else self._snapshots.get(inbound_id)
+        if snap:
+            return snap
+        res = await self._request('GET', f'/panel/api/inbounds/get/{inbound_id}')
+        inbound = res.get('obj') if res and res.get('success') else None
+        return self._store_snapshot(inbound) if inbound else None
+
+    async def add_inbound(self, remark: str, port: int, protocol: str, settings: dict, stream_settings: dict):
+        payload = build_inbound_payload(remark, port, protocol, settings, stream_settings)
+        res = await self._request('POST', '/panel/api/inbounds/add', json=payload)
+        return res and res.get('success')
+
+    async def update_inbound(self, inbound_id: int, data: dict):
+        res = await self._request('POST', f'/panel/api/inbounds/update/{inbound_id}', json=data, retry=True)
+        self._invalidate_snapshot(inbound_id)
+        return res and res.get('success')
+
+    async def delete_inbound(self, inbound_id: int):
+        res = await self._request('POST', f'/panel/api/inbounds/del/{inbound_id}')
+        self._invalidate_snapshot(inbound_id)
+        return res and res.get('success')
+
+    # ==========================
+    # 3. مدیریت کلاینت‌ها
+    # ==========================
+    async def add_client(self, inbound_id: int, email: str, uuid: str, sub_id: str, total_gb: float = 0, expiry_time: int = 0, enable: bool = True, limit_ip: int = 1, flow: str = ""):
+        client = build_client(email, uuid, sub_id, total_gb, expiry_time, enable, limit_ip, flow)
+        return (await self.add_clients_bulk(inbound_id, [client])).get(email, False)
+
+    async def _created_clients(self, inbound_id: int, clients: list) -> list:
+        snap = await self.get_inbound_snapshot(inbound_id, fresh=True)
+        if not snap:
+            return []
+        return [c for c in clients if (snap.by_email.get(c['email']) or {}).get('id') == c['id']]
+
+    async def add_clients_bulk(self, inbound_id: int, clients: list, chunk_size: int = BULK_CHUNK_SIZE) -> dict:
+        """معادل async متد XUIClient.add_clients_bulk"""
+        results = {}
+        pending = deque((chunk, 0) for chunk in chunked(list(clients), max(1, chunk_size)))
+        while pending:
+            chunk, attempt = pending.popleft()
+            res = await self._request('POST', '/panel/api/inbounds/addClient', json=clients_payload(inbound_id, chunk))
+            self._invalidate_snapshot(inbound_id)
+            if res and res.get('success'):
+                results.update((c['email'], True) for c in chunk)
+                continue
+            if res is not None and len(chunk) > 1:
+                mid = len(chunk) // 2
+                pending.extendleft([(chunk[mid:], attempt), (chunk[:mid], attempt)])
+                continue
+            created = {c['email'] for c in await self._created_clients(inbound_id, chunk)}
+            results.update((email, True) for email in created)
+            missing = [c for c in chunk if c['email'] not in created]
+            if not missing:
+                continue
+            if res is None and attempt < self.retries and not self._circuit_open():
+                await asyncio.sleep(backoff_delay(attempt))
+                pending.appendleft((missing, attempt + 1))
+            else:
+                results.update((c['email'], False) for c in missing)
+        return results
+
+    async def update_client(self, client_uuid: str, client_settings: dict):
+        cached = self._client_index.get(client_uuid)
+        db_id, current_data = cached or await self._lookup_client(client_uuid)
+        if not db_id:
+            logger.error(f"Cannot update client: UUID {client_uuid} not found.")
+            return False
+
+        payload = merge_client_update(client_uuid, db_id, current_data, client_settings)
+
+        endpoint = f'/panel/api/inbounds/updateClient/{db_id}'
+        res = await self._request('POST', endpoint, json=payload, retry=True)
+        self._invalidate_snapshot(current_data.get('inboundId') if current_data else None)
+        if res and res.get('success'):
+            self._remember_client(db_id, payload, client_uuid)
+            return True
+        if cached:
+            self._forget_client(client_uuid)
+            return await self.update_client(client_uuid, client_settings)
+        return False
+
+    async def update_clients_on_inbound(self, inbound_id: int, updates: dict) -> dict:
+        """معادل async متد XUIClient.update_clients_on_inbound"""
+        snap = await self.get_inbound_snapshot(inbound_id, fresh=True)
+        results = {}
+        for email, client_settings in updates.items():
+            current = snap.by_email.get(email) if snap else None
+            db_id = (snap.stats_by_email.get(email) or {}).get('id') if snap else None
+            if not current or not db_id:
+                results[email] = False
+                continue
+            payload = merge_client_update(current.get('id'), db_id, current, client_settings)
+            res = await self._request('POST', f'/panel/api/inbounds/updateClient/{db_id}', json=payload, retry=True)
+            results[email] = bool(res and res.get('success'))
+        self._invalidate_snapshot(inbound_id)
+        return results
+
+    async def delete_clients_on_inbound(self, inbound_id: int, emails: list) -> dict:
+        """معادل async متد XUIClient.delete_clients_on_inbound"""
+        snap = await self.get_inbound_snapshot(inbound_id, fresh=True)
+        results = {}
+        for email in emails:
+            current = snap.by_email.get(email) if snap else None
+            db_id = (snap.stats_by_email.get(email) or {}).get('id') if snap else None
+            if not current or not db_id:
+                results[email] = False
+                continue
+            res = await self._request('POST', f'/panel/api/inbounds/{inbound_id}/delClient/{db_id}')
+            results[email] = bool(res and res.get('success'))
+            if results[email]:
+                self._forget_client(current.get('id'))
+        self._invalidate_snapshot(inbound_id)
+        return results
+
+    async def delete_client(self, inbound_id: int, client_uuid: str):
+        cached = self._client_index.get(client_uuid)
+        db_id, _ = cached or await self._lookup_client(client_uuid)
+        if not db_id:
+            logger.error(f"Cannot delete client: UUID {client_uuid} not found.")
+            return False
+
+        endpoint = f'/panel/api/inbounds/{inbound_id}/delClient/{db_id}'
+        res = await self._request('POST', endpoint)
+        self._forget_client(client_uuid)
+        self._invalidate_snapshot(inbound_id)
+        if res and res.get('success'):
+            return True
+        if cached:
+            return await self.delete_client(inbound_id, client_uuid)
+        return False
+
+    async def get_client_info(self, inbound_id: int, uuid_or_email: str, fresh: bool = False):
+        snap = await self.get_inbound_snapshot(inbound_id, fresh=fresh)
+        return snap.find(uuid_or_email) if snap else None
+
+    # ==========================
+    # 4. ترافیک
+    # ==========================
+    async def get_client_traffic(self, uuid: str):
+        res = await self._request('GET', f'/panel/api/inbounds/getClientTrafficsById/{uuid}')
+        record = first_traffic_record(res)
+        if record and 'id' in record:
+            self._remember_client(record['id'], record, uuid)
+        return record
+
+    async def reset_client_traffic(self, inbound_id: int, email: str):
+        res = await self._request('POST', f'/panel/api/inbounds/{inbound_id}/resetClientTraffic/{email}', retry=True)
+        self._invalidate_snapshot(inbound_id)
+        return res and res.get('success')
+
+
+# ==========================
+# رجیستری کلاینت‌های async (یک کلاینت برای هر سرور)
+# ==========================
+_clients = {}
+
+def get_async_xui_client(server) -> AsyncXUIClient:
+    """معادل async تابع get_xui_client؛ کوکی لاگین هر سرور حفظ می‌شود"""
+    creds = (server.panel_url.rstrip('/'), server.username, server.password)
+    entry = _clients.get(server.id)
+    if entry and entry[0] == creds:
+        return entry[1]
+    client = AsyncXUIClient(*creds, breaker=get_breaker(server.id))
+    _clients[server.id] = (creds, client)
+    return client
+
+def invalidate_async_xui_client(server_id: int):
+    _clients.pop(server_id, None)
@@ -0,0 +1,135 @@
+# test_circuit_breaker.py
+"""ماشین حالت circuit breaker: closed -> open -> half_open -> closed/open"""
+import types
+
+import pytest
+
+from services import circuit_breaker
+from services.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = types.SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(circuit_breaker, "time", types.SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+
+def make(**kwargs):
+    options = dict(failures=3, error_rate=0.5, window=10, cooldown=30, slow_call=1.0)
+    options.update(kwargs)
+    return CircuitBreaker(**options)
+
+
+def trip(breaker):
+    for _ in range(breaker.failures):
+        breaker.record(False, 0.1)
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = make()
+    breaker.record(False, 0.1)
+    breaker.record(False, 0.1)
+    assert breaker.state == CLOSED and breaker.allow()
+    breaker.record(False, 0.1)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.health_score() == 0
+
+
+def test_success_resets_consecutive_count(clock):
+    breaker = make(window=100)
+    for _ in range(5):
+        breaker.record(False, 0.1)
+        breaker.record(False, 0.1)
+        breaker.record(True, 0.1)
+    assert breaker.state == CLOSED
+
+
+def test_opens_on_error_rate(clock):
+    breaker = make(failures=100)
+    for _ in range(5):
+        breaker.record(True, 0.1)
+        breaker.record(False, 0.1)
+    assert breaker.state == OPEN
+
+
+def test_error_rate_waits_for_half_window(clock):
+    breaker = make(failures=100)
+    breaker.record(True, 0.1)
+    breaker.record(False, 0.1)
+    breaker.record(False, 0.1)
+    assert breaker.state == CLOSED
+
+
+def test_slow_calls_count_toward_error_rate(clock):
+    breaker = make(failures=100)
+    for _ in range(4):
+        breaker.record(True, 0.1)
+    assert breaker.state == CLOSED
+    for _ in range(4):
+        breaker.record(True, 5.0)
+    assert breaker.state == OPEN
+
+
+def test_half_open_after_cooldown_allows_one_probe(clock):
+    breaker = make()
+    trip(breaker)
+    clock.value += 29
+    assert breaker.state == OPEN and not breaker.allow()
+    clock.value += 1
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()  # فقط یک درخواست آزمایشی هم‌زمان
+
+
+def test_successful_probe_closes(clock):
+    breaker = make()
+    trip(breaker)
+    clock.value += 30
+    assert breaker.allow()
+    breaker.record(True, 0.1)
+    assert breaker.state == CLOSED
+    assert breaker.allow() and breaker.allow()
+    # پنجره پاک شده و خطاهای قبلی دوباره breaker را باز نمی‌کنند
+    breaker.record(False, 0.1)
+    assert breaker.state == CLOSED
+
+
+@pytest.mark.parametrize("ok, latency", [(False, 0.1), (True, 5.0)])
+def test_failed_or_slow_probe_reopens(clock, ok, latency):
+    breaker = make()
+    trip(breaker)
+    clock.value += 30
+    assert breaker.allow()
+    breaker.record(ok, latency)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    # cooldown از لحظه باز شدن دوباره شمرده می‌شود
+    clock.value += 29
+    assert breaker.state == OPEN
+    clock.value += 1
+    assert breaker.state == HALF_OPEN
+
+
+def test_health_score(clock):
+    breaker = make()
+    assert breaker.health_score() == 100
+    for _ in range(4):
+        breaker.record(True, 0.0)
+    assert breaker.health_score() == 100
+    breaker.record(True, 5.0)
+    breaker.record(False, 0.0)
+    # یک خطا از ۶ و میانگین تاخیر 5/6 از slow_call
+    assert breaker.health_score() == round((5 / 6) * 100 * (1 - 0.5 * 5 / 6))
+    trip(breaker)
+    clock.value += 30
+    assert breaker.health_score() <= 25
+
+
+def test_registry_returns_one_breaker_per_key():
+    assert circuit_breaker.get_breaker("test-key") is circuit_breaker.get_breaker("test-key")
+    first = circuit_breaker.get_breaker("test-key")
+    circuit_breaker.reset_breaker("test-key")
+    assert circuit_breaker.get_breaker("test-key") is not first
+    circuit_breaker.reset_breaker("test-key")
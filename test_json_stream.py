@@ -0,0 +1,125 @@
+# test_json_stream.py
+"""پارسر افزایشی باید برای هر نحوه تکه‌شدن ورودی همان خروجی json.loads را بدهد"""
+import asyncio
+import json
+import random
+
+import pytest
+
+from services.json_stream import iter_json_array, aiter_json_array, iter_settings_clients
+
+ITEMS = [
+    {"id": 1, "remark": "ساده", "settings": json.dumps({"clients": [{"email": "a", "id": "u-1"}]})},
+    {"id": 2, "nested": {"a": [1, [2, {"b": []}]], "c": {}}, "empty": [], "none": None},
+    {"id": 3, "tricky": "brackets ] } [ { inside \"quotes\" and a backslash \\", "tail": "\\\"]"},
+    {"id": 4, "unicode": "سلام 🌐 é‌", "escaped": "\\u0041 \n\t \u0000"},
+    [1, 2, {"x": "array element"}],
+]
+DOC = {"success": True, "msg": "obj ] [ not a key", "obj": ITEMS, "after": [{"ignored": True}]}
+
+
+def encode(doc, **kwargs) -> bytes:
+    return json.dumps(doc, **kwargs).encode("utf-8")
+
+
+def chunked(data: bytes, sizes):
+    pos = 0
+    for size in sizes:
+        if pos >= len(data):
+            return
+        yield data[pos:pos + size]
+        pos += size
+    if pos < len(data):
+        yield data[pos:]
+
+
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+def test_matches_json_loads_whole(ensure_ascii):
+    data = encode(DOC, ensure_ascii=ensure_ascii)
+    assert list(iter_json_array([data], "obj")) == json.loads(data)["obj"]
+
+
+def test_every_split_point():
+    # همه نقاط برش ممکن، از جمله وسط escapeها و وسط کاراکترهای چندبایتی UTF-8
+    data = encode({"obj": ITEMS[2:4]}, ensure_ascii=False)
+    expected = ITEMS[2:4]
+    for cut in range(1, len(data)):
+        assert list(iter_json_array([data[:cut], data[cut:]], "obj")) == expected, cut
+
+
+def test_single_byte_chunks():
+    data = encode(DOC, ensure_ascii=False)
+    assert list(iter_json_array((data[i:i + 1] for i in range(len(data))), "obj")) == ITEMS
+
+
+def test_random_chunk_sizes():
+    rand = random.Random(7)
+    data = encode(DOC, ensure_ascii=False, indent=2)
+    for _ in range(50):
+        sizes = [rand.randint(1, 40) for _ in range(len(data))]
+        assert list(iter_json_array(chunked(data, sizes), "obj")) == ITEMS
+
+
+def test_str_chunks():
+    text = json.dumps(DOC, ensure_ascii=False)
+    assert list(iter_json_array([text[:17], text[17:]], "obj")) == ITEMS
+
+
+def test_key_only_matches_top_level():
+    doc = {"inner": {"obj": [{"wrong": 1}]}, "obj": [{"right": 1}]}
+    assert list(iter_json_array([encode(doc)], "obj")) == [{"right": 1}]
+
+
+def test_stops_after_array():
+    data = encode({"obj": [{"a": 1}]}) + b" trailing garbage that is never parsed {"
+    assert list(iter_json_array([data], "obj")) == [{"a": 1}]
+
+
+def test_truncated_raises():
+    data = encode(DOC)
+    cut = data.index(b'"id": 3')
+    stream = iter_json_array([data[:cut]], "obj")
+    assert next(stream) == ITEMS[0]
+    assert next(stream) == ITEMS[1]
+    with pytest.raises(ValueError, match="truncated"):
+        next(stream)
+
+
+def test_truncated_inside_string_raises():
+    data = encode({"obj": [{"a": "unterminated"}]})
+    with pytest.raises(ValueError, match="truncated"):
+        list(iter_json_array([data[:data.index(b"unterm") + 3]], "obj"))
+
+
+def test_missing_key_raises():
+    with pytest.raises(ValueError, match="not found"):
+        list(iter_json_array([encode({"success": False, "obj": None})], "obj"))
+
+
+def test_async_matches_sync():
+    data = encode(DOC, ensure_ascii=False)
+
+    async def chunks():
+        for i in range(0, len(data), 3):
+            yield data[i:i + 3]
+
+    async def collect():
+        return [item async for item in aiter_json_array(chunks(), "obj")]
+
+    assert asyncio.run(collect()) == ITEMS
+
+
+def test_settings_clients():
+    clients = [{"email": f"e{i}", "id": f"u-{i}", "note": "«}»"} for i in range(5)]
+    inbound = {"settings": json.dumps({"clients": clients, "decryption": "none"})}
+    assert list(iter_settings_clients(inbound, chunk_size=7)) == clients
+    # اینباند بدون کلاینت لیست خالی است
+    assert list(iter_settings_clients({})) == []
+    assert list(iter_settings_clients({"settings": '{"decryption": "none"}'})) == []
+    # settings ناقص خطا می‌دهد، نه یک لیست کوتاه‌تر
+    with pytest.raises(ValueError):
+        list(iter_settings_clients({"settings": '{"clients": [{"a"'}))
+    with pytest.raises(ValueError):
+        list(iter_settings_clients({"settings": json.dumps({"clients": clients})[:-3]}, chunk_size=7))
+    with pytest.raises(ValueError):
+        list(iter_settings_clients({"settings": '{"decryption": "no'}))
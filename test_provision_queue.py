@@ -0,0 +1,242 @@
+# test_provision_queue.py
+"""صف ساخت سرویس: برداشتن اتمی job، بازپس‌گیری بعد از lease، تلاش مجدد تا failed و ادامه با همان کلاینت"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, update
+
+from database.models import User, Server, Inbound, Plan, Payment, Purchase, ProvisionJob
+from handlers import payment_process
+from mock_panel import MockXUIPanel
+from services import provision_queue
+from services.circuit_breaker import reset_breaker
+from services.provision_queue import claim_job, enqueue_job, finish_job, PENDING, RUNNING, DONE, FAILED
+from services.xui_async import close_http_session, get_async_xui_client, invalidate_async_xui_client
+
+ADMIN_ID = 42
+
+
+@pytest.fixture
+def db(async_db, monkeypatch):
+    monkeypatch.setattr("services.xui_async.backoff_delay", lambda attempt, *a, **kw: 0)
+    monkeypatch.setattr(payment_process, "ADMIN_IDS", [ADMIN_ID])
+    return async_db(provision_queue, payment_process)
+
+
+class FakeBot:
+    def __init__(self):
+        self.messages = []
+        self.photos = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.messages.append((chat_id, text))
+
+    async def send_photo(self, chat_id, photo, caption=None, reply_markup=None, **kwargs):
+        buttons = [b.callback_data for row in reply_markup.keyboard for b in row] if reply_markup else []
+        self.photos.append((chat_id, caption, buttons))
+
+
+async def add_jobs(factory, count: int) -> list:
+    async with factory() as session:
+        user = User(telegram_id=1, first_name="t")
+        plan = Plan(name="p", price=1, volume_gb=1, duration_days=1)
+        session.add_all([user, plan])
+        await session.flush()
+        jobs = []
+        for _ in range(count):
+            payment = Payment(user_id=user.id, plan_id=plan.id, amount=1, status="processing")
+            session.add(payment)
+            await session.flush()
+            jobs.append(enqueue_job(session, payment.id))
+        await session.commit()
+        return [j.id for j in jobs]
+
+
+async def get_job(factory, job_id) -> ProvisionJob:
+    async with factory() as session:
+        return await session.get(ProvisionJob, job_id)
+
+
+# ==========================
+# claim_job / finish_job
+# ==========================
+def test_concurrent_claims_take_each_job_once(db):
+    async def go():
+        job_ids = await add_jobs(db, 3)
+        claimed = await asyncio.gather(*(claim_job() for _ in range(8)))
+        taken = [j for j in claimed if j is not None]
+        assert sorted(taken) == sorted(job_ids)
+        for job_id in job_ids:
+            job = await get_job(db, job_id)
+            assert (job.status, job.attempts) == (RUNNING, 1)
+            assert job.locked_at is not None
+
+    asyncio.run(go())
+
+
+def test_two_workers_race_for_one_job(db):
+    async def go():
+        [job_id] = await add_jobs(db, 1)
+        results = await asyncio.gather(claim_job(), claim_job())
+        assert sorted(results, key=str) == sorted([job_id, None], key=str)
+        assert (await get_job(db, job_id)).attempts == 1
+
+    asyncio.run(go())
+
+
+def test_future_job_is_not_claimed(db):
+    async def go():
+        [job_id] = await add_jobs(db, 1)
+        async with db() as session:
+            await session.execute(update(ProvisionJob).values(next_run_at=datetime.now() + timedelta(minutes=1)))
+            await session.commit()
+        assert await claim_job() is None
+
+    asyncio.run(go())
+
+
+def test_expired_lease_is_reclaimed(db):
+    async def go():
+        [job_id] = await add_jobs(db, 1)
+        assert await claim_job() == job_id
+        # worker هنوز در حال اجراست (lease معتبر)
+        assert await claim_job() is None
+        # worker مرده: lease منقضی شده و job دوباره برداشته می‌شود
+        stale = datetime.now() - timedelta(seconds=provision_queue.PROVISION_JOB_LEASE + 1)
+        async with db() as session:
+            await session.execute(update(ProvisionJob).values(locked_at=stale))
+            await session.commit()
+        results = await asyncio.gather(claim_job(), claim_job())
+        assert sorted(results, key=str) == sorted([job_id, None], key=str)
+        job = await get_job(db, job_id)
+        assert (job.status, job.attempts) == (RUNNING, 2)
+        assert job.locked_at > stale
+
+    asyncio.run(go())
+
+
+def test_finish_job_retries_then_fails(monkeypatch):
+    monkeypatch.setattr(provision_queue, "PROVISION_JOB_RETRIES", 3)
+    job = ProvisionJob(payment_id=1, status=RUNNING, attempts=0, locked_at=datetime.now())
+    for attempt in (1, 2):
+        job.attempts = attempt
+        before = datetime.now()
+        assert finish_job(job, error="boom") == PENDING
+        assert job.locked_at is None and job.last_error == "boom"
+        assert job.next_run_at >= before + timedelta(seconds=provision_queue.PROVISION_JOB_BACKOFF)
+    job.attempts = 3
+    assert finish_job(job, error="x" * 1000) == FAILED
+    assert len(job.last_error) == 500
+
+    ok = ProvisionJob(payment_id=1, status=RUNNING, attempts=1, last_error="old")
+    assert finish_job(ok, purchase_id=7) == DONE
+    assert (ok.purchase_id, ok.last_error) == (7, None)
+
+
+# ==========================
+# run_provision_job روی پنل شبیه‌سازی‌شده
+# ==========================
+async def seed_payment(factory, panel, inbounds: int = 2) -> tuple:
+    async with factory() as session:
+        user = User(telegram_id=777, first_name="buyer", username="b")
+        server = Server(name="mock", panel_url=panel.url, username=panel.username, password=panel.password,
+                        subscription_url="http://sub.local/sub")
+        session.add_all([user, server])
+        await session.flush()
+        reset_breaker(server.id)
+        invalidate_async_xui_client(server.id)
+        plan = Plan(name="plan", price=1000, volume_gb=10, duration_days=30,
+                    inbounds=[Inbound(server_id=server.id, xui_id=i, protocol="vless") for i in range(1, inbounds + 1)])
+        session.add(plan)
+        await session.flush()
+        payment = Payment(user_id=user.id, plan_id=plan.id, amount=1000, status="processing",
+                          receipt_image_id="photo-1", payment_method="card")
+        session.add(payment)
+        await session.flush()
+        enqueue_job(session, payment.id, notify_chat_id=ADMIN_ID)
+        await session.commit()
+        return payment.id, server.id
+
+
+async def run_next(bot, factory):
+    """یک اجرای worker: job را (بدون انتظار backoff) برمی‌دارد و اجرا می‌کند"""
+    async with factory() as session:
+        await session.execute(update(ProvisionJob).where(ProvisionJob.status == PENDING).values(next_run_at=datetime.now()))
+        await session.commit()
+    job_id = await claim_job()
+    assert job_id is not None
+    await payment_process.run_provision_job(bot, job_id)
+    return await get_job(factory, job_id)
+
+
+def test_job_resumes_with_stored_client(db):
+    with MockXUIPanel(inbounds=2) as panel:
+        bot = FakeBot()
+
+        async def go():
+            try:
+                payment_id, server_id = await seed_payment(db, panel)
+                async with db() as session:
+                    server = await session.get(Server, server_id)
+                assert await get_async_xui_client(server).login()
+                # کلاینت روی هر دو اینباند ساخته می‌شود ولی هیچ پاسخی برنمی‌گردد،
+                # پس اجرای اول شکست می‌خورد و job دوباره زمان‌بندی می‌شود
+                panel.lost_response_rate = 1.0
+                job = await run_next(bot, db)
+                assert job.status == PENDING and job.uuid and job.sub_id
+                for inbound_id in (1, 2):
+                    assert [c["id"] for c in panel.clients(inbound_id)] == [job.uuid]
+
+                panel.lost_response_rate = 0
+                reset_breaker(server_id)
+                invalidate_async_xui_client(server_id)
+                resumed = await run_next(bot, db)
+                assert resumed.status == DONE and resumed.attempts == 2
+                assert (resumed.uuid, resumed.sub_id) == (job.uuid, job.sub_id)
+
+                async with db() as session:
+                    purchase = await session.get(Purchase, resumed.purchase_id)
+                    payment = await session.get(Payment, payment_id)
+                assert purchase.uuid == job.uuid
+                assert purchase.sub_link.endswith("/" + job.sub_id)
+                assert payment.status == "approved"
+                return job.uuid
+            finally:
+                await close_http_session()
+
+        client_uuid = asyncio.run(go())
+        # اجرای دوم کلاینت موجود را پیدا کرده و دوباره نساخته است
+        for inbound_id in (1, 2):
+            assert [c["id"] for c in panel.clients(inbound_id)] == [client_uuid]
+        assert any("پرداخت تایید شد" in text for _, text in bot.messages)
+
+
+def test_job_fails_after_retries_and_resends_receipt(db, monkeypatch):
+    monkeypatch.setattr(provision_queue, "PROVISION_JOB_RETRIES", 2)
+    with MockXUIPanel(inbounds=1) as panel:
+        bot = FakeBot()
+
+        async def go():
+            try:
+                payment_id, _ = await seed_payment(db, panel, inbounds=1)
+                panel.fail_next(1000)
+                job = await run_next(bot, db)
+                assert job.status == PENDING and job.attempts == 1
+                assert bot.photos == []
+                job = await run_next(bot, db)
+                assert job.status == FAILED and job.attempts == 2
+                async with db() as session:
+                    assert (await session.get(Payment, payment_id)).status == "pending"
+                    assert (await session.scalar(select(Purchase.id))) is None
+                return payment_id
+            finally:
+                await close_http_session()
+
+        payment_id = asyncio.run(go())
+        # فیش با دکمه‌های تازه تایید/رد دوباره برای ادمین فرستاده شده است
+        [(chat_id, caption, buttons)] = bot.photos
+        assert chat_id == ADMIN_ID
+        assert buttons == [f"pay_approve_{payment_id}", f"pay_reject_{payment_id}"]
+        assert "ناموفق" in caption
+        assert any(chat == ADMIN_ID and f"#{payment_id}" in text for chat, text in bot.messages)
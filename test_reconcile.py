@@ -0,0 +1,187 @@
+# test_reconcile.py
+"""diff_server تابع خالص است: وضعیت دیتابیس + اسنپ‌شات پنل --> لیست اصلاحات"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import pytest
+
+from mock_panel import MockXUIPanel
+from services.reconcile import (diff_server, apply_fixes, is_bot_client, sub_id_from_link, _panel_clients,
+                                CREATE, DISABLE, DELETE)
+from services.xui import XUIClient, PanelError
+
+NOW = datetime(2026, 1, 1)
+SERVER_ID = 3
+
+# همان ستون‌های کوئری _expected_clients
+Row = namedtuple('Row', 'xui_id protocol id uuid sub_link expire_date is_active volume_gb limit_ip')
+
+
+def row(uuid, purchase_id, xui_id=1, active=True, expire_in=10, protocol="vless", sub="0123456789abcdef"):
+    expire = NOW + timedelta(days=expire_in) if expire_in is not None else None
+    return Row(xui_id, protocol, purchase_id, uuid, f"http://sub/{sub}", expire, active, 20, 2)
+
+
+def expected_of(*rows):
+    out = {}
+    for r in rows:
+        out.setdefault(r.xui_id, {})[r.uuid] = r
+    return out
+
+
+def panel_client(uuid, email, enable=True):
+    return {"id": uuid, "email": email, "enable": enable}
+
+
+def panel_of(**inbounds):
+    """panel_of(i1=[...]) --> {1: {uuid: client}}"""
+    return {int(k[1:]): {c["id"]: c for c in clients} for k, clients in inbounds.items()}
+
+
+def actions(fixes):
+    return {(f.action, f.xui_id, f.uuid) for f in fixes}
+
+
+def test_in_sync_has_no_fixes():
+    expected = expected_of(row("a", 1), row("b", 2, active=False))
+    panel = panel_of(i1=[panel_client("a", "u01234567"), panel_client("b", "u89abcdef", enable=False)])
+    assert diff_server(expected, panel, {"a", "b"}, SERVER_ID, now=NOW) == []
+
+
+def test_missing_active_purchase_is_created():
+    expected = expected_of(row("a", 1, sub="feedbeef00000000"), row("b", 2, expire_in=None))
+    panel = panel_of(i1=[panel_client("b", "u11111111")])
+    fixes = diff_server(expected, panel, {"a", "b"}, SERVER_ID, now=NOW)
+    assert actions(fixes) == {(CREATE, 1, "a")}
+    fix = fixes[0]
+    assert (fix.server_id, fix.purchase_id, fix.email) == (SERVER_ID, 1, "ufeedbeef")
+    assert fix.client["id"] == "a"
+    assert fix.client["subId"] == "feedbeef00000000"
+    assert fix.client["totalGB"] == 20 * 1024 ** 3
+    assert fix.client["expiryTime"] == int((NOW + timedelta(days=10)).timestamp() * 1000)
+    assert fix.client["limitIp"] == 2
+
+
+def test_create_email_avoids_taken_emails():
+    expected = expected_of(row("a", 1, xui_id=1), row("a", 1, xui_id=2, protocol="vless-reality"))
+    panel = panel_of(i1=[], i2=[])
+    fixes = sorted(diff_server(expected, panel, {"a"}, SERVER_ID, now=NOW), key=lambda f: f.xui_id)
+    # ایمیل در کل پنل یکتاست؛ دومی پسوند xui_id می‌گیرد
+    assert [f.email for f in fixes] == ["u01234567", "u01234567-2"]
+    assert fixes[1].client["flow"] == "xtls-rprx-vision"
+
+
+def test_expired_or_inactive_enabled_client_is_disabled():
+    expected = expected_of(row("old", 1, expire_in=-1), row("off", 2, active=False), row("done", 3, active=False))
+    panel = panel_of(i1=[
+        panel_client("old", "u00000001"),
+        panel_client("off", "u00000002"),
+        panel_client("done", "u00000003", enable=False),
+    ])
+    fixes = diff_server(expected, panel, {"old", "off", "done"}, SERVER_ID, now=NOW)
+    assert actions(fixes) == {(DISABLE, 1, "old"), (DISABLE, 1, "off")}
+    assert {f.purchase_id for f in fixes} == {1, 2}
+
+
+def test_expired_purchase_missing_on_panel_is_not_created():
+    expected = expected_of(row("old", 1, expire_in=-1))
+    assert diff_server(expected, panel_of(i1=[]), {"old"}, SERVER_ID, now=NOW) == []
+
+
+def test_orphan_bot_client_is_deleted():
+    panel = panel_of(i1=[panel_client("ghost", "uabcdef01"), panel_client("ghost2", "uabcdef01-4")])
+    fixes = diff_server({}, panel, set(), SERVER_ID, now=NOW)
+    assert actions(fixes) == {(DELETE, 1, "ghost"), (DELETE, 1, "ghost2")}
+    assert all(f.purchase_id is None and f.client is None for f in fixes)
+
+
+def test_hand_made_clients_are_not_orphans():
+    panel = panel_of(i1=[
+        panel_client("m1", "admin-phone"),
+        panel_client("m2", "u1234"),           # کوتاه‌تر از الگوی ربات
+        panel_client("m3", "uABCDEF01"),       # حروف بزرگ (ساب آیدی ربات hex کوچک است)
+        panel_client("m4", "uabcdef01-x"),
+        panel_client("m5", None),
+    ])
+    assert diff_server({}, panel, set(), SERVER_ID, now=NOW) == []
+
+
+def test_client_known_from_other_server_is_not_orphan():
+    # UUID خرید روی سرور دیگری ثبت است؛ known_uuids کل دیتابیس را پوشش می‌دهد
+    panel = panel_of(i1=[panel_client("elsewhere", "u0000abcd")])
+    assert diff_server({}, panel, {"elsewhere"}, SERVER_ID, now=NOW) == []
+
+
+def test_is_bot_client():
+    assert is_bot_client({"email": "u0123abcd"})
+    assert is_bot_client({"email": "u0123abcd-12"})
+    assert not is_bot_client({"email": "u0123abcd-"})
+    assert not is_bot_client({"email": "xu0123abcd"})
+    assert not is_bot_client({})
+
+
+def test_sub_id_from_link():
+    assert sub_id_from_link("http://sub.example/s/abcdef0123456789/", "x") == "abcdef0123456789"
+    assert sub_id_from_link(None, "01234567-89ab-cdef-0123-456789abcdef") == "0123456789abcdef"
+
+
+class StaticPanel:
+    def __init__(self, inbounds):
+        self.inbounds = inbounds
+
+    def iter_inbounds(self):
+        return iter(self.inbounds)
+
+
+def test_truncated_settings_is_a_panel_error():
+    good = {"id": 1, "settings": '{"clients": [{"id": "a", "email": "u01234567"}]}'}
+    cut = {"id": 2, "settings": '{"clients": [{"id": "b", "email": "u89abcdef"}, {"id"'}
+    assert _panel_clients(StaticPanel([good, cut]), {1}) == {1: {"a": {"id": "a", "email": "u01234567"}}}
+    # کلاینت‌های جاافتاده نباید create یا یتیم به نظر برسند؛ کل سرور گزارش خطا می‌گیرد
+    with pytest.raises(PanelError):
+        _panel_clients(StaticPanel([good, cut]), {1, 2})
+
+
+# ==========================
+# apply_fixes روی پنل شبیه‌سازی‌شده
+# ==========================
+def shared_uuid_panel():
+    """یک UUID روی دو اینباند با ایمیل‌های u…/u…-2 (همان قاعده ساخت سرویس)"""
+    panel = MockXUIPanel(inbounds=2).start()
+    client = XUIClient(panel.url, panel.username, panel.password)
+    assert client.login()
+    assert client.add_client(1, "uabcdef01", "shared", "abcdef0123456789")
+    assert client.add_client(2, "uabcdef01-2", "shared", "abcdef0123456789")
+    return panel, client
+
+
+def test_disable_reaches_every_inbound_of_a_uuid():
+    panel, client = shared_uuid_panel()
+    try:
+        expected = expected_of(row("shared", 1, xui_id=1, active=False), row("shared", 1, xui_id=2, active=False))
+        fixes = diff_server(expected, _panel_clients(client, {1, 2}), {"shared"}, SERVER_ID)
+        assert actions(fixes) == {(DISABLE, 1, "shared"), (DISABLE, 2, "shared")}
+
+        assert apply_fixes(client, fixes)[DISABLE] == 2
+        assert [c["enable"] for c in panel.clients(1) + panel.clients(2)] == [False, False]
+        # بقیه فیلدهای کلاینت حفظ می‌شوند
+        assert [c["id"] for c in panel.clients(1) + panel.clients(2)] == ["shared", "shared"]
+        # اجرای بعدی چیزی برای اصلاح ندارد
+        assert diff_server(expected, _panel_clients(client, {1, 2}), {"shared"}, SERVER_ID) == []
+    finally:
+        panel.stop()
+
+
+def test_delete_orphans_reaches_every_inbound_of_a_uuid():
+    panel, client = shared_uuid_panel()
+    try:
+        fixes = diff_server({}, _panel_clients(client, {1, 2}), set(), SERVER_ID)
+        assert actions(fixes) == {(DELETE, 1, "shared"), (DELETE, 2, "shared")}
+        # بدون delete_orphans چیزی حذف نمی‌شود
+        assert apply_fixes(client, fixes)[DELETE] == 0
+        assert len(panel.clients(1) + panel.clients(2)) == 2
+
+        assert apply_fixes(client, fixes, delete_orphans=True)[DELETE] == 2
+        assert panel.clients(1) == [] and panel.clients(2) == []
+    finally:
+        panel.stop()
@@ -0,0 +1,152 @@
+# test_state_store.py
+"""backendهای memory و db باید رفتار یکسان داشته باشند (انقضا، کپی بودن وضعیت، حذف)"""
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+from database.models import ConversationState
+from services import state_store
+from services.state_store import MemoryStateStore, DBStateStore, get_for_message, make_state_store
+
+
+def make_store(backend, async_db, ttl=60, scope="admin"):
+    if backend == "memory":
+        return MemoryStateStore(ttl=ttl)
+    async_db(state_store)
+    return DBStateStore(scope, ttl=ttl)
+
+
+@pytest.fixture(params=["memory", "db"])
+def backend(request):
+    return request.param
+
+
+def test_roundtrip_and_delete(backend, async_db):
+    store = make_store(backend, async_db)
+
+    async def go():
+        assert await store.get(1) is None
+        state = {"step": "server_name", "data": {"name": "س", "n": 2, "items": [1, None]}}
+        await store.set(1, state)
+        assert await store.get(1) == state
+        await store.set(1, {"step": "server_url", "data": {}})
+        assert (await store.get(1))["step"] == "server_url"
+        assert await store.get(2) is None
+        await store.delete(1)
+        assert await store.get(1) is None
+        await store.delete(1)  # حذف دوباره خطا نمی‌دهد
+
+    asyncio.run(go())
+
+
+def test_changes_need_set(backend, async_db):
+    store = make_store(backend, async_db)
+
+    async def go():
+        await store.set(1, {"step": "a", "data": {}})
+        state = await store.get(1)
+        state["step"] = "b"
+        state["data"]["x"] = 1
+        assert await store.get(1) == {"step": "a", "data": {}}
+
+    asyncio.run(go())
+
+
+def test_ttl_expiry(backend, async_db):
+    store = make_store(backend, async_db, ttl=0.2)
+
+    async def go():
+        await store.set(1, {"step": "a"})
+        assert await store.get(1) == {"step": "a"}
+        await asyncio.sleep(0.3)
+        assert await store.get(1) is None
+        # set دوباره مهلت را از نو شروع می‌کند
+        await store.set(1, {"step": "b"})
+        assert await store.get(1) == {"step": "b"}
+
+    asyncio.run(go())
+
+
+def test_memory_lru_eviction():
+    store = MemoryStateStore(ttl=60, maxsize=2)
+
+    async def go():
+        await store.set(1, {"n": 1})
+        await store.set(2, {"n": 2})
+        assert await store.get(1) == {"n": 1}  # 1 تازه‌ترین استفاده می‌شود
+        await store.set(3, {"n": 3})
+        assert await store.get(2) is None
+        assert await store.get(1) == {"n": 1}
+        assert await store.get(3) == {"n": 3}
+
+    asyncio.run(go())
+
+
+def test_db_scopes_are_independent(async_db):
+    async_db(state_store)
+    admin, user = DBStateStore("admin"), DBStateStore("user")
+
+    async def go():
+        await admin.set(1, {"who": "admin"})
+        await user.set(1, {"who": "user"})
+        assert await admin.get(1) == {"who": "admin"}
+        await user.delete(1)
+        assert await user.get(1) is None
+        assert await admin.get(1) == {"who": "admin"}
+
+    asyncio.run(go())
+
+
+def test_db_purges_expired_rows(async_db):
+    factory = async_db(state_store)
+    store = DBStateStore("admin", ttl=0.1)
+
+    async def rows():
+        async with factory() as session:
+            return (await session.scalars(select(ConversationState.chat_id))).all()
+
+    async def go():
+        await store.set(1, {})
+        await asyncio.sleep(0.2)
+        store._purge_at = 0
+        await store.set(2, {})
+        assert await rows() == [2]
+
+    asyncio.run(go())
+
+
+class Message:
+    def __init__(self, chat_id):
+        self.chat = type("Chat", (), {"id": chat_id})()
+
+
+def test_get_for_message_reads_once():
+    store = MemoryStateStore(ttl=60)
+    calls = []
+    real_get = store.get
+
+    async def counting_get(chat_id):
+        calls.append(chat_id)
+        return await real_get(chat_id)
+
+    store.get = counting_get
+    message, other = Message(5), Message(5)
+
+    async def go():
+        await store.set(5, {"step": "a"})
+        assert await get_for_message(store, message) == {"step": "a"}
+        assert await get_for_message(store, message) == {"step": "a"}
+        assert calls == [5]
+        # پیام بعدی دوباره از store می‌خواند
+        assert await get_for_message(store, other) == {"step": "a"}
+        assert calls == [5, 5]
+
+    asyncio.run(go())
+
+
+def test_make_state_store():
+    assert isinstance(make_state_store("admin", backend="memory"), MemoryStateStore)
+    assert make_state_store("admin", backend="db").scope == "admin"
+    with pytest.raises(ValueError):
+        make_state_store("admin", backend="redis")
@@ -0,0 +1,145 @@
+# test_traffic_sync.py
+"""همگام‌سازی ترافیک: جمع مصرف ایمیل‌های هر خرید روی اینباندها و upsert روی ClientUsage"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database.base import Base
+from database.models import User, Server, Inbound, Plan, Purchase, ClientUsage, ServerSyncState
+from mock_panel import MockXUIPanel
+from services import xui
+from services.circuit_breaker import reset_breaker
+from services.traffic_sync import collect_usage, sync_server_traffic
+from services.xui import XUIClient, invalidate_xui_client
+
+GB = 1024 ** 3
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(xui, "backoff_delay", lambda attempt, *a, **kw: 0)
+
+
+@pytest.fixture
+def session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+@pytest.fixture
+def panel():
+    with MockXUIPanel(inbounds=2) as panel:
+        yield panel
+
+
+def seed(session, panel) -> Server:
+    """
+    دو خرید روی هر دو اینباند (ایمیل‌های u…/u…-2 مثل create_service) و یک کلاینت
+    دستی روی پنل که به هیچ خریدی تعلق ندارد
+    """
+    user = User(telegram_id=1, first_name="t")
+    server = Server(name="mock", panel_url=panel.url, username=panel.username, password=panel.password,
+                    subscription_url="http://sub.local/sub")
+    session.add_all([user, server])
+    session.flush()
+    reset_breaker(server.id)
+    invalidate_xui_client(server.id)
+    plan = Plan(name="p", price=1, volume_gb=10, duration_days=30,
+                inbounds=[Inbound(server_id=server.id, xui_id=i, protocol="vless") for i in (1, 2)])
+    session.add_all([
+        Purchase(user_id=user.id, plan=plan, uuid="uuid-a", sub_link="http://sub/aaaa"),
+        Purchase(user_id=user.id, plan=plan, uuid="uuid-b", sub_link="http://sub/bbbb"),
+    ])
+    session.commit()
+
+    client = XUIClient(panel.url, panel.username, panel.password)
+    assert client.login()
+    for uuid, email in (("uuid-a", "uaaaaaaaa"), ("uuid-b", "ubbbbbbbb")):
+        assert client.add_client(1, email, uuid, email[1:], total_gb=10, expiry_time=1000)
+        assert client.add_client(2, f"{email}-2", uuid, email[1:], total_gb=10, expiry_time=1000)
+    assert client.add_client(1, "admin-phone", "uuid-manual", "manual")
+    return server
+
+
+def purchase_id(session, uuid) -> int:
+    return session.query(Purchase.id).filter_by(uuid=uuid).scalar()
+
+
+def usage(session, server) -> dict:
+    session.expire_all()
+    return {u.purchase_id: u for u in session.query(ClientUsage).filter_by(server_id=server.id)}
+
+
+def test_collect_usage_sums_and_takes_max():
+    inbounds = [
+        {"id": 1, "settings": '{"clients": [{"id": "a", "email": "ua"}, {"id": "x", "email": "manual"}]}',
+         "clientStats": [{"email": "ua", "up": 1, "down": 10, "total": 5, "expiryTime": 300, "enable": False},
+                         {"email": "manual", "up": 99, "down": 99}]},
+        {"id": 2, "settings": '{"clients": [{"id": "a", "email": "ua-2"}]}',
+         "clientStats": [{"email": "ua-2", "up": 2, "down": 20, "total": 7, "expiryTime": 200, "enable": True}]},
+    ]
+    [row] = collect_usage(inbounds, {"a": 11}, server_id=3)
+    assert (row["purchase_id"], row["server_id"]) == (11, 3)
+    assert (row["up"], row["down"]) == (3, 30)
+    assert (row["total"], row["expiry_time"]) == (7, 300)
+    assert row["enable"] is True
+
+
+def test_sync_writes_usage_per_purchase(session, panel):
+    server = seed(session, panel)
+    panel.set_traffic("uaaaaaaaa", up=100, down=1000)
+    panel.set_traffic("uaaaaaaaa-2", up=5, down=50, total=20 * GB, expiryTime=5000)
+    panel.set_traffic("ubbbbbbbb", up=7)
+    panel.set_traffic("admin-phone", up=1 << 40, down=1 << 40)
+
+    assert sync_server_traffic(session, server) == 2
+    rows = usage(session, server)
+    # کلاینت دستی پنل خریدی ندارد و ثبت نمی‌شود
+    assert set(rows) == {purchase_id(session, "uuid-a"), purchase_id(session, "uuid-b")}
+    a = rows[purchase_id(session, "uuid-a")]
+    assert (a.up, a.down) == (105, 1050)
+    assert (a.total, a.expiry_time) == (20 * GB, 5000)
+    b = rows[purchase_id(session, "uuid-b")]
+    assert (b.up, b.down, b.total, b.expiry_time) == (7, 0, 10 * GB, 1000)
+
+    state = session.get(ServerSyncState, server.id)
+    assert state.last_error is None and state.clients_synced == 2 and state.last_synced_at is not None
+
+
+def test_second_sync_updates_rows(session, panel):
+    server = seed(session, panel)
+    panel.set_traffic("uaaaaaaaa", up=1)
+    assert sync_server_traffic(session, server) == 2
+    first = usage(session, server)
+
+    panel.set_traffic("uaaaaaaaa", up=500)
+    panel.set_traffic("uaaaaaaaa-2", down=9)
+    assert sync_server_traffic(session, server) == 2
+    second = usage(session, server)
+    assert session.query(ClientUsage).count() == 2
+    a = second[purchase_id(session, "uuid-a")]
+    assert a.id == first[a.purchase_id].id
+    assert (a.up, a.down) == (500, 9)
+
+
+def test_panel_error_keeps_previous_usage(session, panel):
+    server = seed(session, panel)
+    panel.set_traffic("uaaaaaaaa", up=42)
+    assert sync_server_traffic(session, server) == 2
+    before = {pid: (u.up, u.down, u.updated_at) for pid, u in usage(session, server).items()}
+
+    panel.set_traffic("uaaaaaaaa", up=1000)
+    panel.fail_next(100)
+    assert sync_server_traffic(session, server) == 0
+    after = {pid: (u.up, u.down, u.updated_at) for pid, u in usage(session, server).items()}
+    assert after == before
+
+    state = session.get(ServerSyncState, server.id)
+    session.refresh(state)
+    assert state.last_error
+    # همگام‌سازی موفق قبلی پاک نمی‌شود
+    assert state.clients_synced == 2
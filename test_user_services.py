@@ -0,0 +1,75 @@
+# test_user_services.py
+"""تعداد کوئری‌های «سرویس‌های من» نباید با تعداد سرویس‌های کاربر زیاد شود"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from database.base import Base
+from database.models import User, Server, Inbound, Plan, Purchase, ClientUsage
+from database.queries import get_active_purchases, get_purchase_with_servers
+
+
+def make_session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    queries = []
+    event.listen(engine, "before_cursor_execute", lambda *args: queries.append(args[2]))
+    return sessionmaker(bind=engine)(), queries
+
+
+def seed(session, telegram_id, services):
+    user = User(telegram_id=telegram_id, first_name="t")
+    server = Server(name=f"s{telegram_id}", panel_url="http://p", username="a", password="a",
+                    subscription_url="http://sub", config_template="vless://UUID@h:443#EMAIL")
+    session.add_all([user, server])
+    session.flush()
+    for i in range(services):
+        inbounds = [Inbound(server_id=server.id, xui_id=i * 10 + n, protocol="vless") for n in range(3)]
+        plan = Plan(name=f"p{i}", price=1, volume_gb=10, duration_days=30, inbounds=inbounds)
+        purchase = Purchase(user_id=user.id, plan=plan, uuid=f"{telegram_id}-{i}", sub_link=f"http://sub/{i}",
+                            expire_date=None if i % 2 else datetime.now() + timedelta(days=10), is_active=True)
+        purchase.usages = [ClientUsage(server_id=server.id, up=1, down=2)]
+        session.add_all([plan, purchase])
+    # سرویس غیرفعال نباید برگردد
+    session.add(Purchase(user_id=user.id, uuid=f"{telegram_id}-off", is_active=False))
+    session.commit()
+
+
+def touch(purchases):
+    """دسترسی به همه رابطه‌هایی که هندلر استفاده می‌کند"""
+    for p in purchases:
+        p.plan.volume_gb
+        [(inb.protocol, inb.server.config_template) for inb in p.plan.inbounds]
+        sum(u.up + u.down for u in p.usages)
+
+
+def count_queries(services):
+    session, queries = make_session()
+    seed(session, 1000 + services, services)
+    session.expunge_all()
+    queries.clear()
+    purchases = get_active_purchases(session, 1000 + services)
+    touch(purchases)
+    session.close()
+    return len(purchases), len(queries)
+
+
+def test_active_purchases_constant_query_count():
+    found_one, q_one = count_queries(1)
+    found_many, q_many = count_queries(25)
+    assert (found_one, found_many) == (1, 25)
+    assert q_one == q_many
+    assert q_many <= 3
+
+
+def test_purchase_with_servers_loads_server_eagerly():
+    session, queries = make_session()
+    seed(session, 7, 1)
+    pid = session.query(Purchase.id).filter_by(is_active=True).scalar()
+    session.expunge_all()
+    queries.clear()
+    purchase = get_purchase_with_servers(session, pid)
+    assert purchase.plan.inbounds[0].server.config_template
+    assert len(queries) <= 2
+    session.close()
@@ -0,0 +1,68 @@
+# test_webhook.py
+"""webhook: بررسی secret و سقف آپدیت‌هایی که همزمان پردازش می‌شوند"""
+import asyncio
+import json
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from services.webhook import make_webhook_app, SECRET_HEADER
+
+PATH = "/hook"
+SECRET = "s3cret"
+
+
+class SlowBot:
+    """هر آپدیت تا باز شدن gate طول می‌کشد؛ بیشترین تعداد همزمان ثبت می‌شود"""
+
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.running = 0
+        self.peak = 0
+        self.done = []
+
+    async def process_new_updates(self, updates):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            await self.gate.wait()
+            self.done.extend(u.update_id for u in updates)
+        finally:
+            self.running -= 1
+
+
+def post(client, update_id, secret=SECRET):
+    return client.post(PATH, data=json.dumps({"update_id": update_id}), headers={SECRET_HEADER: secret})
+
+
+def test_secret_is_checked():
+    async def go():
+        async with TestClient(TestServer(make_webhook_app(SlowBot(), PATH, SECRET))) as client:
+            assert (await post(client, 1, secret="wrong")).status == 403
+            assert (await client.post(PATH, data=b"", headers={SECRET_HEADER: SECRET})).status == 400
+            assert (await client.post(PATH, data=b"{", headers={SECRET_HEADER: SECRET})).status == 400
+
+    asyncio.run(go())
+
+
+def test_concurrency_is_capped():
+    async def go():
+        bot = SlowBot()
+        async with TestClient(TestServer(make_webhook_app(bot, PATH, SECRET, concurrency=2))) as client:
+            first = [(await post(client, i)).status for i in (1, 2)]
+            assert first == [200, 200]
+            # جا پر است؛ پاسخ آپدیت سوم تا پایان یکی از قبلی‌ها برنمی‌گردد
+            third = asyncio.create_task(post(client, 3))
+            await asyncio.sleep(0.2)
+            assert not third.done()
+            assert bot.running == 2
+
+            bot.gate.set()
+            assert (await third).status == 200
+            for _ in range(50):
+                if len(bot.done) == 3:
+                    break
+                await asyncio.sleep(0.01)
+        assert sorted(bot.done) == [1, 2, 3]
+        assert bot.peak == 2
+
+    asyncio.run(go())
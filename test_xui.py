@@ -2,14 +2,15 @@
 import uuid
 import time
 import random
+import sys
 from services.xui import XUIClient
 from config import XUI_PANEL_URL, XUI_USERNAME, XUI_PASSWORD
 
-def run_full_test():
+def run_full_test(panel_url=XUI_PANEL_URL, username=XUI_USERNAME, password=XUI_PASSWORD):
     print("🚀 شروع تست جامع قابلیت‌های API پنل ثنایی...\n")
     
     # 1. تست اتصال
-    client = XUIClient(XUI_PANEL_URL, XUI_USERNAME, XUI_PASSWORD)
+    client = XUIClient(panel_url, username, password)
     if client.login():
         print("✅ [1/7] اتصال و لاگین موفقیت‌آمیز بود.")
     else:
@@ -45,7 +46,7 @@ def run_full_test():
     test_uuid = str(uuid.uuid4())
     print(f"\n⏳ [3/7] افزودن کلاینت تستی (Email: {test_email})...")
     
-    if client.add_client(inbound_id, test_email, test_uuid, total_gb=10, enable=True): # 10 GB
+    if client.add_client(inbound_id, test_email, test_uuid, sub_id=test_uuid[:16], total_gb=10, enable=True): # 10 GB
         print("✅ کلاینت با موفقیت اضافه شد.")
     else:
         print("❌ خطا در افزودن کلاینت.")
@@ -91,4 +92,11 @@ def run_full_test():
     print("\n🎉 تست تمام قابلیت‌ها با موفقیت به پایان رسید.")
 
 if __name__ == "__main__":
-    run_full_test()
\ No newline at end of file
+    # با --mock (یا بدون آدرس پنل در .env) تست روی پنل شبیه‌سازی‌شده اجرا می‌شود
+    if "--mock" in sys.argv or not XUI_PANEL_URL:
+        from mock_panel import MockXUIPanel
+        with MockXUIPanel() as panel:
+            run_full_test(panel.url, panel.username, panel.password)
+            print(f"📊 درخواست‌ها: {dict(panel.requests)}")
+    else:
+        run_full_test()
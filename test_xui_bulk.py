@@ -0,0 +1,171 @@
+# test_xui_bulk.py
+"""add_clients_bulk در برابر خطا و پاسخ گم‌شده نباید کلاینت تکراری بسازد یا کلاینتی را جا بیندازد"""
+import asyncio
+import uuid as uuidlib
+from collections import Counter
+
+import pytest
+
+from mock_panel import MockXUIPanel
+from services import xui
+from services.xui import XUIClient, build_client
+from services.xui_async import AsyncXUIClient, close_http_session
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(xui, "backoff_delay", lambda attempt, *a, **kw: 0)
+    monkeypatch.setattr("services.xui_async.backoff_delay", lambda attempt, *a, **kw: 0)
+
+
+def make_clients(count: int, prefix: str = "bulk") -> list:
+    return [build_client(f"{prefix}{i}", str(uuidlib.uuid4()), f"sub{i}") for i in range(count)]
+
+
+def assert_created_once(panel, inbound_id, clients):
+    on_panel = panel.clients(inbound_id)
+    counts = Counter(c["email"] for c in on_panel)
+    assert all(n == 1 for n in counts.values()), "duplicate emails on panel"
+    by_email = {c["email"]: c for c in on_panel}
+    for c in clients:
+        assert by_email[c["email"]]["id"] == c["id"]
+
+
+# ==========================
+# کلاینت sync
+# ==========================
+def sync_client(panel, retries=2):
+    client = XUIClient(panel.url, panel.username, panel.password, retries=retries)
+    assert client.login()
+    return client
+
+
+def test_bulk_single_request():
+    with MockXUIPanel() as panel:
+        client = sync_client(panel)
+        clients = make_clients(50)
+        panel.reset_counters()
+        results = client.add_clients_bulk(1, clients)
+        assert results == {c["email"]: True for c in clients}
+        assert panel.requests["/panel/api/inbounds/addClient"] == 1
+        assert_created_once(panel, 1, clients)
+
+
+def test_bulk_splits_rejected_batch():
+    with MockXUIPanel() as panel:
+        client = sync_client(panel)
+        existing = make_clients(1, prefix="dup")
+        assert client.add_clients_bulk(1, existing) == {"dup0": True}
+        clients = make_clients(7) + [build_client("dup0", str(uuidlib.uuid4()), "other")]
+        results = client.add_clients_bulk(1, clients)
+        assert results.pop("dup0") is False
+        assert results == {c["email"]: True for c in clients[:-1]}
+        # کلاینت قبلی دست نخورده باقی می‌ماند
+        assert_created_once(panel, 1, existing + clients[:-1])
+
+
+def test_bulk_retries_after_server_error():
+    with MockXUIPanel() as panel:
+        client = sync_client(panel)
+        clients = make_clients(10)
+        panel.fail_next(1)
+        results = client.add_clients_bulk(1, clients)
+        assert results == {c["email"]: True for c in clients}
+        assert_created_once(panel, 1, clients)
+
+
+def test_bulk_gives_up_after_retries():
+    with MockXUIPanel() as panel:
+        client = sync_client(panel, retries=1)
+        clients = make_clients(3)
+        # addClient، بررسی پنل، تلاش مجدد و بررسی نهایی (با تلاش‌های GET) همه خطا می‌گیرند
+        panel.fail_next(20)
+        results = client.add_clients_bulk(1, clients)
+        assert results == {c["email"]: False for c in clients}
+        assert panel.clients(1) == []
+
+
+def test_bulk_lost_responses_create_each_client_once():
+    with MockXUIPanel(lost_response_rate=0.3, seed=3) as panel:
+        client = XUIClient(panel.url, panel.username, panel.password, retries=10)
+        clients = make_clients(60)
+        results = client.add_clients_bulk(1, clients, chunk_size=7)
+        panel.lost_response_rate = 0
+        assert results == {c["email"]: True for c in clients}
+        assert_created_once(panel, 1, clients)
+        assert len(panel.clients(1)) == len(clients)
+
+
+def test_add_client_after_lost_response_is_idempotent():
+    with MockXUIPanel() as panel:
+        client = sync_client(panel)
+        uuid = str(uuidlib.uuid4())
+        panel.lost_response_rate = 1.0
+        # پاسخ addClient گم می‌شود؛ بررسی بعدی هم پاسخ نمی‌گیرد پس نتیجه نامعلوم است
+        assert client.add_client(1, "lost", uuid, "s") is False
+        panel.lost_response_rate = 0
+        assert [c["email"] for c in panel.clients(1)] == ["lost"]
+        # تلاش دوباره با همان UUID موفق حساب می‌شود و کلاینت دوم ساخته نمی‌شود
+        assert client.add_client(1, "lost", uuid, "s") is True
+        assert [c["email"] for c in panel.clients(1)] == ["lost"]
+
+
+# ==========================
+# کلاینت async
+# ==========================
+def run_async(panel, clients, retries=2, chunk_size=xui.BULK_CHUNK_SIZE):
+    async def go():
+        try:
+            client = AsyncXUIClient(panel.url, panel.username, panel.password, timeout=5, retries=retries)
+            return await client.add_clients_bulk(1, clients, chunk_size=chunk_size)
+        finally:
+            await close_http_session()
+    return asyncio.run(go())
+
+
+def test_async_bulk_splits_rejected_batch():
+    with MockXUIPanel() as panel:
+        existing = make_clients(1, prefix="dup")
+        assert run_async(panel, existing) == {"dup0": True}
+        clients = make_clients(5) + [build_client("dup0", str(uuidlib.uuid4()), "other")]
+        results = run_async(panel, clients)
+        assert results.pop("dup0") is False
+        assert results == {c["email"]: True for c in clients[:-1]}
+        assert_created_once(panel, 1, existing + clients[:-1])
+
+
+def test_async_bulk_retries_after_server_error():
+    with MockXUIPanel() as panel:
+        clients = make_clients(10)
+
+        async def go():
+            try:
+                client = AsyncXUIClient(panel.url, panel.username, panel.password, timeout=5)
+                assert await client.login()
+                # فقط درخواست addClient خطا می‌گیرد، نه لاگین
+                panel.fail_next(1)
+                return await client.add_clients_bulk(1, clients)
+            finally:
+                await close_http_session()
+        results = asyncio.run(go())
+        assert results == {c["email"]: True for c in clients}
+        assert_created_once(panel, 1, clients)
+
+
+def test_async_bulk_lost_responses_create_each_client_once():
+    with MockXUIPanel(lost_response_rate=0.3, seed=5) as panel:
+        clients = make_clients(60)
+        results = run_async(panel, clients, retries=10, chunk_size=7)
+        panel.lost_response_rate = 0
+        assert results == {c["email"]: True for c in clients}
+        assert_created_once(panel, 1, clients)
+        assert len(panel.clients(1)) == len(clients)
+
+
+def test_async_readd_same_clients_is_idempotent():
+    with MockXUIPanel() as panel:
+        clients = make_clients(4)
+        assert run_async(panel, clients) == {c["email"]: True for c in clients}
+        assert run_async(panel, clients) == {c["email"]: True for c in clients}
+        assert_created_once(panel, 1, clients)
+        assert len(panel.clients(1)) == len(clients)